@@ -1,11 +1,11 @@
-import os
-import joblib
 import numpy as np
-import pandas as pd
-import tensorflow as tf
 from collections import deque
 from command import Command
-from buttons import Buttons
+from buttons import MASKS, Buttons
+from decision_cache import CACHE_SIZE, QUANTUM, DecisionCache
+from fast_inference import FrameRing
+from model_registry import load_model, model_path as default_model_path
+import telemetry
 
 #define constants the same way as done when training
 WINDOW_SIZE = 6
@@ -18,19 +18,64 @@ for t in range(WINDOW_SIZE-1, -1, -1):
         FEATURE_COLS.append(feat + suffix)
 BUTTONS = ['UP', 'DOWN', 'RIGHT', 'LEFT', 'Y', 'B', 'X', 'A', 'L', 'R']
 P1_BUTTON_COLS = [f'player1_buttons_{b}' for b in BUTTONS]
+FIGHT_MAP = {'NOT_OVER': 0, 'P1': 1, 'P2': 2}
+#a button is pressed when its probability is above this, after opposing directions are resolved
+PRESS_THRESHOLD = 0.005
+_UP, _DOWN, _RIGHT, _LEFT = (BUTTONS.index(b) for b in ('UP', 'DOWN', 'RIGHT', 'LEFT'))
+#Buttons bit of each entry in BUTTONS, to turn a decided row into a button mask with one dot product
+_BUTTON_MASKS = np.array([MASKS[b if len(b) == 1 else b.lower()] for b in BUTTONS], dtype=np.int64)
+#'keras' runs scaler.transform + model.predict, 'numpy' runs the exported weights with the scaler folded in,
+#'npz' runs the same forward pass from a model_<id>.npz artifact without importing tensorflow, sklearn or pandas,
+#'int8' and 'fp16' run the quantized model_<id>.int8.npz / model_<id>.fp16.npz variants from quantize_models.py
+BACKENDS = ('keras', 'numpy', 'npz', 'int8', 'fp16')
+NUMPY_BACKENDS = ('numpy', 'npz', 'int8', 'fp16')
+#features the decision cache rounds to SF_DECISION_QUANTUM, every other feature is keyed exactly
+QUANTIZED_FEATURES = ('p1_x', 'p1_y', 'p2_x', 'p2_y', 'diff_x', 'diff_y')
+
+def quantization_steps(quantum):
+    #per-feature steps over the whole window for DecisionCache, None when quantum is 0
+    if not quantum:
+        return None
+    return np.tile([quantum if feat in QUANTIZED_FEATURES else 0.0 for feat in STATE_FEATURES], WINDOW_SIZE)
+
+def resolve_buttons(preds, threshold=PRESS_THRESHOLD):
+    #(n, len(BUTTONS)) probabilities -> (n, len(BUTTONS)) pressed, shared by decide and the offline evaluation
+    #of LEFT/RIGHT and of UP/DOWN only the stronger stays when both are non-zero (a tie keeps RIGHT and DOWN)
+    probs = np.array(preds, dtype=np.float64, ndmin=2)
+    for a, b in ((_LEFT, _RIGHT), (_UP, _DOWN)):
+        both = (probs[:, a] != 0) & (probs[:, b] != 0)
+        a_wins = probs[:, a] > probs[:, b]
+        probs[both & a_wins, b] = 0.0
+        probs[both & ~a_wins, a] = 0.0
+    return probs > threshold
 
 class Bot:
-    def __init__(self,player_id=0, model_path=None):
+    #loaded is a LoadedModel from model_registry, otherwise the model is loaded here (cold)
+    #cache_size and quantum configure the decision cache (see decision_cache.py), cache_size=0 disables it
+    def __init__(self,player_id=0, model_path=None, backend='keras', loaded=None, cache_size=CACHE_SIZE, quantum=QUANTUM):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        self.backend = backend
+        self.character_id = player_id
         self.buttons = Buttons()
         self.cmd = Command()
-        # locate model & scaler
-        if model_path is None:
-            base = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models'))
-            model_path = os.path.join(base, 'model_'+f'{player_id}' +'.keras')
-        #load model and scaler
-        self.model = tf.keras.models.load_model(model_path)
-        scaler_path = model_path + '.scaler'
-        self.scaler = joblib.load(scaler_path)
+        if loaded is None:
+            # locate and load model & scaler
+            if model_path is None:
+                model_path = default_model_path(player_id, backend=backend)
+            loaded = load_model(model_path, backend, player_id, warm=False)
+        elif backend in NUMPY_BACKENDS and loaded.mlp is None:
+            raise ValueError(f"{backend} backend needs a model loaded with backend='{backend}'")
+        self.model = loaded.model
+        self.scaler = loaded.scaler
+        #repeated windows skip inference; the cache lives with the loaded model, so bots of the same model share it
+        #and a reloaded model starts with an empty one
+        self.cache = None
+        if cache_size:
+            steps = quantization_steps(quantum)
+            if loaded.cache is None or not loaded.cache.matches(cache_size, steps):
+                loaded.cache = DecisionCache(cache_size, steps)
+            self.cache = loaded.cache
 
         # init frame buffer
         self.buffer = deque(maxlen=WINDOW_SIZE)
@@ -39,6 +84,11 @@ class Bot:
         for _ in range(WINDOW_SIZE):
             self.buffer.append(empty.copy())
 
+        #numpy backend keeps the window as a float32 ring and never touches pandas or keras per frame
+        if backend in NUMPY_BACKENDS:
+            self.mlp = loaded.mlp
+            self.ring = FrameRing(WINDOW_SIZE, len(STATE_FEATURES))
+
     def _frame_to_dict(self, gs):
         # map GameState to raw feature dict (no suffix)
         p1, p2 = gs.player1, gs.player2
@@ -69,70 +119,117 @@ class Bot:
         }
         return d
 
-    def fight(self, gs, player_id):
+    def _fill_row(self, row, gs):
+        #same feature order and encoding as _frame_to_dict, written straight into the ring
+        p1, p2 = gs.player1, gs.player2
+        row[:] = (
+            gs.timer, FIGHT_MAP[gs.fight_result], gs.has_round_started, gs.is_round_over,
+            p1.player_id, p1.health, p1.x_coord, p1.y_coord,
+            p1.is_jumping, p1.is_crouching, p1.is_player_in_move, p1.move_id,
+            p2.player_id, p2.health, p2.x_coord, p2.y_coord,
+            p2.is_jumping, p2.is_crouching, p2.is_player_in_move, p2.move_id,
+            p1.x_coord - p2.x_coord, p1.y_coord - p2.y_coord, p1.health - p2.health,
+        )
+
+    def window(self, gs):
+        #appends the frame for gs and returns the raw (1, n_features) window ending at it
+        #numpy backends return a view of the ring, valid until the next frame
+        if self.backend in NUMPY_BACKENDS:
+            with telemetry.timed('features'):
+                self._fill_row(self.ring.next_row(), gs)
+                self.ring.commit()
+                return self.ring.window()
+
         # 1. append new frame
-        # print("[Bot] Incoming GameState raw data:", gs.__dict__)
-        raw = self._frame_to_dict(gs)
-        # print("[Bot] Mapped frame:", raw)
-        self.buffer.append(raw)
-        # print("[Bot] Buffer contents:", list(self.buffer))
-
-        # 2. build flattened feature list
-        flat = []
-        FIGHT_MAP = {'NOT_OVER': 0, 'P1': 1, 'P2': 2}
-        for t in range(WINDOW_SIZE-1, -1, -1):
-            frame = self.buffer[WINDOW_SIZE-1 - t]
-            for feat in STATE_FEATURES:
-                val = frame[feat]
-                if feat == 'fight_result':
-                    flat.append(FIGHT_MAP[val])
-                else:
-                    flat.append(int(val))
+        with telemetry.timed('features'):
+            # print("[Bot] Incoming GameState raw data:", gs.__dict__)
+            raw = self._frame_to_dict(gs)
+            # print("[Bot] Mapped frame:", raw)
+            self.buffer.append(raw)
+            # print("[Bot] Buffer contents:", list(self.buffer))
 
+            # 2. build flattened feature list
+            flat = []
+            for t in range(WINDOW_SIZE-1, -1, -1):
+                frame = self.buffer[WINDOW_SIZE-1 - t]
+                for feat in STATE_FEATURES:
+                    val = frame[feat]
+                    if feat == 'fight_result':
+                        flat.append(FIGHT_MAP[val])
+                    else:
+                        flat.append(int(val))
+            return np.array([flat], dtype=np.float64)
+
+    def model_input(self, window):
+        #numpy backends take the raw window, their scaling is folded into the first layer
+        if self.backend in NUMPY_BACKENDS:
+            return window
         # 3. create DataFrame then scale
-        df_feat = pd.DataFrame([flat], columns=FEATURE_COLS)
-        X_scaled = self.scaler.transform(df_feat)
-        # print(X_scaled)
+        with telemetry.timed('scaling'):
+            #imported here so the numpy backends never load pandas
+            import pandas as pd
+            df_feat = pd.DataFrame(window, columns=FEATURE_COLS)
+            return self.scaler.transform(df_feat)
+
+    def prepare(self, gs):
+        #appends the frame for gs and returns the (1, n_features) model input for the window ending at it
+        return self.model_input(self.window(gs))
 
-        # 4. predict
-        preds = self.model.predict(X_scaled, verbose=0)[0]
+    def lookup(self, window):
+        #(key, cached probabilities or None) for a window, (None, None) without a cache
+        if self.cache is None:
+            return None, None
+        with telemetry.timed('cache'):
+            key = self.cache.key(window)
+            return key, self.cache.get(key)
+
+    def remember(self, key, preds):
+        if key is not None:
+            self.cache.put(key, preds)
+
+    def predict_rows(self, x):
+        #button probabilities for a batch of prepare() outputs, rows may come from several bots sharing this model
+        with telemetry.timed('inference'):
+            if self.backend in NUMPY_BACKENDS:
+                return self.mlp.predict(x)
+            return self.model.predict(x, verbose=0)
+
+    def predict_buttons(self, gs):
+        #returns the sigmoid probability of each entry in BUTTONS for the window ending at gs
+        window = self.window(gs)
+        key, preds = self.lookup(window)
+        if preds is None:
+            preds = self.predict_rows(self.model_input(window))[0]
+            self.remember(key, preds)
+        return preds
+
+    def fight(self, gs, player_id):
+        return self.decide(self.predict_buttons(gs), player_id)
+
+    def decide(self, preds, player_id):
+        #turns the probabilities of one window into the command for player_id
         # print("Current Predictions: ", preds)
-        print("\nPrediction probabilities for each button:")
-        for button, prob in zip(BUTTONS, preds):
-            if prob > 0.005:  # Only show buttons with >0.5% probability
-                print(f"{button}: {prob:.2%}")
-
-        # 5. map to Buttons
-        # btn_map = {b: bool(preds[i] > 0.25) for i, b in enumerate(BUTTONS)}
-        # print("Mapped Buttons: ", btn_map)
-        # 5. map to Buttons, but resolve opposing directions:
-        probs = {b: float(preds[i]) for i, b in enumerate(BUTTONS)}
-        #remove pairs that cancel each other out
-        if probs['LEFT'] and probs['RIGHT']:
-            # pick the stronger
-            if probs['LEFT'] > probs['RIGHT']:
-                probs['RIGHT'] = 0.0
-            else:
-                probs['LEFT'] = 0.0
-        if probs['UP'] and probs['DOWN']:
-            if probs['UP'] > probs['DOWN']:
-                probs['DOWN'] = 0.0
-            else:
-                probs['UP'] = 0.0
-
-        #final button map
-        btn_map = {b: (probs[b] > 0.005) for b in BUTTONS}
-        
+        if telemetry.DEBUG:
+            telemetry.debug("\nPrediction probabilities for each button:")
+            for button, prob in zip(BUTTONS, preds):
+                if prob > PRESS_THRESHOLD:
+                    telemetry.debug(f"{button}: {prob:.2%}")
+
+        #map to Buttons, resolving opposing directions the same way as the offline evaluation
+        pressed = resolve_buttons(preds)[0]
+        bits = int(pressed @ _BUTTON_MASKS)
+
         cmd = Command()
         if player_id == "1":
-            cmd.player_buttons = Buttons(btn_map)
-            print("[Bot Debug] Button map:", btn_map)
-            print("[Bot Debug] Command buttons state:", cmd.player_buttons.__dict__)
+            cmd.player_buttons = Buttons.from_bits(bits)
+            if telemetry.DEBUG:
+                telemetry.debug("[Bot Debug] Command buttons state: %s", cmd.player_buttons.object_to_dict())
         else:
-            cmd.player2_buttons = Buttons(btn_map)
+            cmd.player2_buttons = Buttons.from_bits(bits)
         
         # print(f"[Bot] Sending command with predictions: {cmd.object_to_dict()}")
-        active_buttons = [btn for btn, state in btn_map.items() if state]
-        print(f"\nActive buttons for Player {player_id}:", ", ".join(active_buttons) if active_buttons else "None")
+        if telemetry.DEBUG:
+            active_buttons = [btn for btn, state in zip(BUTTONS, pressed) if state]
+            telemetry.debug(f"\nActive buttons for Player {player_id}: " + (", ".join(active_buttons) if active_buttons else "None"))
 
         return cmd
\ No newline at end of file
@@ -1,58 +1,66 @@
+import telemetry
+
+#the 12 SNES buttons as bits of one int, attribute names as before (up ... start lowercase, face and shoulder buttons uppercase)
+NAMES = ('up', 'down', 'right', 'left', 'select', 'start', 'Y', 'B', 'X', 'A', 'L', 'R')
+#keys of the emulator json, in the same order
+WIRE_KEYS = ('Up', 'Down', 'Right', 'Left', 'Select', 'Start', 'Y', 'B', 'X', 'A', 'L', 'R')
+MASKS = {name: 1 << i for i, name in enumerate(NAMES)}
+N_COMBINATIONS = 1 << len(NAMES)
+#incoming keys are matched case-insensitively, the usual spellings are looked up without lowercasing
+_MASK_BY_KEY = {}
+for _i, _name in enumerate(NAMES):
+    for _key in (_name, _name.lower(), _name.upper(), WIRE_KEYS[_i]):
+        _MASK_BY_KEY[_key] = 1 << _i
+
 class Buttons:
+    __slots__ = ('bits',)
+
     def __init__(self, buttons_dict=None):
+        self.bits = 0
         if buttons_dict is not None:
             self.dict_to_object(buttons_dict)
-        else:
-            self.init_buttons()
+
+    @classmethod
+    def from_bits(cls, bits):
+        b = cls()
+        b.bits = bits
+        return b
 
     def init_buttons(self):
-        self.up = False
-        self.down = False
-        self.right = False
-        self.left = False
-        self.select = False
-        self.start = False
-        self.Y = False
-        self.B = False
-        self.X = False
-        self.A = False
-        self.L = False
-        self.R = False
+        self.bits = 0
 
     def dict_to_object(self, buttons_dict):
-        print("[Buttons Debug] Received dict:", buttons_dict)
-        #normalize incoming keys to uppercase and handle multiple case formats
-        bd = {}
+        #fills this object in place; keys in any case, unknown keys are ignored and a key repeated in another case wins if later
+        if telemetry.DEBUG:
+            telemetry.debug("[Buttons Debug] Received dict: %s", buttons_dict)
+        bits = 0
         for k, v in buttons_dict.items():
-            key = k.lower()
-            bd[key] = v
-    
-        #set button states using lowercase attributes
-        self.up = bd.get('up', False)
-        self.down = bd.get('down', False)
-        self.right = bd.get('right', False)
-        self.left = bd.get('left', False)
-        self.select = bd.get('select', False)
-        self.start = bd.get('start', False)
-        self.Y = bd.get('y', False)
-        self.B = bd.get('b', False)
-        self.X = bd.get('x', False)
-        self.A = bd.get('a', False)
-        self.L = bd.get('l', False)
-        self.R = bd.get('r', False)
+            mask = _MASK_BY_KEY.get(k) or _MASK_BY_KEY.get(k.lower(), 0)
+            if v:
+                bits |= mask
+            else:
+                bits &= ~mask
+        self.bits = bits
 
     def object_to_dict(self):
-        return {
-        'Up': self.up,
-        'Down': self.down,
-        'Right': self.right,
-        'Left': self.left,
-        'Select': self.select,
-        'Start': self.start,
-        'Y': self.Y,
-        'B': self.B,
-        'X': self.X,
-        'A': self.A,
-        'L': self.L,
-        'R': self.R
-    }
\ No newline at end of file
+        bits = self.bits
+        return {key: bool(bits >> i & 1) for i, key in enumerate(WIRE_KEYS)}
+
+    def __eq__(self, other):
+        return isinstance(other, Buttons) and other.bits == self.bits
+
+    def __hash__(self):
+        return self.bits
+
+    def __repr__(self):
+        return f"Buttons({'+'.join(n for n in NAMES if self.bits & MASKS[n]) or 'none'})"
+
+def _button_property(mask):
+    def get(self):
+        return bool(self.bits & mask)
+    def set(self, pressed):
+        self.bits = self.bits | mask if pressed else self.bits & ~mask
+    return property(get, set)
+
+for _name, _mask in MASKS.items():
+    setattr(Buttons, _name, _button_property(_mask))
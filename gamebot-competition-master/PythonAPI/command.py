@@ -1,6 +1,20 @@
-from buttons import Buttons
+import json
+from buttons import N_COMBINATIONS, Buttons
+
+#encode() serves the wire bytes from per-player fragments for all 2^12 button combinations, built on first use
+#the result is byte-identical to json.dumps(cmd.object_to_dict()).encode()
+_fragments = None
+#the fields after the buttons, per (type, player_count, savegamepath); in practice only the defaults
+_tails = {}
+
+def _button_fragments():
+    global _fragments
+    if _fragments is None:
+        _fragments = [json.dumps(Buttons.from_bits(bits).object_to_dict()).encode() for bits in range(N_COMBINATIONS)]
+    return _fragments
 
 class Command:
+    __slots__ = ('player_buttons', 'player2_buttons', 'type', '_Command__player_count', 'save_game_path')
 
     def __init__(self):
 
@@ -20,4 +34,13 @@ class Command:
         command_dict['player_count'] = self.__player_count
         command_dict['savegamepath'] = self.save_game_path
 
-        return command_dict
\ No newline at end of file
+        return command_dict
+
+    def encode(self):
+        #ready-to-send bytes; only the two button fragments vary between frames
+        key = (self.type, self.__player_count, self.save_game_path)
+        tail = _tails.get(key)
+        if tail is None:
+            tail = _tails[key] = b', ' + json.dumps({'type': key[0], 'player_count': key[1], 'savegamepath': key[2]})[1:].encode()
+        fragments = _button_fragments()
+        return b''.join((b'{"p1": ', fragments[self.player_buttons.bits], b', "p2": ', fragments[self.player2_buttons.bits], tail))
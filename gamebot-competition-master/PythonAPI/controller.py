@@ -1,16 +1,27 @@
+import os
 import socket
 import json
 import sys
-import time
-from game_state import GameState
+from game_state import GameState, GameStatePool
 from command import Command
 from buttons import Buttons
-from listen_to_key import get_current_keypress
-from make_dataset import record_frame
+from frame_scheduler import FPS, FramePacer, FrameScheduler
+from stream_decoder import StreamDecoder
+import telemetry
 
 player_id = sys.argv[1]
 MODE = 'record' if len(sys.argv) > 2 and sys.argv[2] == 'record' else 'bot'
-port = 9999 if player_id == '1' else 10000
+#inference backend for bot mode: python controller.py "1" "bot" "numpy"
+#"both" serves player 1 and 2 from one process with batched inference: python controller.py "both" "bot" "npz"
+#"npz" runs exported model_<id>.npz artifacts and never imports tensorflow, sklearn or pandas, "int8" and "fp16" their quantized variants
+BACKEND = sys.argv[3] if len(sys.argv) > 3 else 'keras'
+#SF_PORT_BASE moves player 1 and 2 to base and base + 1, so several sessions can share a host (default 9999/10000)
+PORT_BASE = int(os.environ.get('SF_PORT_BASE', '9999'))
+port = PORT_BASE if player_id == '1' else PORT_BASE + 1
+#record mode must see every frame, the bot only ever needs the newest one
+decoder = StreamDecoder(latest_only=(MODE == 'bot'))
+#game states are decoded in place into recycled objects, the scheduler releases each one once it is done with it
+states = GameStatePool()
 
 def connect(port):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -21,43 +32,73 @@ def connect(port):
     return client
 
 def send(sock, cmd):
-    payload = json.dumps(cmd.object_to_dict())
-    print("[Controller] Sending:", payload)
-    print("\n[Controller] Detailed Debug:")
-    print("1. Command object button states:", vars(cmd.player_buttons))
-    print("2. Serialized command:", payload)
-    print("3. Socket info:", sock.getsockname(), "->", sock.getpeername())
-    sock.sendall(payload.encode())
+    with telemetry.timed('send'):
+        payload = cmd.encode()
+        if telemetry.DEBUG:
+            telemetry.debug("[Controller] Sending: %s", payload)
+            telemetry.debug("\n[Controller] Detailed Debug:")
+            telemetry.debug("1. Command object button states: %s", cmd.player_buttons.object_to_dict())
+            telemetry.debug("2. Serialized command: %s", payload)
+            telemetry.debug("3. Socket info: %s -> %s", sock.getsockname(), sock.getpeername())
+        sock.sendall(payload)
 
-def receive(sock):
-    data = json.loads(sock.recv(4096).decode())
-    return GameState(data)
+def receive(sock, into=None):
+    #receive includes the time spent blocked waiting for the emulator
+    with telemetry.timed('receive'):
+        raw = decoder.next_raw(sock)
+    with telemetry.timed('decode'):
+        return GameState.decode(raw, into if into is not None else states.acquire())
 
 def main():
+    telemetry.start()
+    if player_id == 'both':
+        import asyncio
+        from dual_controller import serve
+        asyncio.run(serve(BACKEND))
+        return
+    if MODE == 'bot':
+        from bot import Bot
+        from model_registry import ModelRegistry, parse_preload
+        #tensorflow is imported and the models load and warm up while we wait for the game to connect
+        registry = ModelRegistry(backend=BACKEND)
+        registry.preload(parse_preload(), background=True)
     sock = connect(port)
-    cmd = Command()
-    player_id_set = False
-    while True:
-        gs = receive(sock)
-        
-        if MODE != 'record' and not player_id_set:
-            from bot import Bot
-            bot = Bot(player_id=gs.player1.player_id)
-            player_id_set = True
-
-
-        if MODE == 'record':
+    if MODE == 'record':
+        #the keyboard listener and the recorder are only needed here
+        from listen_to_key import get_current_keypress
+        from make_dataset import record_frame
+        cmd = Command()
+        pacer = FramePacer(FPS)
+        #each frame is recorded before the next one is received, so one state is reused throughout
+        gs = GameState()
+        while True:
+            receive(sock, gs)
             keys = get_current_keypress()
             # Forward human input
             cmd.player_buttons = Buttons({k: True for k in keys})
             record_frame(gs, keys)
-        else:
-            print("\n[Controller] Getting bot command...")
+            send(sock, cmd)
+            pacer.wait()
+    else:
+        bot = None
+        def decide(gs):
+            #bot is built on the inference thread so a model that was not preloaded never blocks a send
+            #a new character (next match) gets a new Bot, its model usually already warm in the registry
+            nonlocal bot
+            character_id = gs.player1.player_id
+            if bot is None or bot.character_id != character_id:
+                bot = Bot(player_id=character_id, backend=BACKEND, loaded=registry.get(character_id))
+            telemetry.debug("\n[Controller] Getting bot command...")
             cmd = bot.fight(gs, player_id)
-            print(f"[Controller] Bot command received: {cmd.object_to_dict()}")
-        
-        send(sock, cmd)
-        time.sleep(1/60.0)
+            if telemetry.DEBUG:
+                telemetry.debug(f"[Controller] Bot command received: {cmd.object_to_dict()}")
+            return cmd
+        scheduler = FrameScheduler(lambda: receive(sock), lambda cmd: send(sock, cmd), decide, fps=FPS, release=states.release)
+        scheduler.run()
+        print(f"[Controller] Decoder dropped {decoder.messages_dropped} backlog frames before decoding, {states.created} game states allocated")
+        print(registry.summary())
+        if bot is not None and bot.cache is not None:
+            print(bot.cache.summary())
         
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,152 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+#memoizes the button probabilities of a window so repeated windows (pre-round, round over, idle
+#stand-offs, the timer=153 intro frames) skip scaling and the forward pass:
+#  SF_DECISION_CACHE=<n>          windows kept per loaded model, least recently used evicted (default 1024, 0 disables)
+#  SF_DECISION_QUANTUM=<pixels>   key on coordinates rounded down to this step (default 0, exact windows only)
+#the cache belongs to the LoadedModel it was filled from, so a reloaded or retrained model starts empty
+#  python decision_cache.py --character 7 --backend npz --quantum 0 4 8    hit rate and saved time on a recording
+CACHE_SIZE = int(os.environ.get('SF_DECISION_CACHE', '1024'))
+QUANTUM = float(os.environ.get('SF_DECISION_QUANTUM', '0'))
+
+class DecisionCache:
+    #LRU of window key -> probabilities, safe to share between bots of the same model
+    def __init__(self, maxsize=CACHE_SIZE, steps=None):
+        #steps: per-feature step of the window (0 keeps a feature exact), None keys on the exact window
+        self.maxsize = maxsize
+        self.steps = None if steps is None or not np.any(steps) else np.asarray(steps, dtype=np.float64)
+        if self.steps is not None:
+            self._exact = self.steps <= 0
+            self._divisor = np.where(self._exact, 1.0, self.steps)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def matches(self, maxsize, steps=None):
+        #whether this cache was built with the same size and quantization
+        if steps is None or not np.any(steps):
+            return self.maxsize == maxsize and self.steps is None
+        return self.maxsize == maxsize and self.steps is not None and np.array_equal(self.steps, steps)
+
+    def key(self, window):
+        #16-byte digest of the window, or of its quantized copy
+        x = np.asarray(window)
+        if self.steps is not None:
+            x = np.where(self._exact, x, np.floor(x / self._divisor))
+        return hashlib.blake2b(np.ascontiguousarray(x).tobytes(), digest_size=16).digest()
+
+    def get(self, key):
+        with self._lock:
+            preds = self._entries.get(key)
+            if preds is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return preds
+
+    def put(self, key, preds):
+        #copied, the numpy backends return a buffer that the next predict overwrites
+        with self._lock:
+            self._entries[key] = np.array(preds, copy=True)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        #call after changing the weights of a model in place
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"[DecisionCache] {s['size']}/{s['maxsize']} windows | hits {s['hits']} | misses {s['misses']} | "
+                f"hit rate {s['hit_rate']:.1%} | evictions {s['evictions']}")
+
+def replay(character_id, backend='npz', sizes=(CACHE_SIZE,), quanta=(0.0,), source=None, n_frames=None):
+    #replays a recording through Bot.fight without a cache and with each (size, quantum), timing every frame;
+    #agreement is the share of frames whose command is the same as without the cache
+    from bot import Bot
+    from game_state import GameState
+    from model_registry import load_model, model_path
+    from recorded_frames import default_dataset, load_states
+    source = source or default_dataset(character_id)
+    frames = [GameState(s) for s in load_states(source, n_frames)]
+    loaded = load_model(model_path(character_id, backend=backend), backend, character_id)
+
+    def run(cache_size, quantum):
+        loaded.cache = None
+        bot = Bot(player_id=character_id, backend=backend, loaded=loaded, cache_size=cache_size, quantum=quantum)
+        times = np.empty(len(frames))
+        bits = np.empty(len(frames), dtype=np.int64)
+        for i, gs in enumerate(frames):
+            t0 = time.perf_counter()
+            cmd = bot.fight(gs, "1")
+            times[i] = time.perf_counter() - t0
+            bits[i] = cmd.player_buttons.bits
+        return bot, times, bits
+
+    _, base_times, base_bits = run(0, 0.0)
+    rows = [{'maxsize': 0, 'quantum': 0.0, 'hit_rate': 0.0, 'mean_ms': base_times.mean() * 1000,
+             'total_s': base_times.sum(), 'saved_s': 0.0, 'agreement': 1.0}]
+    for size in sizes:
+        for quantum in quanta:
+            bot, times, bits = run(size, quantum)
+            s = bot.cache.stats()
+            rows.append({**s, 'quantum': quantum, 'mean_ms': times.mean() * 1000, 'total_s': times.sum(),
+                         'saved_s': base_times.sum() - times.sum(), 'agreement': float((bits == base_bits).mean())})
+    return {'character': character_id, 'backend': backend, 'source': source, 'frames': len(frames), 'rows': rows}
+
+def print_replay(result):
+    print(f"\n=== model_{result['character']} ({result['backend']}) - {result['frames']} frames from {os.path.basename(result['source'])} ===")
+    print(f"{'cache':>7}{'quantum':>9}{'hit rate':>10}{'mean ms':>10}{'total s':>9}{'saved s':>9}{'same cmd':>10}")
+    for r in result['rows']:
+        print(f"{r['maxsize'] or 'off':>7}{r['quantum']:>9g}{r['hit_rate']:>10.1%}{r['mean_ms']:>10.4f}"
+              f"{r['total_s']:>9.3f}{r['saved_s']:>9.3f}{r['agreement']:>10.2%}")
+
+if __name__ == '__main__':
+    from model_registry import N_CHARACTERS
+    from recorded_frames import default_dataset
+    parser = argparse.ArgumentParser(description="Measure the decision cache on replayed recordings")
+    parser.add_argument('--characters', type=int, nargs='+', help="default every character with a recording")
+    parser.add_argument('--backend', default='npz')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[CACHE_SIZE])
+    parser.add_argument('--quantum', type=float, nargs='+', default=[0.0], help="coordinate steps to compare, 0 is exact")
+    parser.add_argument('--source', help="recording to replay instead of the character's dataset, needs one --characters id")
+    parser.add_argument('--frames', type=int, help="replay only the first FRAMES states, keras runs one model.predict per frame")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+    ids = args.characters or [cid for cid in range(N_CHARACTERS) if os.path.exists(default_dataset(cid))]
+    results = [replay(cid, args.backend, args.sizes, args.quantum, args.source, args.frames) for cid in ids]
+    for r in results:
+        print_replay(r)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,316 @@
+import asyncio
+import json
+import os
+import select
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from bot import Bot
+from command import Command
+from frame_scheduler import FPS
+from game_state import GameStatePool
+from model_registry import ModelRegistry, parse_preload
+from stream_decoder import StreamDecoder
+import telemetry
+
+#one process serving both player ports: python controller.py "both" "bot" "npz"
+#frames that arrive for P1 and P2 within GATHER of each other are decided together, with one
+#batched forward pass per character model, and each command goes back on its own socket
+#as in FrameScheduler, a batch not decided within BUDGET of a frame after its first state arrived
+#answers every player with their previous command and its result is used once it is ready
+#SF_PORT_BASE moves the pair like it does for controller.py
+PORT_BASE = int(os.environ.get('SF_PORT_BASE', '9999'))
+PORTS = {'1': PORT_BASE, '2': PORT_BASE + 1}
+GATHER = 0.25 / FPS
+BUDGET = 0.9
+
+class PlayerConnection:
+    def __init__(self, player_id, writer):
+        self.player_id = player_id
+        self.writer = writer
+        self.decoder = StreamDecoder(latest_only=True)
+        self.bot = None
+        #newest undecided (game state, arrival time)
+        self.latest = None
+        self.last_cmd = None
+        self.frames_dropped = 0
+
+class DualController:
+    def __init__(self, backend='keras', gather=GATHER, budget=BUDGET, registry=None, report_every=600):
+        self.backend = backend
+        self.gather = gather
+        self.frame_budget = budget / FPS
+        self.registry = registry or ModelRegistry(backend=backend)
+        self.report_every = report_every
+        self.connections = {}
+        self.connected_once = False
+        self._frame_ready = asyncio.Event()
+        #inference off the event loop so both sockets keep being read while a batch runs
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batched-inference')
+        self._pending = None
+        #states decoded in place into recycled objects, released once dropped or decided
+        self.states = GameStatePool()
+
+        self.ticks = 0
+        self.rows = 0
+        self.model_calls = 0
+        self.cache_hits = 0
+        self.frames_dropped = 0
+        self.deadline_misses = 0
+        self.late_results = 0
+
+    async def serve_player(self, player_id, reader, writer):
+        conn = PlayerConnection(player_id, writer)
+        self.connections[player_id] = conn
+        self.connected_once = True
+        print(f"Player {player_id} connected to game!")
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                with telemetry.timed('receive'):
+                    conn.decoder.feed(data)
+                    raw = conn.decoder.pop_raw()
+                if raw is None:
+                    continue
+                with telemetry.timed('decode'):
+                    gs = self.states.decode(raw)
+                if conn.latest is not None:
+                    #the batch is behind, only the newest state matters
+                    conn.frames_dropped += 1
+                    self.states.release(conn.latest[0])
+                conn.latest = (gs, time.monotonic())
+                self._frame_ready.set()
+        except ConnectionError:
+            pass
+        finally:
+            self.frames_dropped += conn.frames_dropped + conn.decoder.messages_dropped
+            del self.connections[player_id]
+            writer.close()
+            print(f"Player {player_id} disconnected")
+            self._frame_ready.set()
+
+    def _decide_batch(self, batch):
+        #runs on the inference thread: one forward pass per character model for every waiting player
+        groups = {}
+        cmds = {}
+        for conn, (gs, _) in batch:
+            character_id = gs.player1.player_id
+            if conn.bot is None or conn.bot.character_id != character_id:
+                conn.bot = Bot(player_id=character_id, backend=self.backend, loaded=self.registry.get(character_id))
+            #a window the model has already decided is answered from the cache and left out of the batch
+            window = conn.bot.window(gs)
+            key, preds = conn.bot.lookup(window)
+            if preds is not None:
+                cmds[conn.player_id] = conn.bot.decide(preds, conn.player_id)
+                self.cache_hits += 1
+                continue
+            groups.setdefault(character_id, []).append((conn, key, conn.bot.model_input(window)))
+        for items in groups.values():
+            preds = items[0][0].bot.predict_rows(np.concatenate([x for _, _, x in items]))
+            for (conn, key, _), p in zip(items, preds):
+                conn.bot.remember(key, p)
+                cmds[conn.player_id] = conn.bot.decide(p, conn.player_id)
+            self.model_calls += 1
+        for _, (gs, _) in batch:
+            self.states.release(gs)
+        return cmds
+
+    def _remember(self, cmds):
+        for pid, cmd in cmds.items():
+            conn = self.connections.get(pid)
+            if conn is not None:
+                conn.last_cmd = cmd
+
+    async def _decide(self, batch):
+        #commands for the batch, or every player's previous command when the deadline passes first
+        loop = asyncio.get_running_loop()
+        if self._pending is not None and self._pending.done():
+            self._remember(self._pending.result())
+            self._pending = None
+            self.late_results += 1
+        if self._pending is None:
+            self._pending = loop.run_in_executor(self._executor, self._decide_batch, batch)
+        else:
+            #the previous batch is still in inference, this one gets the fallback and is never decided
+            for _, (gs, _) in batch:
+                self.states.release(gs)
+        deadline = min(arrived for _, (_, arrived) in batch) + self.frame_budget
+        try:
+            cmds = await asyncio.wait_for(asyncio.shield(self._pending), max(0.0, deadline - time.monotonic()))
+            self._pending = None
+            self._remember(cmds)
+            #the result can be of an earlier batch without some of this batch's players
+            return {c.player_id: cmds.get(c.player_id) or c.last_cmd or Command() for c, _ in batch}
+        except asyncio.TimeoutError:
+            self.deadline_misses += 1
+            return {c.player_id: c.last_cmd or Command() for c, _ in batch}
+
+    async def _gather(self):
+        #wait a little for the other player's frame of the same tick
+        deadline = time.monotonic() + self.gather
+        while any(c.latest is None for c in self.connections.values()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._frame_ready.clear()
+            try:
+                await asyncio.wait_for(self._frame_ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+    async def run(self):
+        while True:
+            await self._frame_ready.wait()
+            self._frame_ready.clear()
+            if self.connected_once and not self.connections:
+                break
+            await self._gather()
+            batch = [(c, c.latest) for c in self.connections.values() if c.latest is not None]
+            if not batch:
+                continue
+            for c, _ in batch:
+                c.latest = None
+            cmds = await self._decide(batch)
+            for c, _ in batch:
+                with telemetry.timed('send'):
+                    c.writer.write(cmds[c.player_id].encode())
+            await asyncio.gather(*(c.writer.drain() for c, _ in batch), return_exceptions=True)
+            self.ticks += 1
+            self.rows += len(batch)
+            if self.report_every and self.ticks % self.report_every == 0:
+                print(self.summary())
+        self._executor.shutdown(wait=False)
+
+    def summary(self):
+        per_call = (self.rows - self.cache_hits) / self.model_calls if self.model_calls else 0.0
+        miss_rate = self.deadline_misses / self.ticks if self.ticks else 0.0
+        return (f"[Dual] ticks {self.ticks} | commands {self.rows} | model calls {self.model_calls} "
+                f"({per_call:.2f} rows per call) | cache hits {self.cache_hits} | dropped {self.frames_dropped} | "
+                f"deadline misses {self.deadline_misses} ({miss_rate:.1%}) | late results {self.late_results} | "
+                f"{self.states.created} game states allocated")
+
+async def serve(backend='keras', ports=PORTS, gather=GATHER, budget=BUDGET):
+    controller = DualController(backend, gather, budget)
+    #tensorflow (for keras) and the models load while we wait for the game to connect
+    controller.registry.preload(parse_preload(), background=True)
+    servers = []
+    for pid, port in ports.items():
+        handler = lambda reader, writer, pid=pid: controller.serve_player(pid, reader, writer)
+        servers.append(await asyncio.start_server(handler, '127.0.0.1', port))
+    try:
+        await controller.run()
+    finally:
+        for server in servers:
+            server.close()
+    print(controller.summary())
+    print(controller.registry.summary())
+
+def check_split_batches(budget=BUDGET):
+    #P1 alone, then P2 alone while P1's batch is still in inference: the result that arrives for P2's
+    #batch is P1's, and P2 must still get a command (its previous one or an empty one)
+    async def main():
+        controller = DualController(budget=budget, registry=object())
+        started = asyncio.Event()
+        finish = threading.Event()
+        loop = asyncio.get_running_loop()
+
+        def decide_batch(batch):
+            loop.call_soon_threadsafe(started.set)
+            finish.wait()
+            return {conn.player_id: Command() for conn, _ in batch}
+        controller._decide_batch = decide_batch
+        p1, p2 = PlayerConnection('1', None), PlayerConnection('2', None)
+        controller.connections = {'1': p1, '2': p2}
+        first = await controller._decide([(p1, (controller.states.acquire(), time.monotonic()))])
+        await started.wait()
+        if set(first) != {'1'} or controller.deadline_misses != 1:
+            raise AssertionError(f"P1's batch should miss its deadline, got {sorted(first)}")
+        loop.call_later(controller.frame_budget / 4, finish.set)
+        second = await controller._decide([(p2, (controller.states.acquire(), time.monotonic()))])
+        if set(second) != {'2'}:
+            raise AssertionError(f"P2's batch was answered for players {sorted(second)}")
+        if p1.last_cmd is None:
+            raise AssertionError("P1's late result was not kept as its previous command")
+        controller._executor.shutdown(wait=True)
+        return {'first': sorted(first), 'second': sorted(second), 'deadline_misses': controller.deadline_misses}
+    return asyncio.run(main())
+
+def _cpu_seconds(pid):
+    #user + system time of a running process from /proc (linux only)
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def _rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def bench(backend='npz', seconds=10.0, character_id=7):
+    #plays the game side for two controller.py processes and then for one "both" process, sending the
+    #same recorded frames to both ports at 60 fps, and compares steady-state cpu and memory
+    from game_server import connect
+    from recorded_frames import default_dataset, load_recorded_states
+    states = [json.dumps(s).encode() for s in load_recorded_states(default_dataset(character_id), limit=int(seconds * FPS))]
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, SF_PRELOAD=str(character_id))
+    setups = {
+        'two processes': [['1'], ['2']],
+        'one dual process': [['both']],
+    }
+    results = {}
+    for name, argvs in setups.items():
+        procs = [subprocess.Popen([sys.executable, 'controller.py', *argv, 'bot', backend], cwd=here, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for argv in argvs]
+        socks = [connect(port) for port in PORTS.values()]
+        decoders = [StreamDecoder() for _ in socks]
+        replies = [0, 0]
+        def pump(payload):
+            #one frame to both ports, then collect commands until the next frame is due
+            for s in socks:
+                s.sendall(payload)
+            end = time.monotonic() + 1.0 / FPS
+            while (remaining := end - time.monotonic()) > 0:
+                ready, _, _ = select.select(socks, [], [], remaining)
+                for s in ready:
+                    i = socks.index(s)
+                    decoders[i].feed(s.recv(65536))
+                    while decoders[i].pop_raw() is not None:
+                        replies[i] += 1
+        #the first command on both ports means the models are loaded, measurement starts after it
+        deadline = time.monotonic() + 120
+        while not all(replies) and time.monotonic() < deadline:
+            pump(states[0])
+        cpu0 = sum(_cpu_seconds(p.pid) for p in procs)
+        warmup_replies = sum(replies)
+        for payload in states:
+            pump(payload)
+        sent = len(states)
+        cpu = sum(_cpu_seconds(p.pid) for p in procs) - cpu0
+        rss = sum(_rss_mb(p.pid) for p in procs)
+        for s in socks:
+            s.close()
+        for p in procs:
+            p.wait(timeout=30)
+        results[name] = {'frames': sent, 'cpu_ms_per_frame': cpu / sent * 1000, 'rss_mb': rss, 'replies': sum(replies) - warmup_replies}
+    return results
+
+if __name__ == '__main__':
+    #usage: python dual_controller.py [backend] [seconds]   benchmark two controllers against one dual controller
+    #       python dual_controller.py --check                 P1 and P2 decided in separate, overlapping batches
+    if sys.argv[1:] == ['--check']:
+        r = check_split_batches()
+        print(f"Split batches OK: answered {r['first']} then {r['second']}, {r['deadline_misses']} deadline miss")
+        sys.exit(0)
+    backend = sys.argv[1] if len(sys.argv) > 1 else 'npz'
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    for name, r in bench(backend, seconds).items():
+        print(f"{name:<18} {r['frames']} frames to both ports | cpu {r['cpu_ms_per_frame']:.2f} ms per frame | "
+              f"RSS {r['rss_mb']:.0f} MB | {r['replies']} commands received")
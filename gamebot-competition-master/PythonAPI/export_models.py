@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from fast_inference import PREDICT_ATOL, NumpyMLP, save_artifact
+from model_registry import MODEL_DIR, N_CHARACTERS, model_path
+
+#converts models/model_<id>.keras + .scaler into models/model_<id>.npz for the npz backend:
+#  python export_models.py [ids...]          export (default every model) and check against keras
+#  python export_models.py --measure 7       import, load and startup-to-first-command time and RSS per backend,
+#                                            each in a fresh interpreter (keras and numpy import tensorflow when the model loads)
+HEAVY_MODULES = ('tensorflow', 'sklearn', 'pandas')
+
+def export(character_id, model_dir=MODEL_DIR, n_check=256, seed=0):
+    #writes the artifact and returns the largest difference to the keras model on random frames
+    import joblib
+    import tensorflow as tf
+    src = model_path(character_id, model_dir)
+    dst = model_path(character_id, model_dir, backend='npz')
+    model = tf.keras.models.load_model(src)
+    scaler = joblib.load(src + '.scaler')
+    save_artifact(dst, model, scaler)
+
+    #raw frames spread around the training distribution, scaled the way Bot scales them for keras
+    rng = np.random.default_rng(seed)
+    x = (scaler.mean_ + rng.standard_normal((n_check, len(scaler.mean_))) * scaler.scale_).astype(np.float32)
+    expected = model.predict((x - scaler.mean_) / scaler.scale_, verbose=0)
+    got = NumpyMLP.from_artifact(dst).predict(x)
+    return dst, float(np.abs(expected - got).max())
+
+def _probe(backend, character_id, state_json):
+    #runs in a fresh interpreter: everything bot mode does up to its first command
+    t0 = time.time()
+    from bot import Bot
+    from game_state import GameState
+    from model_registry import ModelRegistry
+    imported = time.time()
+    registry = ModelRegistry(backend=backend)
+    loaded = registry.get(character_id)
+    ready = time.time()
+    bot = Bot(player_id=character_id, backend=backend, loaded=loaded)
+    cmd = bot.fight(GameState(json.loads(state_json)), "1")
+    cmd.encode()
+    done = time.time()
+    try:
+        #unix only, the probe reports no RSS on windows
+        import resource
+        max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        max_rss_mb = None
+    print(json.dumps({
+        'import_s': imported - t0,
+        'load_s': ready - imported,
+        'first_command_at': done,
+        'max_rss_mb': max_rss_mb,
+        'heavy_modules': [m for m in HEAVY_MODULES if m in sys.modules],
+    }))
+
+def measure(character_id, backends=('keras', 'numpy', 'npz')):
+    from recorded_frames import default_dataset, load_recorded_states
+    dataset = default_dataset(character_id)
+    if not os.path.exists(dataset):
+        dataset = default_dataset(1)
+    state = json.dumps(load_recorded_states(dataset, limit=1)[0])
+    results = {}
+    for backend in backends:
+        spawned = time.time()
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--probe', backend, str(character_id), state],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if out.returncode != 0:
+            raise RuntimeError(f"{backend} probe failed:\n{out.stderr[-2000:]}")
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        r['startup_to_first_command_s'] = r.pop('first_command_at') - spawned
+        results[backend] = r
+    return results
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--probe':
+        _probe(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Export keras models to numpy-only .npz artifacts")
+    parser.add_argument('characters', type=int, nargs='*', help="character ids, defaults to every model in models/")
+    parser.add_argument('--measure', type=int, metavar='ID', help="compare startup of the backends for one character instead")
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        results = measure(args.measure)
+        print(f"{'backend':<8}{'imports s':>11}{'load + warm-up s':>18}{'first command s':>17}{'max RSS MB':>12}  heavy modules loaded")
+        for backend, r in results.items():
+            rss = 'n/a' if r['max_rss_mb'] is None else f"{r['max_rss_mb']:.0f}"
+            print(f"{backend:<8}{r['import_s']:>11.2f}{r['load_s']:>18.2f}{r['startup_to_first_command_s']:>17.2f}{rss:>12}  "
+                  f"{', '.join(r['heavy_modules']) or 'none'}")
+        sys.exit(0)
+
+    ids = args.characters or [cid for cid in range(N_CHARACTERS) if os.path.exists(model_path(cid))]
+    failed = 0
+    for cid in ids:
+        dst, diff = export(cid)
+        ok = diff <= PREDICT_ATOL
+        failed += not ok
+        print(f"model_{cid}: {os.path.getsize(dst) / 1e3:.0f} KB -> {dst} | max |keras - npz| {diff:.2e} {'OK' if ok else 'FAILED'}")
+    sys.exit(1 if failed else 0)
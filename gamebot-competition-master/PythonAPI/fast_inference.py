@@ -0,0 +1,353 @@
+import struct
+import sys
+import threading
+import time
+import zipfile
+import numpy as np
+
+#largest absolute difference allowed between NumpyMLP and model.predict on the same frames
+PREDICT_ATOL = 1e-4
+#model_<id>.npz layout written by export_models.py, bump when it changes
+ARTIFACT_VERSION = 1
+#model_<id>.int8.npz / model_<id>.fp16.npz layout written by quantize_models.py
+QUANTIZED_VERSION = 1
+QUANTIZATIONS = ('int8', 'fp16')
+
+#data of every array in a written .npz starts on this boundary, so a memory-mapped array is as fast as a loaded one
+NPZ_ALIGNMENT = 64
+#zip extra field id used for the padding, the one zipalign uses
+_PAD_FIELD = 0xD935
+
+def write_npz(path, **arrays):
+    #np.savez layout (uncompressed, one name.npy member per array) that np.load reads as usual; each member's
+    #local header is padded with an extra field so the array data is NPZ_ALIGNMENT aligned in the file
+    #(the .npy header already pads itself to a multiple of 64 bytes)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as zf:
+        for name, value in arrays.items():
+            info = zipfile.ZipInfo(name + '.npy', date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_STORED
+            start = zf.fp.tell() + 30 + len(info.filename.encode()) + 4
+            pad = -start % NPZ_ALIGNMENT
+            info.extra = struct.pack('<HH', _PAD_FIELD, pad) + bytes(pad)
+            with zf.open(info, 'w') as f:
+                np.lib.format.write_array(f, np.asanyarray(value), allow_pickle=False)
+
+def read_npz(path, mmap=False):
+    #every array of an .npz as a dict; with mmap the numeric arrays of an uncompressed (np.savez) file are
+    #memory-mapped read-only, so processes loading the same model share one copy in the page cache
+    if not mmap:
+        with np.load(path, allow_pickle=False) as npz:
+            return {name: npz[name] for name in npz.files}
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            #the data follows the local file header (30 bytes + file name + extra field) and the .npy header
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran, dtype = read_header(f)
+            if info.compress_type != zipfile.ZIP_STORED or dtype.kind not in 'biuf' or not shape:
+                with zf.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                     order='F' if fortran else 'C')
+    return arrays
+
+class FrameRing:
+    #fixed float32 ring of the last window_size frames
+    #every frame is written twice (pos and pos+window_size) so the window is always one contiguous slice
+    def __init__(self, window_size, n_features):
+        self.window_size = window_size
+        self.n_features = n_features
+        self._data = np.zeros((2 * window_size, n_features), dtype=np.float32)
+        self._pos = 0
+
+    def next_row(self):
+        #row to fill in place with the newest frame, call commit() afterwards
+        return self._data[self._pos]
+
+    def commit(self):
+        self._data[self._pos + self.window_size] = self._data[self._pos]
+        self._pos = (self._pos + 1) % self.window_size
+
+    def push(self, values):
+        self._data[self._pos] = values
+        self.commit()
+
+    def window(self):
+        #oldest frame first, flattened to (1, window_size * n_features) without copying
+        return self._data[self._pos:self._pos + self.window_size].reshape(1, -1)
+
+class NumpyMLP:
+    #forward pass of a keras Dense stack with the StandardScaler folded into the first layer
+    ACTIVATIONS = ('relu', 'sigmoid', 'linear')
+
+    def __init__(self, weights, biases, activations):
+        for act in activations:
+            if act not in self.ACTIVATIONS:
+                raise ValueError(f"Unsupported activation: {act}")
+        self.weights = [np.ascontiguousarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.ascontiguousarray(b, dtype=np.float32) for b in biases]
+        self.activations = list(activations)
+        self.n_inputs = self.weights[0].shape[0]
+        self.n_outputs = self.weights[-1].shape[1]
+        self._buffers = {}
+
+    @classmethod
+    def from_keras(cls, model, scaler=None):
+        weights, biases, activations = dense_layers(model)
+        if scaler is not None:
+            weights[0], biases[0] = fold_scaler(weights[0], biases[0], scaler)
+        return cls(weights, biases, activations)
+
+    @classmethod
+    def from_artifact(cls, path, mmap=False):
+        #numpy-only load of a model_<id>.npz, the scaler is folded in here as in from_keras
+        #with mmap every layer but the first (which the fold rewrites) stays mapped from the file
+        npz = read_npz(path, mmap)
+        version = int(npz['format_version'])
+        if version != ARTIFACT_VERSION:
+            raise ValueError(f"{path} is artifact format {version}, expected {ARTIFACT_VERSION}; export it again")
+        n_layers = int(npz['n_layers'])
+        weights = [npz[f'w{i}'] for i in range(n_layers)]
+        biases = [npz[f'b{i}'] for i in range(n_layers)]
+        activations = [str(a) for a in npz['activations']]
+        mean, scale = npz['mean'], npz['scale']
+        weights[0], biases[0] = fold_scaler(weights[0], biases[0], _Normalization(mean, scale))
+        return cls(weights, biases, activations)
+
+    def _layer_buffers(self, batch_size):
+        #activations are preallocated once per batch size and reused on every call
+        bufs = self._buffers.get(batch_size)
+        if bufs is None:
+            bufs = [np.empty((batch_size, w.shape[1]), dtype=np.float32) for w in self.weights]
+            self._buffers[batch_size] = bufs
+        return bufs
+
+    def predict(self, x):
+        #x is raw (unscaled) float32 features of shape (batch, n_inputs)
+        #the returned array is reused by the next call with the same batch size
+        bufs = self._layer_buffers(x.shape[0])
+        h = x
+        for w, b, act, out in zip(self.weights, self.biases, self.activations, bufs):
+            np.matmul(h, w, out=out)
+            out += b
+            _activate(out, act)
+            h = out
+        return h
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.weights + self.biases)
+
+def _activate(out, act):
+    #in place, out is float32
+    if act == 'relu':
+        np.maximum(out, 0.0, out=out)
+    elif act == 'sigmoid':
+        np.negative(out, out=out)
+        np.exp(out, out=out)
+        out += 1.0
+        np.reciprocal(out, out=out)
+
+def quantize_int8(w):
+    #symmetric per output channel: w[:, j] ~= q[:, j] * scale[j], q in [-127, 127]
+    w = np.asarray(w, dtype=np.float32)
+    scale = np.abs(w).max(axis=0) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.clip(np.rint(w / scale), -127, 127).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+_scratch_local = threading.local()
+
+def _scratch(size):
+    #flat float32 buffer of at least size values for the calling thread
+    buf = getattr(_scratch_local, 'buf', None)
+    if buf is None or buf.size < size:
+        buf = _scratch_local.buf = np.empty(size, dtype=np.float32)
+    return buf[:size]
+
+class QuantizedMLP:
+    #the NumpyMLP forward pass with int8 (per-channel) or float16 weights kept resident
+    #the scaler is not folded: folding divides rows by per-feature scales up to ~1e8 apart, which would leave
+    #no precision for the small rows after quantization, so inputs are normalized in float32 first
+    #numpy has no fast int8/float16 matmul, so each layer is expanded into a float32 scratch buffer (one per thread,
+    #shared by every quantized model) and multiplied in float32: the resident weights take 1/4 (int8) or 1/2 (fp16)
+    #of the memory, at some latency per frame
+    def __init__(self, quantization, weights, scales, biases, activations, mean, scale):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        for act in activations:
+            if act not in NumpyMLP.ACTIVATIONS:
+                raise ValueError(f"Unsupported activation: {act}")
+        self.quantization = quantization
+        dtype = np.int8 if quantization == 'int8' else np.float16
+        self.weights = [np.ascontiguousarray(w, dtype=dtype) for w in weights]
+        self.scales = [None if s is None else np.ascontiguousarray(s, dtype=np.float32) for s in scales]
+        self.biases = [np.ascontiguousarray(b, dtype=np.float32) for b in biases]
+        self.activations = list(activations)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.inv_scale = (1.0 / self.scale).astype(np.float32)
+        self.n_inputs = self.weights[0].shape[0]
+        self.n_outputs = self.weights[-1].shape[1]
+        self._buffers = {}
+
+    @classmethod
+    def from_keras(cls, model, scaler, quantization):
+        weights, biases, activations = dense_layers(model)
+        if quantization == 'int8':
+            weights, scales = zip(*(quantize_int8(w) for w in weights))
+        else:
+            weights, scales = [np.asarray(w, dtype=np.float16) for w in weights], [None] * len(weights)
+        return cls(quantization, weights, scales, biases, activations, scaler.mean_, scaler.scale_)
+
+    @classmethod
+    def from_artifact(cls, path, mmap=False):
+        #with mmap every weight matrix stays mapped from the file, nothing is folded into them
+        npz = read_npz(path, mmap)
+        version = int(npz['format_version'])
+        if version != QUANTIZED_VERSION:
+            raise ValueError(f"{path} is quantized format {version}, expected {QUANTIZED_VERSION}; quantize it again")
+        quantization = str(npz['quantization'])
+        n_layers = int(npz['n_layers'])
+        weights = [npz[f'w{i}'] for i in range(n_layers)]
+        scales = [npz[f's{i}'] if f's{i}' in npz else None for i in range(n_layers)]
+        biases = [npz[f'b{i}'] for i in range(n_layers)]
+        activations = [str(a) for a in npz['activations']]
+        mean, scale = npz['mean'], npz['scale']
+        return cls(quantization, weights, scales, biases, activations, mean, scale)
+
+    def save(self, path, feature_names=()):
+        arrays = {f'w{i}': w for i, w in enumerate(self.weights)}
+        arrays.update({f's{i}': s for i, s in enumerate(self.scales) if s is not None})
+        arrays.update({f'b{i}': b for i, b in enumerate(self.biases)})
+        write_npz(path, format_version=np.int32(QUANTIZED_VERSION), quantization=np.array(self.quantization),
+                 n_layers=np.int32(len(self.weights)), activations=np.array(self.activations),
+                 mean=self.mean, scale=self.scale,
+                 feature_names=np.array([str(f) for f in feature_names]), **arrays)
+
+    def _layer_buffers(self, batch_size):
+        bufs = self._buffers.get(batch_size)
+        if bufs is None:
+            bufs = [np.empty((batch_size, self.n_inputs), dtype=np.float32)]
+            bufs += [np.empty((batch_size, w.shape[1]), dtype=np.float32) for w in self.weights]
+            self._buffers[batch_size] = bufs
+        return bufs
+
+    def predict(self, x):
+        #same contract as NumpyMLP.predict: raw float32 features in, reused probabilities out
+        bufs = self._layer_buffers(x.shape[0])
+        h = bufs[0]
+        np.subtract(x, self.mean, out=h)
+        h *= self.inv_scale
+        for w, s, b, act, out in zip(self.weights, self.scales, self.biases, self.activations, bufs[1:]):
+            wf = _scratch(w.size).reshape(w.shape)
+            np.copyto(wf, w)
+            np.matmul(h, wf, out=out)
+            if s is not None:
+                #per output channel, so the scale applies to the layer output instead of every weight
+                out *= s
+            out += b
+            _activate(out, act)
+            h = out
+        return h
+
+    @property
+    def nbytes(self):
+        #resident weights, the scratch buffer is shared by every quantized model on the thread
+        return sum(a.nbytes for a in self.weights + self.biases + [s for s in self.scales if s is not None])
+
+def dense_layers(model):
+    #(weights, biases, activations) of a keras Dense stack, dropout is a no-op at inference
+    weights, biases, activations = [], [], []
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind in ('Dropout', 'InputLayer'):
+            continue
+        if kind != 'Dense':
+            raise ValueError(f"Unsupported layer for NumpyMLP: {kind}")
+        w, b = layer.get_weights()
+        weights.append(w)
+        biases.append(b)
+        activations.append(layer.activation.__name__)
+    return weights, biases, activations
+
+def fold_scaler(w, b, scaler):
+    #(x - mean) / scale @ W + b  ==  x @ (W / scale) + (b - (mean / scale) @ W)
+    w = np.asarray(w, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    mean = getattr(scaler, 'mean_', None)
+    scale = getattr(scaler, 'scale_', None)
+    mean = np.zeros(w.shape[0]) if mean is None else np.asarray(mean, dtype=np.float64)
+    scale = np.ones(w.shape[0]) if scale is None else np.asarray(scale, dtype=np.float64)
+    w_folded = w / scale[:, None]
+    b_folded = b - (mean / scale) @ w
+    return w_folded.astype(np.float32), b_folded.astype(np.float32)
+
+class _Normalization:
+    #the two StandardScaler attributes fold_scaler reads
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+
+def save_artifact(path, model, scaler):
+    #unfolded weights plus the normalization constants, so the file says what was trained
+    weights, biases, activations = dense_layers(model)
+    arrays = {f'w{i}': w for i, w in enumerate(weights)}
+    arrays.update({f'b{i}': b for i, b in enumerate(biases)})
+    #uncompressed and aligned so the arrays can also be memory-mapped straight from the file
+    write_npz(path, format_version=np.int32(ARTIFACT_VERSION), n_layers=np.int32(len(weights)),
+             activations=np.array(activations), mean=np.asarray(scaler.mean_, dtype=np.float64),
+             scale=np.asarray(scaler.scale_, dtype=np.float64),
+             feature_names=np.array([str(f) for f in scaler.feature_names_in_]), **arrays)
+
+def _latency_summary(samples):
+    ms = np.asarray(samples) * 1000.0
+    return {'mean_ms': float(ms.mean()), 'p50_ms': float(np.percentile(ms, 50)), 'p99_ms': float(np.percentile(ms, 99))}
+
+def compare_backends(character_id, n_frames=500):
+    #replay recorded frames through the keras path and the numpy path, report agreement and latency
+    from bot import Bot
+    from game_state import GameState
+    from recorded_frames import default_dataset, load_recorded_states
+
+    states = [GameState(d) for d in load_recorded_states(default_dataset(character_id), limit=n_frames)]
+    #without the decision cache, a cached window would be timed as a free forward pass
+    keras_bot = Bot(player_id=character_id, backend='keras', cache_size=0)
+    numpy_bot = Bot(player_id=character_id, backend='numpy', cache_size=0)
+
+    keras_times, numpy_times = [], []
+    max_diff = 0.0
+    for gs in states:
+        t0 = time.perf_counter()
+        keras_preds = keras_bot.predict_buttons(gs)
+        t1 = time.perf_counter()
+        numpy_preds = numpy_bot.predict_buttons(gs)
+        t2 = time.perf_counter()
+        keras_times.append(t1 - t0)
+        numpy_times.append(t2 - t1)
+        max_diff = max(max_diff, float(np.abs(np.asarray(keras_preds) - numpy_preds).max()))
+
+    return {
+        'frames': len(states),
+        'max_abs_diff': max_diff,
+        'within_tolerance': max_diff <= PREDICT_ATOL,
+        'keras': _latency_summary(keras_times),
+        'numpy': _latency_summary(numpy_times),
+    }
+
+if __name__ == '__main__':
+    #usage: python fast_inference.py <character_id> [n_frames]
+    cid = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    report = compare_backends(cid, n)
+    print(f"Frames replayed: {report['frames']}")
+    print(f"Max |keras - numpy|: {report['max_abs_diff']:.2e} (tolerance {PREDICT_ATOL:.0e}, {'OK' if report['within_tolerance'] else 'FAILED'})")
+    for name in ('keras', 'numpy'):
+        r = report[name]
+        print(f"{name:>6}: mean {r['mean_ms']:.3f} ms  p50 {r['p50_ms']:.3f} ms  p99 {r['p99_ms']:.3f} ms")
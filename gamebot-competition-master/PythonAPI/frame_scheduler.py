@@ -0,0 +1,163 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from command import Command
+import telemetry
+
+FPS = 60.0
+
+class FramePacer:
+    #paces a loop against monotonic frame deadlines instead of sleeping a fixed 1/fps after the work
+    def __init__(self, fps=FPS):
+        self.period = 1.0 / fps
+        self.next_deadline = time.monotonic() + self.period
+        self.resyncs = 0
+
+    def wait(self):
+        #sleep until the current deadline, then move to the next one
+        now = time.monotonic()
+        if now < self.next_deadline:
+            time.sleep(self.next_deadline - now)
+            self.next_deadline += self.period
+        elif now - self.next_deadline > self.period:
+            #more than a whole frame behind, restart the schedule instead of bursting to catch up
+            self.next_deadline = now + self.period
+            self.resyncs += 1
+        else:
+            self.next_deadline += self.period
+
+class FrameScheduler:
+    #receives frame N+1 on a background thread while frame N is in inference
+    #each frame must be answered within budget * 1/fps of its arrival, otherwise the fallback command is sent
+    #no fixed sleep: the emulator's own frame rate paces the loop
+    #release(gs), if given, is called once a received state is no longer used (dropped, skipped or decided)
+    def __init__(self, receive, send, decide, fps=FPS, budget=0.9, fallback=None, report_every=600, release=None):
+        self._receive = receive
+        self._send = send
+        self._decide = decide
+        self.frame_budget = budget / fps
+        self.fallback = fallback
+        self.report_every = report_every
+        self._release = release
+
+        self._cond = threading.Condition()
+        self._latest = None
+        self._closed = False
+        self.error = None
+        self._pending = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bot-inference')
+        self.last_cmd = None
+
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.commands_sent = 0
+        self.deadline_misses = 0
+        self.late_results = 0
+        self.decide_errors = 0
+
+    def _receive_loop(self):
+        try:
+            while True:
+                gs = self._receive()
+                arrived = time.monotonic()
+                with self._cond:
+                    if self._latest is not None:
+                        #bot is behind, only the newest state matters
+                        self.frames_dropped += 1
+                        if self._release is not None:
+                            self._release(self._latest[0])
+                    self._latest = (gs, arrived)
+                    self.frames_received += 1
+                    self._cond.notify()
+        except Exception as e:
+            with self._cond:
+                self.error = e
+                self._closed = True
+                self._cond.notify()
+
+    def _take_latest(self):
+        with self._cond:
+            while self._latest is None and not self._closed:
+                self._cond.wait()
+            latest, self._latest = self._latest, None
+            return latest
+
+    def fallback_command(self):
+        if self.last_cmd is not None:
+            return self.last_cmd
+        if self.fallback is not None:
+            return self.fallback
+        return Command()
+
+    def _result(self, timeout=None):
+        #the pending command, or None when decide raised: the frame is answered like a missed deadline
+        try:
+            return self._pending.result(timeout=timeout)
+        except FutureTimeout:
+            raise
+        except Exception as e:
+            self.decide_errors += 1
+            telemetry.log('WARNING', "[Scheduler] Decide failed (%d so far): %r", self.decide_errors, e)
+            return None
+
+    def step(self, gs, deadline):
+        #a result that finished after its own deadline still becomes the newest fallback
+        if self._pending is not None and self._pending.done():
+            cmd = self._result()
+            self._pending = None
+            if cmd is not None:
+                self.last_cmd = cmd
+                self.late_results += 1
+        if self._pending is None:
+            self._pending = self._executor.submit(self._decide, gs)
+            if self._release is not None:
+                self._pending.add_done_callback(lambda _, gs=gs: self._release(gs))
+        elif self._release is not None:
+            #the previous frame is still in inference, this one is answered with the fallback and never decided
+            self._release(gs)
+        try:
+            cmd = self._result(timeout=max(0.0, deadline - time.monotonic()))
+            self._pending = None
+            if cmd is None:
+                cmd = self.fallback_command()
+            else:
+                self.last_cmd = cmd
+        except FutureTimeout:
+            self.deadline_misses += 1
+            cmd = self.fallback_command()
+        self._send(cmd)
+        self.commands_sent += 1
+        if self.report_every and self.commands_sent % self.report_every == 0:
+            telemetry.info("%s", self.summary())
+
+    def run(self):
+        receiver = threading.Thread(target=self._receive_loop, name='frame-receiver', daemon=True)
+        receiver.start()
+        try:
+            while True:
+                latest = self._take_latest()
+                if latest is None:
+                    break
+                gs, arrived = latest
+                self.step(gs, arrived + self.frame_budget)
+        finally:
+            self._executor.shutdown(wait=False)
+        telemetry.log('WARNING', "[Scheduler] Connection closed: %r", self.error)
+        telemetry.info("%s", self.summary())
+
+    def stats(self):
+        return {
+            'frames_received': self.frames_received,
+            'frames_dropped': self.frames_dropped,
+            'commands_sent': self.commands_sent,
+            'deadline_misses': self.deadline_misses,
+            'late_results': self.late_results,
+            'decide_errors': self.decide_errors,
+        }
+
+    def summary(self):
+        s = self.stats()
+        miss_rate = s['deadline_misses'] / s['commands_sent'] if s['commands_sent'] else 0.0
+        return (f"[Scheduler] sent {s['commands_sent']} | received {s['frames_received']} | "
+                f"dropped {s['frames_dropped']} | deadline misses {s['deadline_misses']} ({miss_rate:.1%}) | "
+                f"late results {s['late_results']} | decide errors {s['decide_errors']}")
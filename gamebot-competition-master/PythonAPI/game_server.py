@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import select
+import socket
+import sys
+import time
+from frame_scheduler import FramePacer
+from recorded_frames import GAME_STATE_DUMP, default_dataset, load_states
+from stream_decoder import StreamDecoder
+from telemetry import Histogram
+
+#stand-in for the BizHawk Lua side: connects to a controller port, sends recorded game states in the
+#json shape GameState.dict_to_object expects and waits for each command, like the emulator does per frame
+#  python game_server.py --player 1 --source ../current_game_state0.txt
+#  python game_server.py --player 1 --character 7 --fps 0 --frames 5000    (unthrottled)
+#same SF_PORT_BASE as controller.py
+PORT_BASE = int(os.environ.get('SF_PORT_BASE', '9999'))
+PORTS = {'1': PORT_BASE, '2': PORT_BASE + 1}
+
+def connect(port, host='127.0.0.1', timeout=60.0):
+    #the controller listens, so retry until it is up
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+class GameServer:
+    def __init__(self, sock, states, fps=60.0, reply_timeout=1.0):
+        self.sock = sock
+        self.payloads = [json.dumps(s).encode() for s in states]
+        self.fps = fps
+        self.reply_timeout = reply_timeout
+        self.decoder = StreamDecoder()
+        self.rtt = Histogram()
+        self.rtts = []
+        self.frames_sent = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.late_replies = 0
+        self.bad_replies = 0
+        self.seconds = 0.0
+
+    def _drain_late(self):
+        #commands for frames that already timed out must not be taken as the answer to the next one
+        while not self.decoder.closed and select.select([self.sock], [], [], 0)[0]:
+            if self.decoder.recv_from(self.sock) == 0:
+                break
+        while self.decoder.pop_raw() is not None:
+            self.late_replies += 1
+
+    def _await_reply(self):
+        #one command per state; a controller that is too slow gets counted and the next frame goes out anyway
+        self.sock.settimeout(self.reply_timeout)
+        try:
+            raw = self.decoder.next_raw(self.sock)
+        except socket.timeout:
+            self.timeouts += 1
+            return None
+        finally:
+            self.sock.settimeout(None)
+        try:
+            cmd = json.loads(raw)
+            if 'p1' not in cmd or 'p2' not in cmd:
+                raise ValueError
+        except ValueError:
+            self.bad_replies += 1
+        self.replies += 1
+        return raw
+
+    def run(self, n_frames=None, loop=False):
+        #sends n_frames states (default all of them once, or cycling with loop) and returns stats()
+        n_frames = n_frames or len(self.payloads)
+        if not loop:
+            n_frames = min(n_frames, len(self.payloads))
+        pacer = FramePacer(self.fps) if self.fps else None
+        t_start = time.perf_counter()
+        for i in range(n_frames):
+            payload = self.payloads[i % len(self.payloads)]
+            if self.timeouts:
+                self._drain_late()
+            t0 = time.perf_counter()
+            self.sock.sendall(payload)
+            self.frames_sent += 1
+            if self._await_reply() is not None:
+                rtt = time.perf_counter() - t0
+                self.rtt.add(rtt)
+                self.rtts.append(rtt)
+            if pacer is not None:
+                pacer.wait()
+        self.seconds = time.perf_counter() - t_start
+        return self.stats()
+
+    def stats(self):
+        s = {
+            'frames_sent': self.frames_sent,
+            'replies': self.replies,
+            'timeouts': self.timeouts,
+            'late_replies': self.late_replies,
+            'bad_replies': self.bad_replies,
+            'seconds': self.seconds,
+            'fps': self.frames_sent / self.seconds if self.seconds else 0.0,
+            'target_fps': self.fps,
+        }
+        s.update({f'rtt_{k}': v for k, v in self.rtt.summary().items() if k != 'count'})
+        return s
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded game states to a controller over the game socket protocol")
+    parser.add_argument('--player', choices=sorted(PORTS), default='1', help="connect to this player's controller port")
+    parser.add_argument('--port', type=int, help="override the port")
+    parser.add_argument('--source', help="normalized_dataset csv or tab separated game state dump (.txt)")
+    parser.add_argument('--character', type=int, help="use normalized_character_datasets/normalized_dataset_<id>.csv")
+    parser.add_argument('--fps', type=float, default=60.0, help="frames per second, 0 sends the next state as soon as the command is back")
+    parser.add_argument('--frames', type=int, help="number of states to send, default every state once")
+    parser.add_argument('--loop', action='store_true', help="cycle through the states until --frames have been sent")
+    parser.add_argument('--timeout', type=float, default=1.0, help="seconds to wait for each command")
+    parser.add_argument('--json', help="write the stats and per-frame round trip times (ms) to this file")
+    args = parser.parse_args(argv)
+
+    source = args.source or (default_dataset(args.character) if args.character is not None else GAME_STATE_DUMP)
+    states = load_states(source)
+    port = args.port or PORTS[args.player]
+    print(f"Loaded {len(states)} states from {source}, connecting to port {port}")
+    sock = connect(port)
+    try:
+        server = GameServer(sock, states, fps=args.fps, reply_timeout=args.timeout)
+        stats = server.run(args.frames, args.loop)
+    finally:
+        sock.close()
+    print(f"Sent {stats['frames_sent']} frames in {stats['seconds']:.2f}s ({stats['fps']:.1f} fps), "
+          f"{stats['replies']} commands, {stats['timeouts']} timeouts ({stats['late_replies']} answered late), {stats['bad_replies']} malformed")
+    print(f"Round trip: mean {stats['rtt_mean_ms']:.2f} ms  p50 {stats['rtt_p50_ms']:.2f} ms  "
+          f"p95 {stats['rtt_p95_ms']:.2f} ms  p99 {stats['rtt_p99_ms']:.2f} ms  max {stats['rtt_max_ms']:.2f} ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'source': source, 'port': port, **stats, 'rtt_ms': [r * 1000 for r in server.rtts]}, f)
+    return stats
+
+if __name__ == '__main__':
+    stats = main()
+    sys.exit(0 if stats['replies'] else 1)
@@ -1,16 +1,50 @@
+import json
+import threading
 from player import Player
 
 class GameState:
+    __slots__ = ('player1', 'player2', 'timer', 'fight_result', 'has_round_started', 'is_round_over')
 
-    def __init__(self, input_dict):
-
-        self.dict_to_object(input_dict)
+    def __init__(self, input_dict=None):
+        self.player1 = Player()
+        self.player2 = Player()
+        if input_dict is not None:
+            self.dict_to_object(input_dict)
 
     def dict_to_object(self, input_dict):
-
-        self.player1 = Player(input_dict['p1'])
-        self.player2 = Player(input_dict['p2'])
+        #fills this state in place, the two Players and their Buttons are reused
+        self.player1.dict_to_object(input_dict['p1'])
+        self.player2.dict_to_object(input_dict['p2'])
         self.timer = input_dict['timer']
         self.fight_result = input_dict['result']
         self.has_round_started = input_dict['round_started']
-        self.is_round_over = input_dict['round_over']
\ No newline at end of file
+        self.is_round_over = input_dict['round_over']
+
+    @classmethod
+    def decode(cls, raw, into=None):
+        #parses one json message from the emulator into a reused state (into) or a new one
+        gs = into if into is not None else cls()
+        gs.dict_to_object(json.loads(raw))
+        return gs
+
+class GameStatePool:
+    #recycles GameState objects between frames: whoever finishes with a state (dropped, or decided) releases it
+    #acquire never blocks, an empty pool makes a new state, so the pool only grows to the number in flight
+    def __init__(self):
+        self._free = []
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.created += 1
+        return GameState()
+
+    def release(self, gs):
+        with self._lock:
+            self._free.append(gs)
+
+    def decode(self, raw):
+        return GameState.decode(raw, self.acquire())
@@ -1,17 +1,27 @@
+import atexit
 import csv
 import os
+import queue
+import threading
+import time
 from game_state import GameState
 from buttons import Buttons
-from listen_to_key import get_current_keypress
+import telemetry
 
 #define feilds
 BUTTONS = ['Up', 'Down', 'Right', 'Left', 'Select', 'Start', 'Y', 'B', 'X', 'A', 'L', 'R']
 FIELDNAMES = ['timer', 'fight_result', 'has_round_started', 'is_round_over','player1_id', 'p1_health', 'p1_x', 'p1_y', 'p1_jumping', 'p1_crouching', 'p1_in_move', 'p1_move_id'] + [f'player1_buttons_{b.lower()}' for b in BUTTONS] + ['player2_id', 'p2_health', 'p2_x', 'p2_y', 'p2_jumping', 'p2_crouching', 'p2_in_move', 'p2_move_id']  + ['diff_x', 'diff_y', 'diff_health']
 
+#SF_RECORD_ROTATE=1 writes each recording session to normalized_character_datasets/sessions/<session>/ instead of appending
+ROTATE_SESSIONS = os.environ.get('SF_RECORD_ROTATE') == '1'
+
 _last_keys = None
+_recorder = None
 
-def get_output_file(character_id):
-    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'normalized_character_datasets'))
+def get_output_file(character_id, session_id=None, base_dir=None):
+    base_dir = base_dir or os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'normalized_character_datasets'))
+    if session_id is not None:
+        base_dir = os.path.join(base_dir, 'sessions', session_id)
     os.makedirs(base_dir, exist_ok=True)
     return os.path.join(base_dir, f'normalized_dataset_{character_id}.csv')
 
@@ -21,6 +31,91 @@ def ensure_file_exists(filename):
             writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
             writer.writeheader()
 
+class DatasetRecorder:
+    #rows are handed to a writer thread through a bounded queue so the control loop never waits on disk
+    #the writer keeps one open handle per character file and flushes on round end, every flush_every seconds and on close
+    _CLOSE = object()
+
+    def __init__(self, rotate=ROTATE_SESSIONS, queue_size=4096, flush_every=2.0, base_dir=None):
+        self.session_id = time.strftime('%Y%m%d-%H%M%S') if rotate else None
+        #base_dir overrides normalized_character_datasets/ (the benchmarks record into a temporary directory)
+        self.base_dir = base_dir
+        self.flush_every = flush_every
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._files = {}
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self._thread = threading.Thread(target=self._run, name='dataset-recorder', daemon=True)
+        self._thread.start()
+
+    def submit(self, character_id, row):
+        try:
+            self._queue.put_nowait((character_id, row))
+        except queue.Full:
+            #the writer fell behind, losing a row is better than stalling the frame
+            self.rows_dropped += 1
+            if self.rows_dropped == 1:
+                telemetry.log('WARNING', "[Recorder] Queue full, dropping rows")
+
+    def _writer(self, character_id):
+        entry = self._files.get(character_id)
+        if entry is None:
+            output_file = get_output_file(character_id, self.session_id, self.base_dir)
+            ensure_file_exists(output_file)
+            f = open(output_file, mode='a', newline='')
+            entry = self._files[character_id] = (f, csv.DictWriter(f, fieldnames=FIELDNAMES))
+        return entry[1]
+
+    def _flush(self):
+        for f, _ in self._files.values():
+            f.flush()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        closing = False
+        while not closing:
+            try:
+                item = self._queue.get(timeout=self.flush_every)
+            except queue.Empty:
+                item = None
+            #write everything that is already queued in one go
+            batch = []
+            while item is not None:
+                if item is self._CLOSE:
+                    closing = True
+                    break
+                batch.append(item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            round_over = False
+            for character_id, row in batch:
+                self._writer(character_id).writerow(row)
+                round_over = round_over or bool(row['is_round_over'])
+            self.rows_written += len(batch)
+            now = time.monotonic()
+            if closing or round_over or now - last_flush >= self.flush_every:
+                self._flush()
+                last_flush = now
+        for f, _ in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        self._queue.put(self._CLOSE)
+        self._thread.join()
+        telemetry.info("[Recorder] %d rows written, %d dropped", self.rows_written, self.rows_dropped)
+
+def get_recorder():
+    global _recorder
+    if _recorder is None:
+        _recorder = DatasetRecorder()
+        atexit.register(_recorder.close)
+    return _recorder
+
 def record_frame(gs: GameState, keys: list):
     global _last_keys
      
@@ -29,7 +124,8 @@ def record_frame(gs: GameState, keys: list):
         return
         
     #debug flag
-    print(f"Raw keys received: {keys}")
+    if telemetry.DEBUG:
+        telemetry.debug(f"Raw keys received: {keys}")
 
     _last_keys = '+'.join(sorted(keys))
     
@@ -70,7 +166,8 @@ def record_frame(gs: GameState, keys: list):
     bd1 = p1_buttons.object_to_dict()
     
     #debug print
-    print(f"Button mapping: {bd1}")
+    if telemetry.DEBUG:
+        telemetry.debug(f"Button mapping: {bd1}")
     
     #update rows with button values true
     for b in BUTTONS:
@@ -82,12 +179,5 @@ def record_frame(gs: GameState, keys: list):
     #     for b in BUTTONS:
     #         row[f'player2_buttons_{b.lower()}'] = bd2[b]
 
-    #input into file based on character id
-    character_id = gs.player1.player_id
-    output_file = get_output_file(character_id)
-    ensure_file_exists(output_file)
-
-    #add row to file
-    with open(output_file, mode='a', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-        writer.writerow(row)
\ No newline at end of file
+    #queue the row for the file of this character, the writer thread does the file io
+    get_recorder().submit(gs.player1.player_id, row)
@@ -0,0 +1,219 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from fast_inference import QUANTIZATIONS, NumpyMLP, QuantizedMLP
+import telemetry
+
+#keeps loaded character models so a Bot can be built without touching the disk or tracing predict:
+#  SF_PRELOAD=1,7,11 | all     models to load and warm up at startup (default none, loaded on first use)
+#  SF_MODEL_CACHE_MB=<n>       least recently used models are evicted above this estimate (default 512)
+#  SF_MMAP_WEIGHTS=1           npz, int8 and fp16 weights are memory-mapped from the artifact, so every process
+#                              running the same model shares one read-only copy (see orchestrator.py)
+#  SF_MODEL_DIR=<dir>          load model_<id> from another directory with the models/ layout, e.g. models/students
+#tensorflow, joblib/sklearn and pandas are only imported for .keras models, the npz, int8 and fp16 backends run on numpy alone
+MODEL_DIR = os.path.abspath(os.environ.get('SF_MODEL_DIR') or os.path.join(os.path.dirname(__file__), '..', 'models'))
+N_CHARACTERS = 12
+PRELOAD = os.environ.get('SF_PRELOAD', '')
+CACHE_MB = float(os.environ.get('SF_MODEL_CACHE_MB', '512'))
+MMAP_WEIGHTS = os.environ.get('SF_MMAP_WEIGHTS', '0') == '1'
+
+#backends that read an artifact instead of the .keras model
+ARTIFACT_EXTENSIONS = {'npz': 'npz', 'int8': 'int8.npz', 'fp16': 'fp16.npz'}
+
+def model_path(character_id, model_dir=MODEL_DIR, backend='keras'):
+    #npz reads the artifact written by export_models.py, int8 and fp16 the variants written by quantize_models.py
+    ext = ARTIFACT_EXTENSIONS.get(backend, 'keras')
+    return os.path.join(model_dir, f'model_{character_id}.{ext}')
+
+def parse_preload(spec=PRELOAD):
+    #"1,7,11" -> [1, 7, 11], "all" -> every character with a model on disk
+    spec = spec.strip()
+    if not spec:
+        return []
+    if spec == 'all':
+        return [cid for cid in range(N_CHARACTERS)
+                if os.path.exists(model_path(cid)) or os.path.exists(model_path(cid, backend='npz'))]
+    return [int(cid) for cid in spec.split(',') if cid.strip()]
+
+def _rss_bytes():
+    #resident set size from /proc, None where it is not available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+class LoadedModel:
+    #a model with its scaler (and the numpy forward pass for that backend), ready for Bot
+    def __init__(self, character_id, path, model, scaler, mlp=None):
+        self.character_id = character_id
+        self.path = path
+        self.model = model
+        self.scaler = scaler
+        self.mlp = mlp
+        #DecisionCache of the bots using this model, set by Bot
+        self.cache = None
+        self.load_seconds = 0.0
+        self.warmup_seconds = 0.0
+        self.nbytes = 0
+
+    def warm_up(self):
+        #the first predict traces the keras function, do it here instead of in a live frame
+        t0 = time.perf_counter()
+        if self.model is not None:
+            import pandas as pd
+            n_features = self.model.input_shape[-1]
+            x = self.scaler.transform(pd.DataFrame(np.zeros((1, n_features)), columns=self.scaler.feature_names_in_))
+            self.model.predict(x, verbose=0)
+        if self.mlp is not None:
+            self.mlp.predict(np.zeros((1, self.mlp.n_inputs), dtype=np.float32))
+        self.warmup_seconds = time.perf_counter() - t0
+
+def load_model(path, backend='keras', character_id=None, warm=True, mmap=MMAP_WEIGHTS):
+    t0 = time.perf_counter()
+    rss0 = _rss_bytes()
+    if backend == 'npz':
+        model = scaler = None
+        mlp = NumpyMLP.from_artifact(path, mmap)
+    elif backend in QUANTIZATIONS:
+        model = scaler = None
+        mlp = QuantizedMLP.from_artifact(path, mmap)
+    else:
+        import joblib
+        import tensorflow as tf
+        model = tf.keras.models.load_model(path)
+        scaler = joblib.load(path + '.scaler')
+        mlp = NumpyMLP.from_keras(model, scaler) if backend == 'numpy' else None
+    loaded = LoadedModel(character_id, path, model, scaler, mlp)
+    loaded.load_seconds = time.perf_counter() - t0
+    if warm:
+        loaded.warm_up()
+    rss1 = _rss_bytes()
+    #what the process grew by, never less than the weights themselves
+    weights = mlp.nbytes if model is None else \
+        sum(w.size * w.itemsize for w in model.get_weights())
+    loaded.nbytes = max(weights, rss1 - rss0) if rss0 is not None else weights
+    return loaded
+
+class ModelRegistry:
+    #LRU cache of LoadedModel by character id, safe to use from the inference and preload threads
+    def __init__(self, backend='keras', model_dir=MODEL_DIR, max_bytes=CACHE_MB * 1e6, warm=True):
+        self.backend = backend
+        self.model_dir = model_dir
+        self.max_bytes = max_bytes
+        self.warm = warm
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        #one load at a time, a get() for a model that is being preloaded waits for it
+        self._load_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.history = []
+
+    def __contains__(self, character_id):
+        with self._lock:
+            return character_id in self._models
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(m.nbytes for m in self._models.values())
+
+    def _lookup(self, character_id):
+        with self._lock:
+            loaded = self._models.get(character_id)
+            if loaded is not None:
+                self._models.move_to_end(character_id)
+            return loaded
+
+    def get(self, character_id):
+        loaded = self._lookup(character_id)
+        if loaded is not None:
+            self.hits += 1
+            return loaded
+        with self._load_lock:
+            loaded = self._lookup(character_id)
+            if loaded is not None:
+                self.hits += 1
+                return loaded
+            self.misses += 1
+            return self._load(character_id)
+
+    def _load(self, character_id):
+        loaded = load_model(model_path(character_id, self.model_dir, self.backend), self.backend, character_id, self.warm)
+        self.history.append(loaded)
+        telemetry.info("[Registry] model_%s: load %.0f ms, warm-up %.0f ms, ~%.1f MB",
+                       character_id, loaded.load_seconds * 1000, loaded.warmup_seconds * 1000, loaded.nbytes / 1e6)
+        with self._lock:
+            self._models[character_id] = loaded
+            #the model just loaded is never the one evicted
+            while len(self._models) > 1 and sum(m.nbytes for m in self._models.values()) > self.max_bytes:
+                evicted, _ = self._models.popitem(last=False)
+                self.evictions += 1
+                telemetry.info("[Registry] Evicted model_%s (cache over %.0f MB)", evicted, self.max_bytes / 1e6)
+        return loaded
+
+    def preload(self, character_ids, background=False):
+        #load and warm up each model, in a daemon thread when background is set
+        def run():
+            for cid in character_ids:
+                try:
+                    self.get(cid)
+                except Exception as e:
+                    telemetry.log('WARNING', "[Registry] Could not preload model_%s: %r", cid, e)
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name='model-preload', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'cached': list(self._models),
+            'cached_mb': self.total_bytes() / 1e6,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'loads': [{'character_id': m.character_id, 'load_ms': m.load_seconds * 1000,
+                       'warmup_ms': m.warmup_seconds * 1000, 'mb': m.nbytes / 1e6} for m in self.history],
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"[Registry] {len(s['cached'])} cached ({s['cached_mb']:.1f} MB) | hits {s['hits']} | "
+                f"misses {s['misses']} | evictions {s['evictions']}")
+
+if __name__ == '__main__':
+    #usage: python model_registry.py [keras|numpy|npz|int8|fp16] [character ids...]
+    #preloads the models, then shows what a Bot pays for a cached model against a cold one
+    backend = sys.argv[1] if len(sys.argv) > 1 else 'keras'
+    ids = [int(a) for a in sys.argv[2:]] or parse_preload('all')
+    registry = ModelRegistry(backend=backend)
+    t0 = time.perf_counter()
+    registry.preload(ids)
+    print(f"Preloaded {len(ids)} models in {time.perf_counter() - t0:.1f}s")
+    print(f"{'model':<10}{'load ms':>10}{'warm-up ms':>12}{'MB':>8}")
+    for m in registry.history:
+        print(f"model_{m.character_id:<4}{m.load_seconds * 1000:>10.0f}{m.warmup_seconds * 1000:>12.0f}{m.nbytes / 1e6:>8.1f}")
+
+    from bot import Bot
+    from recorded_frames import default_dataset, load_recorded_states
+    from game_state import GameState
+    #a character with a recorded dataset to take a real game state from
+    cid = next((i for i in ids if os.path.exists(default_dataset(i))), ids[0])
+    gs = GameState(load_recorded_states(default_dataset(cid if os.path.exists(default_dataset(cid)) else 1), limit=1)[0])
+    t0 = time.perf_counter()
+    bot = Bot(player_id=cid, backend=backend, loaded=registry.get(cid))
+    bot.fight(gs, "1")
+    cached = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    bot = Bot(player_id=cid, backend=backend)
+    bot.fight(gs, "1")
+    cold = time.perf_counter() - t0
+    print(f"Bot + first decision for model_{cid}: {cached * 1000:.1f} ms from the registry, {cold * 1000:.0f} ms cold")
+    print(registry.summary())
@@ -0,0 +1,274 @@
+import argparse
+import itertools
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+#runs many matches on one host: every session gets its own port pair (SF_PORT_BASE), one controller.py "both"
+#process playing both sides, and its game side - two game_server.py stand-ins replaying each character's
+#recording, or an emulator started from a --game-cmd template. Sessions are pinned to cores, share the
+#memory-mapped model weights (SF_MMAP_WEIGHTS=1), and a crashed session is restarted up to --restarts times
+#  python orchestrator.py --matchups 7:2 1:11 --parallel 2 --frames 3000
+#  python orchestrator.py --tournament 1 2 7 11 --parallel 4 --backend int8 --json tournament.json
+#  python orchestrator.py --game-cmd "EmuHawk.exe --lua=bot.lua --port1={port1} --port2={port2}" --matchups 7:2
+HERE = os.path.dirname(os.path.abspath(__file__))
+PORT_BASE = 20000
+POLL = 0.2
+
+def _pss_mb(pid):
+    #proportional set size: pages shared with other sessions (mapped weights, libraries) are split between them
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def _cpu_seconds(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except OSError:
+        return None
+
+def _pin(pid, core):
+    #linux only, elsewhere the scheduler decides
+    if core is not None and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(pid, {core})
+        except OSError:
+            pass
+
+class Session:
+    #one match: a controller for both players and the game side, restarted together when either crashes
+    def __init__(self, index, p1, p2, port_base, core, args, log_dir):
+        self.index = index
+        self.p1, self.p2 = p1, p2
+        self.ports = (port_base, port_base + 1)
+        self.core = core
+        self.args = args
+        self.log_dir = os.path.join(log_dir, f'session_{index}_{p1}v{p2}')
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.controller = None
+        self.game = []
+        self.restarts = 0
+        self.status = 'pending'
+        self.error = None
+        self.started = None
+        self.seconds = 0.0
+        self.peak_pss_mb = 0.0
+        self.cpu_seconds = 0.0
+
+    def _spawn(self, argv, name, env=None):
+        log = open(os.path.join(self.log_dir, f'{name}.log'), 'a')
+        proc = subprocess.Popen(argv, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+        _pin(proc.pid, self.core)
+        return proc
+
+    def _game_argv(self):
+        if self.args.game_cmd:
+            cmd = self.args.game_cmd.format(port1=self.ports[0], port2=self.ports[1], p1=self.p1, p2=self.p2, session=self.index)
+            return [shlex.split(cmd)]
+        argvs = []
+        for port, character in zip(self.ports, (self.p1, self.p2)):
+            argv = [sys.executable, 'game_server.py', '--port', str(port), '--character', str(character),
+                    '--fps', str(self.args.fps), '--timeout', str(self.args.timeout),
+                    '--json', os.path.join(self.log_dir, f'port_{port}.json')]
+            if self.args.frames:
+                argv += ['--frames', str(self.args.frames), '--loop']
+            argvs.append(argv)
+        return argvs
+
+    def start(self):
+        for port in self.ports:
+            path = os.path.join(self.log_dir, f'port_{port}.json')
+            if os.path.exists(path):
+                os.remove(path)
+        env = dict(os.environ, SF_PORT_BASE=str(self.ports[0]), SF_PRELOAD=f'{self.p1},{self.p2}',
+                   SF_MMAP_WEIGHTS='1' if self.args.share_weights else '0')
+        self.controller = self._spawn([sys.executable, 'controller.py', 'both', 'bot', self.args.backend], 'controller', env)
+        self.game = [self._spawn(argv, f'game_{i}') for i, argv in enumerate(self._game_argv())]
+        self.status = 'running'
+        self.started = time.monotonic()
+
+    def stop(self):
+        for proc in self.game + [self.controller]:
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+        for proc in self.game + [self.controller]:
+            if proc is not None:
+                try:
+                    proc.wait(5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+
+    def _sample(self):
+        pss = _pss_mb(self.controller.pid)
+        if pss is not None:
+            self.peak_pss_mb = max(self.peak_pss_mb, pss)
+        cpu = _cpu_seconds(self.controller.pid)
+        if cpu is not None:
+            self.cpu_seconds = cpu
+
+    def _failed(self, reason):
+        #restart the whole session, the game side cannot reconnect to a new controller mid-match
+        self.stop()
+        if self.restarts >= self.args.restarts:
+            self.status = 'failed'
+            self.error = reason
+            return
+        self.restarts += 1
+        print(f"[Orchestrator] session {self.index} ({self.p1} vs {self.p2}): {reason}, restart {self.restarts}/{self.args.restarts}")
+        self.start()
+
+    def poll(self):
+        #advances the session and returns its status
+        if self.status != 'running':
+            return self.status
+        self._sample()
+        codes = [proc.poll() for proc in self.game]
+        controller_code = self.controller.poll()
+        if any(code not in (None, 0) for code in codes):
+            self._failed(f"game side exited with {[c for c in codes if c not in (None, 0)][0]}")
+        elif all(code == 0 for code in codes):
+            #the controller leaves on its own once both players disconnected
+            try:
+                self.controller.wait(10)
+            except subprocess.TimeoutExpired:
+                self.controller.terminate()
+                self.controller.wait()
+            self.seconds = time.monotonic() - self.started
+            self.status = 'done'
+        elif controller_code is not None:
+            self._failed(f"controller exited with {controller_code}")
+        elif self.args.session_timeout and time.monotonic() - self.started > self.args.session_timeout:
+            self.stop()
+            self.status = 'failed'
+            self.error = f"still running after {self.args.session_timeout:.0f}s"
+        return self.status
+
+    def result(self):
+        r = {'session': self.index, 'p1': self.p1, 'p2': self.p2, 'ports': list(self.ports), 'core': self.core,
+             'status': self.status, 'error': self.error, 'restarts': self.restarts, 'seconds': self.seconds,
+             'controller_cpu_s': self.cpu_seconds, 'controller_peak_pss_mb': self.peak_pss_mb, 'log_dir': self.log_dir,
+             'players': {}}
+        for player, port in zip(('1', '2'), self.ports):
+            path = os.path.join(self.log_dir, f'port_{port}.json')
+            if os.path.exists(path):
+                with open(path) as f:
+                    stats = json.load(f)
+                stats.pop('rtt_ms', None)
+                r['players'][player] = stats
+        return r
+
+def matchups_from(args):
+    if args.tournament:
+        pairs = list(itertools.combinations(args.tournament, 2))
+    else:
+        pairs = [tuple(int(c) for c in m.split(':')) for m in args.matchups]
+    return pairs * args.repeat
+
+def run(pairs, args):
+    #at most args.parallel sessions at a time; a finished slot (its ports and core) takes the next matchup
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix='sf_orchestrator_')
+    queue = list(enumerate(pairs))
+    slots = [None] * args.parallel
+    finished = []
+    t0 = time.monotonic()
+    try:
+        while queue or any(slots):
+            for slot, session in enumerate(slots):
+                if session is not None and session.poll() in ('done', 'failed'):
+                    print(f"[Orchestrator] session {session.index} ({session.p1} vs {session.p2}) {session.status} "
+                          f"after {time.monotonic() - session.started:.1f}s, {session.restarts} restart(s)")
+                    finished.append(session)
+                    slots[slot] = session = None
+                if session is None and queue:
+                    index, (p1, p2) = queue.pop(0)
+                    core = cores[slot % len(cores)] if cores and args.pin else None
+                    slots[slot] = Session(index, p1, p2, args.port_base + 2 * slot, core, args, log_dir)
+                    slots[slot].start()
+            time.sleep(POLL)
+    finally:
+        for session in slots:
+            if session is not None:
+                session.stop()
+    wall = time.monotonic() - t0
+    return aggregate([s.result() for s in sorted(finished, key=lambda s: s.index)], wall, args)
+
+def aggregate(sessions, wall, args):
+    players = [p for s in sessions if s['status'] == 'done' for p in s['players'].values()]
+    frames = sum(p['frames_sent'] for p in players)
+    total = {
+        'sessions': len(sessions),
+        'done': sum(s['status'] == 'done' for s in sessions),
+        'failed': sum(s['status'] == 'failed' for s in sessions),
+        'restarts': sum(s['restarts'] for s in sessions),
+        'wall_s': wall,
+        'frames': frames,
+        'frames_per_s': frames / wall if wall else 0.0,
+        'timeouts': sum(p['timeouts'] for p in players),
+        'mean_rtt_p50_ms': sum(p['rtt_p50_ms'] for p in players) / len(players) if players else 0.0,
+        'worst_rtt_p99_ms': max((p['rtt_p99_ms'] for p in players), default=0.0),
+        'controller_pss_mb': sum(s['controller_peak_pss_mb'] for s in sessions),
+    }
+    return {'config': {k: v for k, v in vars(args).items() if k != 'json'}, 'total': total, 'sessions': sessions}
+
+def print_results(results):
+    print(f"\n{'session':>7} {'match':>7} {'ports':>12} {'core':>4} {'status':>7} {'restarts':>8} {'fps p1/p2':>13} "
+          f"{'rtt p50 ms':>11} {'rtt p99 ms':>11} {'timeouts':>8} {'PSS MB':>7} {'cpu s':>6}")
+    for s in results['sessions']:
+        p = [s['players'].get(k, {}) for k in ('1', '2')]
+        fps = '/'.join(f"{x.get('fps', 0):.0f}" for x in p)
+        p50 = max((x.get('rtt_p50_ms', 0) for x in p), default=0)
+        p99 = max((x.get('rtt_p99_ms', 0) for x in p), default=0)
+        timeouts = sum(x.get('timeouts', 0) for x in p)
+        core = '-' if s['core'] is None else s['core']
+        print(f"{s['session']:>7} {s['p1']:>3} v {s['p2']:<2} {s['ports'][0]:>6}/{s['ports'][1]:<5} {core:>4} {s['status']:>7} "
+              f"{s['restarts']:>8} {fps:>13} {p50:>11.2f} {p99:>11.2f} {timeouts:>8} {s['controller_peak_pss_mb']:>7.1f} "
+              f"{s['controller_cpu_s']:>6.1f}")
+    t = results['total']
+    print(f"\n{t['done']}/{t['sessions']} sessions done, {t['failed']} failed, {t['restarts']} restart(s) in {t['wall_s']:.1f}s: "
+          f"{t['frames']} frames ({t['frames_per_s']:.0f} fps over all sessions), {t['timeouts']} timeouts, "
+          f"mean rtt p50 {t['mean_rtt_p50_ms']:.2f} ms, worst p99 {t['worst_rtt_p99_ms']:.2f} ms, "
+          f"controllers {t['controller_pss_mb']:.0f} MB PSS")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run many controller/game sessions on one host")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--matchups', nargs='+', metavar='P1:P2', help="character ids of player 1 and player 2, e.g. 7:2")
+    group.add_argument('--tournament', type=int, nargs='+', metavar='ID', help="every pairing of these characters")
+    parser.add_argument('--repeat', type=int, default=1, help="play every matchup this many times")
+    parser.add_argument('--parallel', type=int, default=os.cpu_count() or 1, help="sessions running at once")
+    parser.add_argument('--backend', default='npz')
+    parser.add_argument('--port-base', type=int, default=PORT_BASE, help="slot i uses ports base + 2i and base + 2i + 1")
+    parser.add_argument('--fps', type=float, default=60.0, help="game side frame rate, 0 runs unthrottled")
+    parser.add_argument('--frames', type=int, default=3600, help="frames per player per session (0 plays each recording once)")
+    parser.add_argument('--timeout', type=float, default=1.0, help="seconds the game side waits for each command")
+    parser.add_argument('--game-cmd', help="start this instead of the game_server.py stand-ins; {port1} {port2} {p1} {p2} {session} are filled in")
+    parser.add_argument('--restarts', type=int, default=2, help="restarts of a crashed session before it counts as failed")
+    parser.add_argument('--session-timeout', type=float, default=0, help="seconds before a session is stopped as failed, 0 waits forever")
+    parser.add_argument('--no-pin', dest='pin', action='store_false', help="do not pin sessions to cores")
+    parser.add_argument('--no-share-weights', dest='share_weights', action='store_false', help="load the weights per process instead of memory-mapping them")
+    parser.add_argument('--log-dir', help="controller and game logs per session, default a new temp directory")
+    parser.add_argument('--json', help="write the per-session and total results to this file")
+    args = parser.parse_args()
+    if args.backend not in ('npz', 'int8', 'fp16') and args.share_weights:
+        print(f"[Orchestrator] the {args.backend} backend loads .keras models, weights are not shared between sessions")
+
+    results = run(matchups_from(args), args)
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if results['total']['failed'] else 0)
@@ -1,19 +1,22 @@
 from buttons import Buttons
 
 class Player:
+    __slots__ = ('player_id', 'health', 'x_coord', 'y_coord', 'is_jumping', 'is_crouching',
+                 'player_buttons', 'is_player_in_move', 'move_id')
+
+    def __init__(self, player_dict=None):
+        self.player_buttons = Buttons()
+        if player_dict is not None:
+            self.dict_to_object(player_dict)
 
-    def __init__(self, player_dict):
-        
-        self.dict_to_object(player_dict)
-    
     def dict_to_object(self, player_dict):
-        
+        #overwrites every field, the Buttons object is reused
         self.player_id = player_dict['character']
         self.health = player_dict['health']
         self.x_coord = player_dict['x']
         self.y_coord = player_dict['y']
         self.is_jumping = player_dict['jumping']
         self.is_crouching = player_dict['crouching']
-        self.player_buttons = Buttons(player_dict['buttons'])
+        self.player_buttons.dict_to_object(player_dict['buttons'])
         self.is_player_in_move = player_dict['in_move']
         self.move_id = player_dict['move']
@@ -0,0 +1,115 @@
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import sys
+import time
+import numpy as np
+from bot import WINDOW_SIZE, resolve_buttons
+from fast_inference import QUANTIZATIONS, NumpyMLP, QuantizedMLP
+from model_registry import MODEL_DIR, N_CHARACTERS, model_path
+from recorded_frames import default_dataset
+
+#writes int8 (per output channel) and float16 variants of models/model_<id>.keras next to it and reports
+#size, latency and button-decision agreement of each variant against the float32 model (model_<id>.npz):
+#  python quantize_models.py [ids...]            quantize (needs tensorflow) and report
+#  python quantize_models.py --report [ids...]   report on the variants already on disk, numpy only
+#run a variant with python controller.py "1" "bot" "int8"
+
+def quantize(character_id, model_dir=MODEL_DIR):
+    import joblib
+    import tensorflow as tf
+    src = model_path(character_id, model_dir)
+    model = tf.keras.models.load_model(src)
+    scaler = joblib.load(src + '.scaler')
+    paths = []
+    for q in QUANTIZATIONS:
+        dst = model_path(character_id, model_dir, backend=q)
+        QuantizedMLP.from_keras(model, scaler, q).save(dst, scaler.feature_names_in_)
+        paths.append(dst)
+    return paths
+
+def _windows(character_id):
+    #recorded windows of the character, or of the first character with a dataset when it has none
+    source = next(cid for cid in [character_id] + list(range(N_CHARACTERS)) if os.path.exists(default_dataset(cid)))
+    return _dataset_windows(source), source
+
+@functools.lru_cache(maxsize=None)
+def _dataset_windows(source):
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'pre_processing')))
+    from window_views import load_character_windows
+    with contextlib.redirect_stdout(io.StringIO()):
+        X, _ = load_character_windows(default_dataset(source), WINDOW_SIZE, dtype=np.float32)
+    return np.ascontiguousarray(X)
+
+def _latency(mlp, X, n_frames):
+    #one frame per call, as in the bot loop
+    times = np.empty(min(n_frames, len(X)))
+    for i in range(len(times)):
+        x = X[i:i + 1]
+        t0 = time.perf_counter()
+        mlp.predict(x)
+        times[i] = time.perf_counter() - t0
+    return times * 1000
+
+def report(character_id, model_dir=MODEL_DIR, n_frames=2000):
+    reference = NumpyMLP.from_artifact(model_path(character_id, model_dir, backend='npz'))
+    X, source = _windows(character_id)
+    ref_probs = np.concatenate([reference.predict(X[i:i + 8192]) for i in range(0, len(X), 8192)])
+    ref_pressed = resolve_buttons(ref_probs)
+    keras_file = model_path(character_id, model_dir)
+    rows = []
+    for backend in ('npz',) + QUANTIZATIONS:
+        path = model_path(character_id, model_dir, backend=backend)
+        mlp = reference if backend == 'npz' else QuantizedMLP.from_artifact(path)
+        probs = ref_probs if backend == 'npz' else np.concatenate([mlp.predict(X[i:i + 8192]) for i in range(0, len(X), 8192)])
+        pressed = ref_pressed if backend == 'npz' else resolve_buttons(probs)
+        ms = _latency(mlp, X, n_frames)
+        rows.append({
+            'character': character_id,
+            'variant': 'float32' if backend == 'npz' else backend,
+            'windows_from': source,
+            'windows': len(X),
+            'file_kb': os.path.getsize(path) / 1e3,
+            'weights_kb': mlp.nbytes / 1e3,
+            'keras_file_kb': (os.path.getsize(keras_file) + os.path.getsize(keras_file + '.scaler')) / 1e3
+                             if os.path.exists(keras_file) else None,
+            'p50_ms': float(np.percentile(ms, 50)),
+            'p99_ms': float(np.percentile(ms, 99)),
+            'combo_agreement': float((pressed == ref_pressed).all(axis=1).mean()),
+            'button_agreement': float((pressed == ref_pressed).mean()),
+            'max_prob_diff': float(np.abs(probs - ref_probs).max()),
+        })
+    return rows
+
+def print_report(rows):
+    print(f"{'model':<9}{'variant':<9}{'file KB':>9}{'weights KB':>12}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'combo agree':>13}{'button agree':>14}{'max |dp|':>10}  windows")
+    for r in rows:
+        print(f"model_{r['character']:<3}{r['variant']:<9}{r['file_kb']:>9.0f}{r['weights_kb']:>12.0f}{r['p50_ms']:>9.3f}"
+              f"{r['p99_ms']:>9.3f}{r['combo_agreement']:>13.2%}{r['button_agreement']:>14.3%}{r['max_prob_diff']:>10.1e}"
+              f"  {r['windows']} of character {r['windows_from']}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Quantize the character models to int8 and float16 and compare them with float32")
+    parser.add_argument('characters', type=int, nargs='*', help="character ids, defaults to every model in models/")
+    parser.add_argument('--report', action='store_true', help="only report on the variants already on disk")
+    parser.add_argument('--frames', type=int, default=2000, help="single-frame calls timed per variant")
+    parser.add_argument('--json', help="write the report rows to this file")
+    args = parser.parse_args()
+
+    ids = args.characters or [cid for cid in range(N_CHARACTERS) if os.path.exists(model_path(cid))]
+    if not args.report:
+        for cid in ids:
+            for path in quantize(cid):
+                print(f"model_{cid}: {os.path.getsize(path) / 1e3:.0f} KB -> {path}")
+    missing = [cid for cid in ids if not os.path.exists(model_path(cid, backend='npz'))]
+    if missing:
+        sys.exit(f"No float32 reference for {missing}, run python export_models.py {' '.join(map(str, missing))} first")
+    rows = [r for cid in ids for r in report(cid, n_frames=args.frames)]
+    print_report(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
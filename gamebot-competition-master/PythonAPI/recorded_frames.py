@@ -0,0 +1,92 @@
+import csv
+import os
+
+#rebuild the json game states the emulator sends from rows recorded by make_dataset
+#or from the tab separated dump in current_game_state0.txt
+BUTTON_KEYS = ['Up', 'Down', 'Right', 'Left', 'Select', 'Start', 'Y', 'B', 'X', 'A', 'L', 'R']
+GAME_STATE_DUMP = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'current_game_state0.txt'))
+
+def default_dataset(character_id):
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'normalized_character_datasets'))
+    return os.path.join(base_dir, f'normalized_dataset_{character_id}.csv')
+
+def _to_bool(value):
+    return str(value).strip().lower() == 'true'
+
+def _player_dict(row, prefix, id_col, buttons_prefix=None):
+    buttons = {}
+    if buttons_prefix is not None:
+        for b in BUTTON_KEYS:
+            col = f'{buttons_prefix}{b.lower()}'
+            if col in row:
+                buttons[b] = _to_bool(row[col])
+    return {
+        'character': int(row[id_col]),
+        'health': int(row[f'{prefix}_health']),
+        'x': int(row[f'{prefix}_x']),
+        'y': int(row[f'{prefix}_y']),
+        'jumping': _to_bool(row[f'{prefix}_jumping']),
+        'crouching': _to_bool(row[f'{prefix}_crouching']),
+        'buttons': buttons,
+        'in_move': _to_bool(row[f'{prefix}_in_move']),
+        'move': int(row[f'{prefix}_move_id']),
+    }
+
+def row_to_state_dict(row):
+    #map one normalized_dataset row back to the shape GameState.dict_to_object expects
+    return {
+        'p1': _player_dict(row, 'p1', 'player1_id', 'player1_buttons_'),
+        'p2': _player_dict(row, 'p2', 'player2_id'),
+        'timer': int(row['timer']),
+        'result': row['fight_result'],
+        'round_started': _to_bool(row['has_round_started']),
+        'round_over': _to_bool(row['is_round_over']),
+    }
+
+def _dump_player_dict(row, prefix, id_col, buttons_prefix):
+    #the dump prefixes player 2 columns with "Player2 " and only has the direction buttons
+    return {
+        'character': int(row[id_col]),
+        'health': int(row[f'{prefix}health']),
+        'x': int(row[f'{prefix}x_coord']),
+        'y': int(row[f'{prefix}y_coord']),
+        'jumping': _to_bool(row[f'{prefix}is_jumping']),
+        'crouching': _to_bool(row[f'{prefix}is_crouching']),
+        'buttons': {b: _to_bool(row[f'{buttons_prefix}{b.lower()}'])
+                    for b in BUTTON_KEYS if f'{buttons_prefix}{b.lower()}' in row},
+        'in_move': _to_bool(row[f'{prefix}is_player_in_move']),
+        'move': int(row[f'{prefix}move_id']),
+    }
+
+def dump_row_to_state_dict(row):
+    return {
+        'p1': _dump_player_dict(row, '', 'Player1_ID', 'player1_buttons '),
+        'p2': _dump_player_dict(row, 'Player2 ', 'Player2_ID', 'player2_buttons '),
+        'timer': int(row['timer']),
+        'result': row['fight_result'],
+        'round_started': _to_bool(row['has_round_started']),
+        'round_over': _to_bool(row['is_round_over']),
+    }
+
+def load_states(path, limit=None):
+    #game states from a normalized_dataset csv or a tab separated game state dump (.txt)
+    if not path.endswith('.txt'):
+        return load_recorded_states(path, limit)
+    states = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            if not row.get('timer'):
+                continue
+            states.append(dump_row_to_state_dict(row))
+            if limit is not None and len(states) >= limit:
+                break
+    return states
+
+def load_recorded_states(csv_path, limit=None):
+    states = []
+    with open(csv_path, newline='') as f:
+        for row in csv.DictReader(f):
+            states.append(row_to_state_dict(row))
+            if limit is not None and len(states) >= limit:
+                break
+    return states
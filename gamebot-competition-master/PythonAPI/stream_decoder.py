@@ -0,0 +1,221 @@
+import json
+import random
+import re
+import select
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+#bytes that can change the brace depth or string state of a json text
+_TOKENS = re.compile(rb'[{}"\\]')
+_LBRACE, _RBRACE, _QUOTE, _BACKSLASH = b'{}"\\'
+
+class StreamDecoder:
+    #splits a tcp byte stream into complete top-level json objects
+    #one recv may hold several objects or only part of one, so bytes are scanned once as they arrive
+    #and a message is only json-decoded when it is handed out
+    def __init__(self, bufsize=65536, latest_only=False):
+        self.latest_only = latest_only
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._end = 0          #end of received bytes
+        self._scan = 0         #bytes before this have been scanned
+        self._obj_start = 0    #start of the object currently being scanned
+        self._skip = 0         #index of a byte escaped by a backslash
+        self._depth = 0
+        self._in_string = False
+        self._messages = deque()
+        self.closed = False
+        self.messages_decoded = 0
+        self.messages_dropped = 0
+        self.bytes_received = 0
+
+    def pending(self):
+        return len(self._messages)
+
+    def feed(self, data):
+        #append bytes that did not come from a socket (tests, replays)
+        n = len(data)
+        self._reserve(n)
+        self._view[self._end:self._end + n] = data
+        self._end += n
+        self.bytes_received += n
+        self._scan_new()
+
+    def _reserve(self, n):
+        #make room for n more bytes, first by dropping consumed bytes, then by growing
+        if len(self._buf) - self._end >= n:
+            return
+        keep_from = self._obj_start if self._depth else self._scan
+        tail = bytes(self._view[keep_from:self._end])
+        size = len(self._buf)
+        while size - len(tail) < n:
+            size *= 2
+        if size != len(self._buf):
+            self._view.release()
+            self._buf = bytearray(size)
+            self._view = memoryview(self._buf)
+        self._view[:len(tail)] = tail
+        self._end = len(tail)
+        self._scan -= keep_from
+        self._obj_start = max(0, self._obj_start - keep_from)
+        self._skip = max(0, self._skip - keep_from)
+
+    def _scan_new(self):
+        buf = self._buf
+        for m in _TOKENS.finditer(buf, self._scan, self._end):
+            i = m.start()
+            if i < self._skip:
+                continue
+            c = buf[i]
+            if self._in_string:
+                if c == _BACKSLASH:
+                    self._skip = i + 2
+                elif c == _QUOTE:
+                    self._in_string = False
+            elif c == _QUOTE:
+                self._in_string = True
+            elif c == _LBRACE:
+                if self._depth == 0:
+                    self._obj_start = i
+                self._depth += 1
+            elif c == _RBRACE and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._messages.append(bytes(self._view[self._obj_start:i + 1]))
+        self._scan = self._end
+
+    def recv_from(self, sock, min_free=4096):
+        #read whatever the socket has straight into the buffer, returns the byte count (0 on close)
+        self._reserve(min_free)
+        n = sock.recv_into(self._view[self._end:])
+        if n == 0:
+            self.closed = True
+            return 0
+        self._end += n
+        self.bytes_received += n
+        self._scan_new()
+        return n
+
+    def pop_raw(self):
+        #next complete message as bytes (or None), in latest_only mode older complete messages are dropped
+        if not self._messages:
+            return None
+        if self.latest_only and len(self._messages) > 1:
+            self.messages_dropped += len(self._messages) - 1
+            raw = self._messages.pop()
+            self._messages.clear()
+        else:
+            raw = self._messages.popleft()
+        self.messages_decoded += 1
+        return raw
+
+    def pop(self):
+        raw = self.pop_raw()
+        return None if raw is None else json.loads(raw)
+
+    def next_raw(self, sock):
+        #block until a complete message is available and return its bytes
+        while not self._messages:
+            if self.closed or self.recv_from(sock) == 0:
+                raise ConnectionError("Game closed the connection")
+        if self.latest_only:
+            #drain what is already readable so a backlog collapses to its newest state
+            while not self.closed and select.select([sock], [], [], 0)[0]:
+                if self.recv_from(sock) == 0:
+                    break
+        return self.pop_raw()
+
+    def next_message(self, sock):
+        return json.loads(self.next_raw(sock))
+
+def _random_state(rng):
+    def player():
+        return {
+            'character': rng.randrange(12), 'health': rng.randrange(177),
+            'x': rng.randrange(-400, 900), 'y': rng.randrange(256),
+            'jumping': rng.random() < 0.1, 'crouching': rng.random() < 0.1,
+            'buttons': {b: rng.random() < 0.2 for b in ['Up', 'Down', 'Right', 'Left', 'Select', 'Start', 'Y', 'B', 'X', 'A', 'L', 'R']},
+            'in_move': rng.random() < 0.3, 'move': rng.randrange(2 ** 28),
+        }
+    state = {'p1': player(), 'p2': player(), 'timer': rng.randrange(154),
+             'result': rng.choice(['NOT_OVER', 'P1', 'P2']),
+             'round_started': True, 'round_over': rng.random() < 0.05}
+    if rng.random() < 0.1:
+        #strings with braces, quotes and escapes must not confuse the framing
+        state['note'] = rng.choice(['}{', '"}', '\\', '\\"{', 'café }}'])
+    return state
+
+def fuzz(n_messages=20000, seed=0, max_chunk=4096):
+    #feeds randomly fragmented and concatenated streams and checks every message comes back intact
+    rng = random.Random(seed)
+    states = [_random_state(rng) for _ in range(n_messages)]
+    parts = []
+    for s in states:
+        parts.append(json.dumps(s).encode())
+        parts.append(rng.choice([b'', b'', b'\n', b' ', b'\r\n']))
+    stream = b''.join(parts)
+
+    decoder = StreamDecoder(bufsize=1024)
+    out = []
+    pos = 0
+    t0 = time.perf_counter()
+    while pos < len(stream):
+        step = rng.randint(1, max_chunk) if rng.random() < 0.9 else rng.randint(1, 8)
+        decoder.feed(stream[pos:pos + step])
+        pos += step
+        msg = decoder.pop()
+        while msg is not None:
+            out.append(msg)
+            msg = decoder.pop()
+    elapsed = time.perf_counter() - t0
+    if out != states:
+        raise AssertionError("decoded stream does not match the encoded messages")
+    return {'messages': len(out), 'bytes': len(stream), 'seconds': elapsed,
+            'messages_per_s': len(out) / elapsed, 'mb_per_s': len(stream) / elapsed / 1e6}
+
+def fuzz_socket(n_messages=2000, seed=1):
+    #same check over a real socket pair, then latest_only mode on a backlog
+    rng = random.Random(seed)
+    states = [_random_state(rng) for _ in range(n_messages)]
+    stream = b''.join(json.dumps(s).encode() for s in states)
+    a, b = socket.socketpair()
+    try:
+        sender = threading.Thread(target=a.sendall, args=(stream,))
+        sender.start()
+        decoder = StreamDecoder(bufsize=512)
+        got = [decoder.next_message(b) for _ in range(n_messages)]
+        sender.join()
+        if got != states:
+            raise AssertionError("socket stream does not match the encoded messages")
+
+        #a backlog sent in one go should collapse to the newest state
+        a.sendall(b''.join(json.dumps(s).encode() for s in states[-100:]))
+        a.close()
+        latest = StreamDecoder(latest_only=True)
+        last = None
+        try:
+            while True:
+                last = latest.next_message(b)
+        except ConnectionError:
+            pass
+        if last != states[-1]:
+            raise AssertionError("latest_only did not end on the newest state")
+        return {'messages': n_messages, 'latest_only_dropped': latest.messages_dropped,
+                'latest_only_decoded': latest.messages_decoded}
+    finally:
+        a.close()
+        b.close()
+
+if __name__ == '__main__':
+    #usage: python stream_decoder.py [n_messages] [seed]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    r = fuzz(n, seed)
+    print(f"Fragmented stream: {r['messages']} messages, {r['bytes'] / 1e6:.1f} MB in {r['seconds']:.2f}s "
+          f"({r['messages_per_s']:.0f} msg/s, {r['mb_per_s']:.1f} MB/s)")
+    r = fuzz_socket(seed=seed + 1)
+    print(f"Socket stream: {r['messages']} messages OK, latest_only decoded {r['latest_only_decoded']} "
+          f"and dropped {r['latest_only_dropped']} backlog frames")
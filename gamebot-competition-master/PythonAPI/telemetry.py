@@ -0,0 +1,201 @@
+import atexit
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+#configured from the environment so a live session can be instrumented without editing code:
+#  SF_LOG_LEVEL=DEBUG|INFO|WARNING|ERROR   (default INFO, the old per-frame prints are DEBUG)
+#  SF_TELEMETRY=<file.json>                 per-stage timing histograms, rewritten every SF_TELEMETRY_EVERY seconds (default 10)
+#  SF_PROFILE=<file.folded>                 sampling profiler, collapsed stacks at SF_PROFILE_HZ samples/s (default 200)
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+LEVEL = LEVELS.get(os.environ.get('SF_LOG_LEVEL', 'INFO').upper(), 20)
+#check these before building a log message so disabled levels cost one global lookup
+DEBUG = LEVEL <= LEVELS['DEBUG']
+INFO = LEVEL <= LEVELS['INFO']
+
+TELEMETRY_FILE = os.environ.get('SF_TELEMETRY')
+ENABLED = bool(TELEMETRY_FILE)
+DUMP_EVERY = float(os.environ.get('SF_TELEMETRY_EVERY', '10'))
+PROFILE_FILE = os.environ.get('SF_PROFILE')
+PROFILE_HZ = float(os.environ.get('SF_PROFILE_HZ', '200'))
+
+def log(level, msg, *args):
+    if LEVELS[level] >= LEVEL:
+        print(msg % args if args else msg)
+
+def debug(msg, *args):
+    if DEBUG:
+        print(msg % args if args else msg)
+
+def info(msg, *args):
+    if INFO:
+        print(msg % args if args else msg)
+
+class Histogram:
+    #log-bucketed latency histogram, 1us to ~100s with ~2% relative resolution
+    MIN = 1e-6
+    GROWTH = 1.02
+
+    def __init__(self):
+        self._log_growth = math.log(self.GROWTH)
+        self.buckets = [0] * (int(math.log(1e2 / self.MIN) / self._log_growth) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds <= self.MIN:
+            i = 0
+        else:
+            i = min(int(math.log(seconds / self.MIN) / self._log_growth) + 1, len(self.buckets) - 1)
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        target = q / 100.0 * self.count
+        seen = 0
+        for i, c in enumerate(self.buckets):
+            seen += c
+            if seen >= target:
+                #upper edge of the bucket, never above the largest value seen
+                return min(self.MIN * self.GROWTH ** i, self.max)
+        return self.max
+
+    def summary(self):
+        ms = 1000.0
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * ms if self.count else 0.0,
+            'p50_ms': self.percentile(50) * ms,
+            'p95_ms': self.percentile(95) * ms,
+            'p99_ms': self.percentile(99) * ms,
+            'max_ms': self.max * ms,
+        }
+
+_histograms = {}
+_started = time.time()
+
+def record(stage, seconds):
+    if not ENABLED:
+        return
+    h = _histograms.get(stage)
+    if h is None:
+        h = _histograms[stage] = Histogram()
+    h.add(seconds)
+
+class _Timer:
+    __slots__ = ('stage', 't0')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.t0)
+        return False
+
+_NULL_TIMER = nullcontext()
+
+def timed(stage):
+    #with timed('inference'): ...   costs a null context manager when telemetry is off
+    return _Timer(stage) if ENABLED else _NULL_TIMER
+
+def snapshot():
+    return {
+        'started': _started,
+        'written': time.time(),
+        'pid': os.getpid(),
+        'stages': {name: h.summary() for name, h in sorted(_histograms.items())},
+    }
+
+def dump(path=None):
+    path = path or TELEMETRY_FILE
+    if not path:
+        return
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot(), f, indent=2)
+    os.replace(tmp, path)
+
+class SamplingProfiler:
+    #samples the stacks of every other thread from a daemon thread and counts them in collapsed form
+    #(one "a;b;c count" line per stack, readable by flamegraph.pl and speedscope)
+    def __init__(self, path, hz=PROFILE_HZ):
+        self.path = path
+        self.interval = 1.0 / hz
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self):
+        with open(self.path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+_profiler = None
+
+def _periodic_dump():
+    while True:
+        time.sleep(DUMP_EVERY)
+        dump()
+        if _profiler is not None:
+            _profiler.write()
+
+def _shutdown():
+    if _profiler is not None:
+        _profiler.stop()
+    if ENABLED:
+        dump()
+
+def start():
+    #called once by the controller, starts the dump thread and the profiler if they were asked for
+    global _profiler
+    if PROFILE_FILE and _profiler is None:
+        _profiler = SamplingProfiler(PROFILE_FILE).start()
+        info("[Telemetry] Sampling profiler writing to %s", PROFILE_FILE)
+    if ENABLED or _profiler is not None:
+        threading.Thread(target=_periodic_dump, name='telemetry-dump', daemon=True).start()
+        atexit.register(_shutdown)
+    if ENABLED:
+        info("[Telemetry] Stage histograms writing to %s every %.0fs", TELEMETRY_FILE, DUMP_EVERY)
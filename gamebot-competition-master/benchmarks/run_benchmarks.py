@@ -0,0 +1,253 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import metadata
+import numpy as np
+
+#one entry point for the hot paths, results as json with the environment they were measured in:
+#  python benchmarks/run_benchmarks.py --out results.json
+#  python benchmarks/run_benchmarks.py --only bot codec --baseline results.json --threshold 0.15
+#metrics ending in _per_s are throughputs (higher is better), every other metric is a time (lower is better)
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+for sub in ('PythonAPI', 'pre_processing', 'train_models'):
+    sys.path.append(os.path.join(ROOT, sub))
+
+from recorded_frames import default_dataset, load_recorded_states
+
+BENCHMARKS = ('bot', 'codec', 'record', 'preprocess', 'train')
+
+def _percentiles(samples, prefix):
+    ms = np.asarray(samples) * 1000
+    return {f'{prefix}_p50_ms': float(np.percentile(ms, 50)),
+            f'{prefix}_p99_ms': float(np.percentile(ms, 99)),
+            f'{prefix}_mean_ms': float(ms.mean())}
+
+def bench_bot(states, backends=('npz', 'keras'), warmup=50):
+    #Bot.fight per frame, the first warmup frames fill the window and are not timed; fight_* is measured
+    #with the decision cache off so it follows inference cost, cached_fight_* with the default cache
+    from bot import Bot
+    from decision_cache import CACHE_SIZE
+    from game_state import GameState
+    from model_registry import load_model, model_path
+    frames = [GameState(s) for s in states]
+    character_id = frames[0].player1.player_id
+    results = {}
+    for backend in backends:
+        loaded = load_model(model_path(character_id, backend=backend), backend, character_id)
+        results[backend] = {}
+        for prefix, cache_size in (('fight', 0), ('cached_fight', CACHE_SIZE)):
+            if prefix == 'cached_fight' and not cache_size:
+                continue
+            loaded.cache = None
+            bot = Bot(player_id=character_id, backend=backend, loaded=loaded, cache_size=cache_size)
+            for gs in frames[:warmup]:
+                bot.fight(gs, "1")
+            times = []
+            for gs in frames[warmup:]:
+                t0 = time.perf_counter()
+                bot.fight(gs, "1")
+                times.append(time.perf_counter() - t0)
+            results[backend].update({**_percentiles(times, prefix), f'{prefix}_per_s': len(times) / sum(times)})
+            if bot.cache is not None:
+                results[backend]['cache_hit_rate'] = bot.cache.stats()['hit_rate']
+        results[backend]['frames'] = len(frames) - warmup
+    return results
+
+def bench_codec(states, repeat=5):
+    #the controller's per-frame path without the socket: frame the bytes, parse the state, serialize a command
+    from command import Command
+    from game_state import GameStatePool
+    from stream_decoder import StreamDecoder
+    payloads = [json.dumps(s).encode() for s in states]
+    cmd = Command()
+    pool = GameStatePool()
+    decode, encode = [], []
+    for _ in range(repeat):
+        decoder = StreamDecoder()
+        for payload in payloads:
+            t0 = time.perf_counter()
+            decoder.feed(payload)
+            gs = pool.decode(decoder.pop_raw())
+            t1 = time.perf_counter()
+            cmd.encode()
+            t2 = time.perf_counter()
+            pool.release(gs)
+            decode.append(t1 - t0)
+            encode.append(t2 - t1)
+    return {'frames': len(decode), **_percentiles(decode, 'decode'), **_percentiles(encode, 'encode'),
+            'frames_per_s': len(decode) / (sum(decode) + sum(encode))}
+
+def bench_record(states, tmp):
+    #record_frame into a temporary dataset directory: the call on the control loop and the writer thread draining it
+    import make_dataset
+    from game_state import GameState
+    frames = [GameState(s) for s in states]
+    keys = ['RIGHT', 'Y']
+    recorder = make_dataset._recorder = make_dataset.DatasetRecorder(rotate=False, queue_size=len(frames) + 1, base_dir=tmp)
+    calls = []
+    t_start = time.perf_counter()
+    for gs in frames:
+        t0 = time.perf_counter()
+        make_dataset.record_frame(gs, keys)
+        calls.append(time.perf_counter() - t0)
+    recorder.close()
+    total = time.perf_counter() - t_start
+    make_dataset._recorder = None
+    return {'rows': recorder.rows_written, 'dropped': recorder.rows_dropped, **_percentiles(calls, 'record_frame'),
+            'record_frame_per_s': len(calls) / sum(calls), 'rows_written_per_s': recorder.rows_written / total}
+
+def bench_preprocess(csv_path, tmp, repeat=3):
+    import pandas as pd
+    from preprocess_windows import clean_dataset, create_windowed_dataset
+    df = pd.read_csv(csv_path)
+    clean = []
+    for _ in range(repeat):
+        #clean_dataset drops columns in place
+        frame = df.copy()
+        t0 = time.perf_counter()
+        clean_dataset(frame, verbose=False)
+        clean.append(time.perf_counter() - t0)
+    output_csv = os.path.join(tmp, 'windowed.csv')
+    window = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = create_windowed_dataset(csv_path, output_csv=output_csv)
+        window.append(time.perf_counter() - t0)
+    #best of repeat, the other runs only show page cache and allocator noise
+    return {'rows': len(df), 'windows': stats['windows'],
+            'clean_s': min(clean), 'clean_rows_per_s': len(df) / min(clean),
+            'windowed_dataset_s': min(window), 'windowed_dataset_rows_per_s': len(df) / min(window)}, output_csv
+
+def bench_train(windowed_csv, tmp, epochs=3):
+    #train_model end to end on the windowed dataset; the first epoch also traces the graph, so it is reported apart
+    import tensorflow as tf
+    from train_individual_character import train_model
+    class EpochTimer(tf.keras.callbacks.Callback):
+        def on_train_begin(self, logs=None):
+            self.times = []
+        def on_epoch_begin(self, epoch, logs=None):
+            self.t0 = time.perf_counter()
+        def on_epoch_end(self, epoch, logs=None):
+            self.times.append(time.perf_counter() - self.t0)
+    timer = EpochTimer()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        train_model(windowed_csv, os.path.join(tmp, 'model.keras'), epochs=epochs, extra_callbacks=[timer])
+    total = time.perf_counter() - t0
+    steady = timer.times[1:] or timer.times
+    return {'epochs': epochs, 'first_epoch_s': timer.times[0], 'epoch_s': float(np.mean(steady)),
+            'setup_s': total - sum(timer.times)}
+
+def environment():
+    def version(pkg):
+        try:
+            return metadata.version(pkg)
+        except metadata.PackageNotFoundError:
+            return None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    cpu = platform.processor()
+    if os.path.exists('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as f:
+            cpu = next((line.split(':', 1)[1].strip() for line in f if line.startswith('model name')), cpu)
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu': cpu,
+        'cpu_count': os.cpu_count(),
+        'packages': {p: version(p) for p in ('numpy', 'pandas', 'scikit-learn', 'tensorflow')},
+        'env': {k: v for k, v in os.environ.items() if k.startswith('SF_')},
+    }
+
+def run(only=BENCHMARKS, character_id=7, frames=2000, backends=('npz', 'keras'), epochs=3):
+    csv_path = default_dataset(character_id)
+    states = load_recorded_states(csv_path, limit=frames)
+    results = {'environment': environment(),
+               'config': {'character': character_id, 'frames': len(states), 'backends': list(backends), 'epochs': epochs},
+               'benchmarks': {}}
+    out = results['benchmarks']
+    with tempfile.TemporaryDirectory() as tmp:
+        def step(name, fn, *args):
+            print(f"[bench] {name}...", flush=True)
+            t0 = time.perf_counter()
+            r = fn(*args)
+            print(f"[bench] {name} done in {time.perf_counter() - t0:.1f}s", flush=True)
+            return r
+        if 'bot' in only:
+            for backend, r in step('bot', bench_bot, states, backends).items():
+                out[f'bot_{backend}'] = r
+        if 'codec' in only:
+            out['codec'] = step('codec', bench_codec, states)
+        if 'record' in only:
+            out['record'] = step('record', bench_record, states, tmp)
+        windowed_csv = None
+        if 'preprocess' in only or 'train' in only:
+            out['preprocess'], windowed_csv = step('preprocess', bench_preprocess, csv_path, tmp)
+            if 'preprocess' not in only:
+                del out['preprocess']
+        if 'train' in only:
+            out['train'] = step('train', bench_train, windowed_csv, tmp, epochs)
+    return results
+
+def higher_is_better(metric):
+    return metric.endswith('_per_s')
+
+def compare(results, baseline, threshold=0.1):
+    #rows of (benchmark, metric, baseline, current, relative change, regressed) for every timed metric in both
+    rows = []
+    for name, metrics in results['benchmarks'].items():
+        base = baseline.get('benchmarks', {}).get(name, {})
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if old is None or not (metric.endswith('_s') or metric.endswith('_ms')) or not old:
+                continue
+            change = (value - old) / old
+            regressed = change < -threshold if higher_is_better(metric) else change > threshold
+            rows.append((name, metric, old, value, change, regressed))
+    return rows
+
+def print_results(results):
+    for name, metrics in results['benchmarks'].items():
+        print(f"{name:<12} " + "  ".join(f"{k} {v:.4g}" if isinstance(v, float) else f"{k} {v}" for k, v in metrics.items()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark inference, the controller path, recording, preprocessing and training")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--character', type=int, default=7, help="dataset (and model) used by every benchmark")
+    parser.add_argument('--frames', type=int, default=2000, help="recorded frames replayed by bot, codec and record")
+    parser.add_argument('--backends', nargs='+', default=['npz', 'keras'], help="Bot backends timed by the bot benchmark")
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--out', help="write the results json here")
+    parser.add_argument('--baseline', help="results json to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    results = run(args.only, args.character, args.frames, args.backends, args.epochs)
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.threshold)
+        print(f"\nAgainst {args.baseline} (commit {baseline.get('environment', {}).get('git_commit')}), threshold {args.threshold:.0%}:")
+        print(f"{'benchmark':<12}{'metric':<30}{'baseline':>12}{'current':>12}{'change':>9}")
+        for name, metric, old, new, change, regressed in rows:
+            print(f"{name:<12}{metric:<30}{old:>12.4g}{new:>12.4g}{change:>+9.1%}{'  REGRESSION' if regressed else ''}")
+        regressions = sum(r[5] for r in rows)
+        print(f"{regressions} regression(s) in {len(rows)} compared metrics")
+        sys.exit(1 if regressions else 0)
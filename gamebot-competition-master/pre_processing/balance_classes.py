@@ -1,72 +1,127 @@
-import pandas as pd
+import argparse
 import os
-def balance_button_distribution(df, threshold=0.55):
-    button_cols = ['player1_buttons_up', 'player1_buttons_down', 'player1_buttons_right', 'player1_buttons_left','player1_buttons_y', 'player1_buttons_b', 'player1_buttons_x', 'player1_buttons_a','player1_buttons_l', 'player1_buttons_r']
-    
-    initial_rows = len(df)
-    print(f"\nInitial rows: {initial_rows}")
-    
-    # Show initial distribution
-    print("\nInitial button distribution:")
-    for col in button_cols:
-        press_ratio = df[col].mean()
-        print(f"{col}: {press_ratio:.2%}")
-    
-    # Balance each button that exceeds threshold
-    total_rows_removed = 0
-    for col in button_cols:
-        press_ratio = df[col].mean()
-        if press_ratio > threshold:
-            # Get rows where this button is pressed
+import time
+import numpy as np
+import pandas as pd
+from preprocess_windows import BUTTON_COLS
+
+#rows are grouped by their button combination (at most 2**10 patterns), so the whole dataset is
+#read once to count patterns and the balancing itself only works on the pattern counts.
+#each pattern gets a keep fraction, the smallest downsampling factor of the buttons it presses,
+#and the factors are refined until every button is at or below the threshold. the result is the
+#same whatever the column order, and nothing is copied or dropped: callers get row indices or weights.
+
+def pattern_codes(y):
+    #one integer per row, bit j set when button j is pressed
+    y = np.asarray(y)
+    return (y.astype(bool) @ (1 << np.arange(y.shape[1]))).astype(np.int64)
+
+def _pattern_bits(n_buttons):
+    return ((np.arange(1 << n_buttons)[:, None] >> np.arange(n_buttons)) & 1).astype(bool)
+
+def pattern_keep_fractions(counts, n_buttons, threshold=0.55, max_iter=100, tol=1e-4):
+    #keep fraction per pattern such that every button's press ratio is at most threshold
+    bits = _pattern_bits(n_buttons)
+    counts = counts.astype(np.float64)
+    factors = np.ones(n_buttons)
+    keep = np.ones(len(counts))
+    target_odds = threshold / (1 - threshold)
+    for _ in range(max_iter):
+        kept = keep * counts
+        pressed = kept @ bits
+        ratio = pressed / max(kept.sum(), 1.0)
+        over = ratio > threshold + tol
+        if not over.any():
+            break
+        #scale the odds of each over-represented button down to the target odds
+        factors[over] *= target_odds / (pressed[over] / np.maximum(kept.sum() - pressed[over], 1.0))
+        factors = np.minimum(factors, 1.0)
+        keep = np.where(bits, factors, 1.0).min(axis=1)
+    return keep
+
+def keep_weights(y, threshold=0.55):
+    #per-row keep fraction in [0, 1], usable as training sample weights
+    codes = pattern_codes(y)
+    n_buttons = np.asarray(y).shape[1]
+    keep = pattern_keep_fractions(np.bincount(codes, minlength=1 << n_buttons), n_buttons, threshold)
+    return keep[codes]
+
+def select_rows(y, threshold=0.55, seed=42):
+    #sorted row indices of a balanced subset: round(keep * count) random rows of each pattern
+    codes = pattern_codes(y)
+    n_buttons = np.asarray(y).shape[1]
+    counts = np.bincount(codes, minlength=1 << n_buttons)
+    quota = np.rint(pattern_keep_fractions(counts, n_buttons, threshold) * counts).astype(np.int64)
+    #random rank of every row inside its pattern
+    order = np.lexsort((np.random.default_rng(seed).random(len(codes)), codes))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.empty(len(codes), dtype=np.int64)
+    rank[order] = np.arange(len(codes)) - starts[codes[order]]
+    return np.flatnonzero(rank < quota[codes])
+
+def distribution(y, rows=None, weights=None):
+    #press ratio of every button over all rows, a row selection or weighted rows
+    y = np.asarray(y, dtype=np.float64)
+    if rows is not None:
+        y = y[rows]
+    if weights is None:
+        return y.mean(axis=0)
+    return weights @ y / weights.sum()
+
+def report(y, threshold=0.55, seed=42, names=BUTTON_COLS):
+    rows = select_rows(y, threshold, seed)
+    before = distribution(y)
+    after = distribution(y, rows=rows)
+    weighted = distribution(y, weights=keep_weights(y, threshold))
+    print(f"{'button':<24}{'before':>9}{'selected':>10}{'weighted':>10}")
+    for name, b, a, w in zip(names, before, after, weighted):
+        print(f"{name:<24}{b:>9.2%}{a:>10.2%}{w:>10.2%}")
+    print(f"Rows: {len(y)} -> {len(rows)} selected ({len(rows) / max(len(y), 1):.1%} kept), threshold {threshold:.0%}")
+    return rows
+
+def balance_button_distribution(df, threshold=0.55, seed=42):
+    #balanced copy of a windowed dataframe, the frame itself is left untouched
+    rows = report(df[BUTTON_COLS].to_numpy(), threshold, seed)
+    return df.iloc[rows]
+
+def _balance_by_drops(df, threshold=0.55):
+    #the previous column-by-column loop, kept to compare against
+    for col in BUTTON_COLS:
+        if df[col].mean() > threshold:
             pressed_rows = df[df[col] == 1]
-            current_count = len(pressed_rows)
-            
-            # Calculate target count to achieve threshold ratio
-            target_count = int((threshold * len(df)) / (1 - threshold))
-            rows_to_remove = current_count - target_count
-            
+            rows_to_remove = len(pressed_rows) - int((threshold * len(df)) / (1 - threshold))
             if rows_to_remove > 0:
-                # Randomly sample rows to remove
-                drop_indices = pressed_rows.sample(n=rows_to_remove, random_state=42).index
-                df = df.drop(drop_indices)
-                total_rows_removed += rows_to_remove
-                
-                print(f"\nBalanced {col}")
-                print(f"Removed {rows_to_remove} rows")
-                print(f"New ratio: {df[col].mean():.2%}")
-    
-    final_rows = len(df)
-    kept_percent = (final_rows / initial_rows) * 100
-    
-    print(f"\nDataset Statistics:")
-    print(f"Initial rows: {initial_rows}")
-    print(f"Final rows: {final_rows}")
-    print(f"Total rows removed: {total_rows_removed}")
-    print(f"Kept {kept_percent:.1f}% of original data")
-    
+                df = df.drop(pressed_rows.sample(n=rows_to_remove, random_state=42).index)
     return df
 
 if __name__ == "__main__":
-    # List of large datasets which are overfitting our models
-    datasets_to_process = [0, 3, 8, 9]
-    
-    # Base directory containing datasets
-    base_dir = os.path.abspath(
-        os.path.join(os.path.dirname(__file__), '..', 'flattened_window_datasets')
-    )
-    
-    for idx in datasets_to_process:
+    parser = argparse.ArgumentParser(description="Report (and optionally write) button-balanced windowed datasets")
+    #the large datasets which are overfitting our models
+    parser.add_argument('--characters', type=int, nargs='+', default=[0, 3, 8, 9])
+    parser.add_argument('--threshold', type=float, default=0.55)
+    parser.add_argument('--write', action='store_true', help="save the selection to windowed_dataset_<id>_balanced.csv, the source is never rewritten")
+    parser.add_argument('--compare', action='store_true', help="also time the previous drop loop")
+    args = parser.parse_args()
+
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'flattened_window_datasets'))
+    for idx in args.characters:
         dataset_path = os.path.join(base_dir, f'windowed_dataset_{idx}.csv')
-        
         if not os.path.exists(dataset_path):
             print(f"\nSkipping dataset {idx} - file not found")
             continue
-            
+
         print(f"\nProcessing dataset {idx}")
-        print(f"Loading {dataset_path}")
-        
-        # Read, balance and save back to same file
-        df = pd.read_csv(dataset_path)
-        df_balanced = balance_button_distribution(df)
-        df_balanced.to_csv(dataset_path, index=False)
-        print(f"Saved balanced dataset back to {dataset_path}")
\ No newline at end of file
+        y = pd.read_csv(dataset_path, usecols=BUTTON_COLS)[BUTTON_COLS].to_numpy()
+        t0 = time.perf_counter()
+        rows = report(y, args.threshold)
+        print(f"Selected in {(time.perf_counter() - t0) * 1000:.1f} ms")
+        if args.compare:
+            df = pd.read_csv(dataset_path)
+            t0 = time.perf_counter()
+            old = _balance_by_drops(df, args.threshold)
+            ratios = ' '.join(f"{r:.0%}" for r in old[BUTTON_COLS].mean())
+            print(f"Drop loop: {len(old)} rows in {(time.perf_counter() - t0) * 1000:.1f} ms, ratios {ratios}")
+        if args.write:
+            out_path = os.path.join(base_dir, f'windowed_dataset_{idx}_balanced.csv')
+            pd.read_csv(dataset_path).iloc[rows].to_csv(out_path, index=False)
+            print(f"Saved balanced dataset to {out_path}")
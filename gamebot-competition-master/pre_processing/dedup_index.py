@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import time
+import zlib
+import numpy as np
+import pandas as pd
+from preprocess_windows import STATE_COLS, BUTTON_COLS, character_dataset_files, clean_dataset
+
+#clean_dataset only drops a frame equal to the one before it, while the same stretch of (state, buttons)
+#frames keeps coming back across rounds and sessions (intros, menus, idle stand-offs). Every frame gets a
+#64-bit signature of its state and button columns, every window the signature of its frames in order, and
+#a DedupIndex counts window signatures per character. Windows over the cap are dropped whole and frames
+#never are, so a kept window is always frames that followed each other in the game:
+#  python pre_processing/preprocess_windows.py --dedup 1                 keep only the first copy of each window
+#  python train_models/train_individual_character.py --source windows --dedup 2
+#  python pre_processing/dedup_index.py --characters 7 --caps 1 2 --epoch-time    shrink and epoch time per cap
+#recordings are written whole and deduplicated only here; preprocess_windows.py --incremental keeps its
+#index next to the windowed csv, so appended windows are judged against everything processed before
+#without re-reading it
+SIGNATURE_COLS = STATE_COLS + BUTTON_COLS
+_MASK = (1 << 64) - 1
+_FNV_OFFSET = 0xcbf29ce484222325
+_FNV_PRIME = 0x100000001b3
+#csv chunks can read booleans and numbers as text
+_BOOL_STRINGS = {'True': 1, 'False': 0}
+#missing cells (NaN, None) all get this code instead of raising in int()
+_MISSING_CODE = 0x9e3779b97f4a7c15
+
+def index_path(csv_path):
+    return csv_path + '.dedup.npz'
+
+def _code(value):
+    #64-bit code of one cell, numbers and booleans by value (also when read as text), other text by crc32
+    if pd.isna(value):
+        return _MISSING_CODE
+    if isinstance(value, str):
+        if value in _BOOL_STRINGS:
+            return _BOOL_STRINGS[value]
+        try:
+            value = int(value)
+        except ValueError:
+            return zlib.crc32(value.encode())
+    return int(value) & _MASK
+
+def _column_codes(values):
+    if values.dtype.kind in 'biu' and not values.hasnans:
+        return values.to_numpy().astype(np.int64).view(np.uint64)
+    #NaN is kept as a unique of its own rather than the -1 sentinel, which would index the last unique
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return np.array([_code(v) for v in uniques], dtype=np.uint64)[codes]
+
+def _finalize(h):
+    #splitmix64 finalizer on uint64 arrays
+    h ^= h >> 30
+    h = h * 0xbf58476d1ce4e5b9
+    h ^= h >> 27
+    h = h * 0x94d049bb133111eb
+    return h ^ (h >> 31)
+
+def row_signatures(df):
+    #uint64 signature of every row over SIGNATURE_COLS (FNV-1a over the 64-bit cell codes)
+    h = np.full(len(df), _FNV_OFFSET, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for col in SIGNATURE_COLS:
+            h ^= _column_codes(df[col])
+            h *= np.uint64(_FNV_PRIME)
+        return _finalize(h)
+
+def window_signatures(frame_signatures, window_size):
+    #signature of every window of window_size consecutive frames, row i covering frames i..i+window_size-1 like
+    #preprocess_windows.window_rows (the window's target is the buttons of its last frame, so it is covered too)
+    n = len(frame_signatures) - window_size + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+    h = np.full(n, _FNV_OFFSET, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for t in range(window_size):
+            h ^= frame_signatures[t:t + n]
+            h *= np.uint64(_FNV_PRIME)
+        return _finalize(h)
+
+class DedupIndex:
+    #occurrence count per window signature; cap=None only counts, cap=k keeps the first k copies
+    def __init__(self, cap=None, meta=None):
+        self.cap = cap
+        self.meta = meta or {}
+        self.counts = {}
+        self.seen = 0
+        self.duplicates = 0
+        self.dropped = 0
+
+    @classmethod
+    def load(cls, path, cap=None):
+        with np.load(path) as data:
+            index = cls(cap, json.loads(str(data['meta'])))
+            index.counts = dict(zip(data['signatures'].tolist(), data['counts'].tolist()))
+        return index
+
+    def save(self, path, **meta):
+        #meta records what the counts cover (e.g. the source size), written atomically like the manifests
+        self.meta.update(meta)
+        keys = np.fromiter(self.counts.keys(), dtype=np.uint64, count=len(self.counts))
+        counts = np.fromiter(self.counts.values(), dtype=np.uint32, count=len(self.counts))
+        order = np.argsort(keys)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, signatures=keys[order], counts=counts[order], meta=np.array(json.dumps(self.meta)))
+        os.replace(tmp, path)
+
+    def observe(self, signatures):
+        #counts the signatures in order and returns the mask of the rows within the cap
+        keep = np.ones(len(signatures), dtype=bool)
+        counts = self.counts
+        for i, s in enumerate(signatures.tolist()):
+            c = counts.get(s, 0)
+            counts[s] = c + 1
+            if c:
+                self.duplicates += 1
+                if self.cap is not None and c >= self.cap:
+                    keep[i] = False
+        self.seen += len(keep)
+        self.dropped += len(keep) - int(keep.sum())
+        return keep
+
+    def __len__(self):
+        return len(self.counts)
+
+    def stats(self):
+        return {'seen': self.seen, 'unique': len(self.counts), 'duplicates': self.duplicates, 'dropped': self.dropped}
+
+    def summary(self):
+        s = self.stats()
+        cap = 'off' if self.cap is None else self.cap
+        return (f"[Dedup] cap {cap} | {s['seen']} seen | {s['unique']} unique | {s['duplicates']} duplicates | "
+                f"{s['dropped']} dropped")
+
+def epoch_seconds(X, y, epochs=6):
+    #median seconds per epoch with the training setup of train_model_from_windows
+    import sys
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'train_models')))
+    import tensorflow as tf
+    from train_individual_character import WindowBatches, build_model, fit_scaler, select_training_rows
+    times = []
+
+    class EpochTimer(tf.keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.t0 = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            times.append(time.perf_counter() - self.t0)
+
+    tf.keras.utils.set_random_seed(42)
+    train_idx, val_idx = select_training_rows(y)
+    scaler = fit_scaler(X, train_idx)
+    model = build_model(X.shape[1], y.shape[1])
+    model.fit(WindowBatches(X, y, train_idx, scaler, weighted=True, shuffle=True),
+              validation_data=WindowBatches(X, y, val_idx, scaler), epochs=epochs, callbacks=[EpochTimer()], verbose=0)
+    #the first epoch also traces the train step
+    return float(np.median(times[1:])), len(train_idx)
+
+def report(input_csv, caps=(1, 2, 4), window_size=6, epoch_time=False):
+    #how far each cap shrinks the windows of one recording, and optionally its epoch time
+    from window_views import load_character_windows
+    df = pd.read_csv(input_csv)
+    raw = DedupIndex(1)
+    raw.observe(row_signatures(df))
+    t0 = time.perf_counter()
+    clean = clean_dataset(df, verbose=False)
+    clean_seconds = time.perf_counter() - t0
+    rows = []
+    for cap in (None,) + tuple(caps):
+        index = DedupIndex(cap)
+        t0 = time.perf_counter()
+        X, y = load_character_windows(input_csv, window_size, dedup=index)
+        row = {'cap': cap, 'windows': len(X), 'load_s': time.perf_counter() - t0, **index.stats()}
+        if epoch_time:
+            row['epoch_s'], row['train_rows'] = epoch_seconds(X, y)
+        rows.append(row)
+    return {'input': input_csv, 'raw_frames': raw.seen, 'raw_duplicates': raw.duplicates, 'raw_unique': len(raw),
+            'clean_frames': len(clean), 'clean_seconds': clean_seconds, 'rows': rows}
+
+def print_report(result):
+    base = result['rows'][0]
+    print(f"\n=== {os.path.basename(result['input'])} ===")
+    print(f"recording: {result['raw_frames']} frames, {result['raw_duplicates']} exact copies "
+          f"({result['raw_duplicates'] / max(result['raw_frames'], 1):.1%}) | "
+          f"after clean_dataset: {result['clean_frames']} frames")
+    epoch = 'epoch_s' in base
+    print(f"copies of an earlier window: {base['duplicates']} ({base['duplicates'] / max(base['windows'], 1):.1%})")
+    print(f"{'cap':>5}{'dropped':>9}{'windows':>9}{'shrink':>9}{'load s':>9}" +
+          (f"{'train rows':>12}{'epoch s':>9}{'saved':>8}" if epoch else ''))
+    for r in result['rows']:
+        line = (f"{r['cap'] or 'off':>5}{r['dropped']:>9}{r['windows']:>9}"
+                f"{1 - r['windows'] / max(base['windows'], 1):>9.1%}{r['load_s']:>9.3f}")
+        if epoch:
+            line += f"{r['train_rows']:>12}{r['epoch_s']:>9.2f}{1 - r['epoch_s'] / base['epoch_s']:>8.1%}"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report how much deduplicating repeated windows shrinks each dataset")
+    parser.add_argument('--characters', type=int, nargs='+', help="default every normalized dataset")
+    parser.add_argument('--caps', type=int, nargs='+', default=[1, 2, 4], help="copies of each window kept")
+    parser.add_argument('--window-size', type=int, default=6)
+    parser.add_argument('--epoch-time', action='store_true', help="also time a training epoch per cap (imports tensorflow)")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+
+    files = sorted(character_dataset_files())
+    if args.characters:
+        files = [f for f in files if int(os.path.basename(f)[len('normalized_dataset_'):-len('.csv')]) in args.characters]
+    results = [report(f, args.caps, args.window_size, args.epoch_time) for f in files]
+    for r in results:
+        print_report(r)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
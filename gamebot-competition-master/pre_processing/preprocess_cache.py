@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from dedup_index import DedupIndex, index_path
+from preprocess_windows import STATE_COLS, BUTTON_COLS, default_output_csv, stream_windows, window_columns
+
+#record mode only ever appends to normalized_dataset_<id>.csv, so a windowed dataset can be
+#brought up to date by processing just the appended rows. Next to each windowed csv a manifest
+#records how far the source was processed (byte offset, sha1 of those bytes, size, mtime) and the
+#cleaning/window state at that point. Anything that does not look like a pure append rebuilds.
+#with a dedup cap the DedupIndex of the processed windows is saved next to the manifest
+#(windowed_dataset_<id>.csv.dedup.npz) at the same offset, so appended windows are judged against all earlier ones
+
+#bump when the cleaning rules or the output layout change
+SCHEMA_VERSION = 2
+HASH_BLOCK = 1 << 20
+
+def manifest_path(output_csv):
+    return output_csv + '.manifest.json'
+
+def _jsonable(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+class _ByteRange:
+    #file reader that stops after length bytes and hashes what it hands out
+    def __init__(self, f, length, hasher):
+        self.f = f
+        self.remaining = length
+        self.hasher = hasher
+
+    def read(self, n=-1):
+        if n is None or n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self.f.read(n)
+        self.remaining -= len(data)
+        self.hasher.update(data)
+        return data
+
+def _hash_prefix(f, length):
+    hasher = hashlib.sha1()
+    remaining = length
+    while remaining:
+        data = f.read(min(HASH_BLOCK, remaining))
+        if not data:
+            break
+        hasher.update(data)
+        remaining -= len(data)
+    return hasher, length - remaining
+
+def _complete_end(f, size):
+    #offset just past the last newline, a row that is still being written is left for the next run
+    pos = size
+    while pos > 0:
+        start = max(0, pos - 4096)
+        f.seek(start)
+        block = f.read(pos - start)
+        i = block.rfind(b'\n')
+        if i >= 0:
+            return start + i + 1
+        pos = start
+    return 0
+
+def _load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _resume_point(manifest, input_csv, output_csv, window_size, header, st, dedup_cap=None):
+    #returns why the cached state cannot be resumed, or None when it can
+    if manifest is None:
+        return "no manifest"
+    if manifest.get('schema') != SCHEMA_VERSION or manifest.get('columns') != STATE_COLS + BUTTON_COLS:
+        return "schema changed"
+    if manifest.get('window_size') != window_size:
+        return "window size changed"
+    if manifest.get('dedup_cap') != dedup_cap:
+        return "dedup cap changed"
+    if manifest.get('header') != header:
+        return "source header changed"
+    if not os.path.exists(output_csv) or os.path.getsize(output_csv) != manifest.get('output_size'):
+        return "output missing or modified"
+    if st.st_size < manifest['offset']:
+        return "source shrank"
+    return None
+
+def _load_dedup(output_csv, cap, offset):
+    #the saved index, when it covers exactly the processed rows
+    try:
+        dedup = DedupIndex.load(index_path(output_csv), cap)
+    except (OSError, ValueError, KeyError):
+        return None
+    return dedup if dedup.meta.get('offset') == offset else None
+
+def update_windowed_dataset(input_csv, window_size=6, output_csv=None, chunksize=50000, dedup_cap=None):
+    #process only what was appended to input_csv since the last run, or rebuild when that is not safe
+    if output_csv is None:
+        output_csv = default_output_csv(input_csv)
+    mpath = manifest_path(output_csv)
+    manifest = _load_manifest(mpath)
+    st = os.stat(input_csv)
+
+    with open(input_csv, 'rb') as f:
+        header = f.readline().decode().rstrip('\r\n')
+        header_end = f.tell()
+        reason = _resume_point(manifest, input_csv, output_csv, window_size, header, st, dedup_cap)
+        if reason is None and st.st_size == manifest['size'] and st.st_mtime_ns == manifest['mtime_ns']:
+            return {'input': input_csv, 'output': output_csv, 'mode': 'unchanged',
+                    'frames': 0, 'kept': 0, 'windows': 0, 'dropped': 0}
+
+        if reason is None:
+            f.seek(0)
+            hasher, hashed = _hash_prefix(f, manifest['offset'])
+            if hashed != manifest['offset'] or hasher.hexdigest() != manifest['sha1']:
+                reason = "processed rows were modified"
+
+        dedup = None
+        if reason is None and dedup_cap:
+            dedup = _load_dedup(output_csv, dedup_cap, manifest['offset'])
+            if dedup is None:
+                reason = "dedup index missing or out of date"
+
+        if reason is None:
+            mode = 'appended'
+            offset = manifest['offset']
+            carry = {'prev_round_over': manifest['carry']['prev_round_over'],
+                     'last_state': None if manifest['carry']['last_state'] is None else tuple(manifest['carry']['last_state'])}
+            tail = np.array(manifest['tail'], dtype=object).reshape(-1, len(STATE_COLS + BUTTON_COLS))
+            totals = manifest['totals']
+            out_mode = 'a'
+        else:
+            print(f"Rebuilding {os.path.basename(output_csv)}: {reason}")
+            mode = 'rebuilt'
+            f.seek(0)
+            hasher = hashlib.sha1()
+            hasher.update(f.read(header_end))
+            offset = header_end
+            carry = {'prev_round_over': False, 'last_state': None}
+            tail = None
+            totals = {'frames': 0, 'kept': 0, 'windows': 0}
+            dedup = DedupIndex(dedup_cap) if dedup_cap else None
+            out_mode = 'w'
+
+        end = _complete_end(f, st.st_size)
+        f.seek(offset)
+        new_bytes = _ByteRange(f, max(0, end - offset), hasher)
+        with open(output_csv, out_mode, newline='') as out:
+            if out_mode == 'w':
+                pd.DataFrame(columns=window_columns(window_size)).to_csv(out, index=False)
+            stats = {'frames': 0, 'kept': 0, 'windows': 0, 'dropped': 0}
+            if end > offset:
+                reader = pd.read_csv(new_bytes, header=None, names=header.split(','), chunksize=chunksize)
+                stats, tail = stream_windows(reader, out, window_size, carry, tail, dedup)
+
+    for key in totals:
+        totals[key] += stats[key]
+    offset = end if end > offset else offset
+    if dedup is not None:
+        dedup.save(index_path(output_csv), offset=offset)
+    manifest = {
+        'schema': SCHEMA_VERSION,
+        'columns': STATE_COLS + BUTTON_COLS,
+        'window_size': window_size,
+        'dedup_cap': dedup_cap,
+        'source': os.path.basename(input_csv),
+        'header': header,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'offset': offset,
+        'sha1': hasher.hexdigest(),
+        'carry': {'prev_round_over': carry['prev_round_over'],
+                  'last_state': None if carry['last_state'] is None else [_jsonable(v) for v in carry['last_state']]},
+        'tail': [] if tail is None else [[_jsonable(v) for v in row] for row in tail],
+        'totals': totals,
+        'output_size': os.path.getsize(output_csv),
+    }
+    tmp = mpath + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, mpath)
+    repeats = f", {stats['dropped']} repeated windows dropped" if dedup is not None else ''
+    print(f"{os.path.basename(input_csv)} {mode}: {stats['frames']} new frames{repeats}, {stats['windows']} new windows "
+          f"({totals['windows']} total) -> {output_csv}")
+    return {'input': input_csv, 'output': output_csv, 'mode': mode, **stats}
@@ -1,17 +1,71 @@
 import pandas as pd
 import numpy as np
+import argparse
 import glob
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 #define constants
 BUTTONS = ['up', 'down', 'right', 'left', 'y', 'b', 'x', 'a', 'l', 'r']
 STATE_COLS = ['timer','fight_result','has_round_started','is_round_over','player1_id','p1_health','p1_x','p1_y','p1_jumping','p1_crouching','p1_in_move','p1_move_id','player2_id','p2_health','p2_x','p2_y','p2_jumping','p2_crouching','p2_in_move','p2_move_id','diff_x', 'diff_y', 'diff_health']
 BUTTON_COLS = [f'player1_buttons_{b}' for b in BUTTONS] 
 
-def clean_dataset(df):
+def _clean_mask(df, carry=None):
+    #boolean mask of the rows the frame-by-frame rules below keep, computed column-wise
+    #carry holds the rule state at the end of the previous chunk ('prev_round_over', 'last_state')
+    #and is updated in place, so a file cleaned chunk by chunk keeps exactly the same rows
+    if carry is None:
+        carry = {'prev_round_over': False, 'last_state': None}
+    #skip states where both player healths are zero or all positions are zero, they never affect the rules
+    skip = ((df['p1_health'] == 0) & (df['p2_health'] == 0)).to_numpy() | \
+        ((df['p1_x'] == 0) & (df['p1_y'] == 0) & (df['p2_x'] == 0) & (df['p2_y'] == 0)).to_numpy()
+    live = np.flatnonzero(~skip)
+    round_over = (df['is_round_over'] == True).to_numpy()[live]
+
+    #keep only the first of each run of round over frames
+    keep_live = round_over.copy()
+    keep_live[1:] &= ~round_over[:-1]
+    if len(keep_live) and carry['prev_round_over']:
+        keep_live[0] = False
+
+    #keep a normal frame when its state differs from the previous normal frame
+    normal = np.flatnonzero(~round_over)
+    changed = np.zeros(len(normal), dtype=bool)
+    if len(normal):
+        last_state = carry['last_state']
+        changed[0] = last_state is None
+        rows = live[normal]
+        for j, col in enumerate(STATE_COLS):
+            values = df[col].to_numpy()[rows]
+            changed[1:] |= values[1:] != values[:-1]
+            if last_state is not None and values[0] != last_state[j]:
+                changed[0] = True
+        carry['last_state'] = tuple(df[col].iat[rows[-1]] for col in STATE_COLS)
+    keep_live[normal] = changed
+    if len(round_over):
+        carry['prev_round_over'] = bool(round_over[-1])
+
+    mask = np.zeros(len(df), dtype=bool)
+    mask[live] = keep_live
+    return mask
+
+def clean_dataset(df, carry=None, verbose=True):
     initial_size = len(df)
     #drop start and select columns as they are of no use in the model
     df.drop(['player1_buttons_select','player1_buttons_start'], axis=1, inplace=True)
+    clean_df = df[_clean_mask(df, carry)]
+    
+    #report the clean data
+    if verbose:
+        print(f"Original frames: {initial_size}")
+        print(f"After cleaning: {len(clean_df)} ({len(clean_df)/initial_size*100:.1f}% of original)")
+    
+    return clean_df
+
+def _clean_indices_iterrows(df):
+    #original row-by-row rules, kept as the reference the vectorized mask is checked against
     clean_indices = []
     last_state_signature = None
     include_round_end = True  
@@ -35,17 +89,59 @@ def clean_dataset(df):
         if state_signature != last_state_signature:
             clean_indices.append(i)
             last_state_signature = state_signature
-    
-    clean_df = df.loc[clean_indices]
-    
-    #report the clean data
-    print(f"Original frames: {initial_size}")
-    print(f"After cleaning: {len(clean_df)} ({len(clean_df)/initial_size*100:.1f}% of original)")
-    
-    return clean_df
+    return clean_indices
+
+def verify_clean_dataset(files):
+    #compare kept indices and timing of the vectorized and row-by-row cleaning on each file
+    all_equal = True
+    for file in files:
+        df = pd.read_csv(file)
+        t0 = time.perf_counter()
+        reference = _clean_indices_iterrows(df)
+        t1 = time.perf_counter()
+        vectorized = list(df.index[_clean_mask(df)])
+        t2 = time.perf_counter()
+        equal = reference == vectorized
+        all_equal = all_equal and equal
+        print(f"{os.path.basename(file)}: {len(df)} rows, kept {len(vectorized)} | "
+              f"iterrows {t1 - t0:.3f}s, vectorized {t2 - t1:.4f}s ({(t1 - t0) / max(t2 - t1, 1e-9):.0f}x) | "
+              f"{'identical' if equal else 'MISMATCH'}")
+    return all_equal
+
+def window_columns(window_size):
+    feature_names = []
+    for t in range(window_size):
+        suffix = f"t-{window_size - 1 - t}" if window_size > 1 else 't'
+        for col in STATE_COLS + BUTTON_COLS:
+            feature_names.append(f'{col}_{suffix}')
+    target_names = BUTTON_COLS
+    return feature_names + target_names
+
+def window_rows(values, window_size):
+    #values holds the STATE_COLS + BUTTON_COLS of consecutive cleaned frames
+    #row i is frames i..i+window_size-1 flattened, followed by the buttons of the last frame
+    n = len(values) - window_size + 1
+    if n <= 0:
+        return np.empty((0, window_size * values.shape[1] + len(BUTTON_COLS)), dtype=object)
+    blocks = [values[t:t + n] for t in range(window_size)]
+    blocks.append(values[window_size - 1:, -len(BUTTON_COLS):])
+    return np.hstack(blocks)
+
+def default_output_csv(input_csv):
+    base = os.path.basename(input_csv)
+    if base.startswith("normalized_dataset_"):
+        char_id = base[len("normalized_dataset_"):-len(".csv")]
+        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'flattened_window_datasets'))
+        os.makedirs(base_dir, exist_ok=True)
+        return os.path.join(base_dir, f"windowed_dataset_{char_id}.csv")
+    return "windowed_dataset.csv"
 
 #create windows of window size for temporal context to the ANN
-def create_windowed_dataset(input_csv: str, window_size: int = 6, output_csv: str = None):
+def create_windowed_dataset(input_csv: str, window_size: int = 6, output_csv: str = None, chunksize: int = None,
+                            dedup_cap: int = None):
+    #dedup_cap keeps at most that many copies of each window (its frames and buttons), see dedup_index.py
+    if chunksize:
+        return create_windowed_dataset_streaming(input_csv, window_size, output_csv, chunksize, dedup_cap)
     try:
         df = pd.read_csv(input_csv)
         print(f"Loaded input CSV: {input_csv}, shape: {df.shape}")
@@ -53,41 +149,148 @@ def create_windowed_dataset(input_csv: str, window_size: int = 6, output_csv: st
         print(f"Error loading input CSV: {e}")
         return
     
+    initial_size = len(df)
+    dedup = _dedup_index(dedup_cap)
     df = clean_dataset(df)
-    rows = []
+    values = df[STATE_COLS + BUTTON_COLS].values
+    rows = window_rows(values, window_size)
+    if dedup is not None:
+        rows = rows[dedup_windows(values, window_size, dedup)]
+        print(f"Repeated windows dropped: {dedup.dropped} (at most {dedup.cap} of each)")
 
-    for i in range(window_size - 1, len(df)):
-        window = df.iloc[i - window_size + 1:i + 1]
-        features = window[STATE_COLS + BUTTON_COLS].values.flatten()
-        target = window[BUTTON_COLS].iloc[-1].values
-        rows.append(np.concatenate([features, target]))
-
-    feature_names = []
-    for t in range(window_size):
-        suffix = f"t-{window_size - 1 - t}" if window_size > 1 else 't'
-        for col in STATE_COLS + BUTTON_COLS:
-            feature_names.append(f'{col}_{suffix}')
-    target_names = BUTTON_COLS
-    all_cols = feature_names + target_names
-
-    out_df = pd.DataFrame(rows, columns=all_cols)
+    out_df = pd.DataFrame(rows, columns=window_columns(window_size))
     if output_csv is None:
-        base = os.path.basename(input_csv)
-        if base.startswith("normalized_dataset_"):
-            char_id = base[len("normalized_dataset_"):-len(".csv")]
-            base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'flattened_window_datasets'))
-            os.makedirs(base_dir, exist_ok=True)
-            output_csv = os.path.join(base_dir, f"windowed_dataset_{char_id}.csv")
-        else:
-            output_csv = "windowed_dataset.csv"
+        output_csv = default_output_csv(input_csv)
     out_df.to_csv(output_csv, index=False)
     print(f"Windowed dataset saved to {output_csv}, shape: {out_df.shape}")
+    return {'input': input_csv, 'output': output_csv, 'frames': initial_size, 'kept': len(df), 'windows': len(out_df),
+            'dropped': dedup.dropped if dedup else 0}
+
+def _dedup_index(cap):
+    if not cap:
+        return None
+    #imported here, dedup_index builds on this module
+    from dedup_index import DedupIndex
+    return DedupIndex(cap)
 
-def process_all_character_datasets(window_size=6):
+def dedup_windows(values, window_size, dedup):
+    #mask of the window_rows(values, window_size) that dedup (a dedup_index.DedupIndex) keeps; whole windows
+    #are dropped and frames never are, so every kept window is still frames that followed each other
+    from dedup_index import row_signatures, window_signatures
+    frames = row_signatures(pd.DataFrame(values, columns=STATE_COLS + BUTTON_COLS))
+    return dedup.observe(window_signatures(frames, window_size))
+
+def stream_windows(chunks, out, window_size, carry, tail=None, dedup=None):
+    #cleans and windows each chunk, appending the rows to the open csv out
+    #carry and the returned tail (last window_size-1 cleaned frames) continue the stream in a later call,
+    #as does dedup (a dedup_index.DedupIndex) for the repeated windows
+    all_cols = window_columns(window_size)
+    frames_in = frames_kept = windows_out = 0
+    dropped = dedup.dropped if dedup else 0
+    for chunk in chunks:
+        frames_in += len(chunk)
+        clean = clean_dataset(chunk, carry, verbose=False)
+        frames_kept += len(clean)
+        values = clean[STATE_COLS + BUTTON_COLS].values
+        if tail is not None and len(tail):
+            values = np.concatenate([tail, values])
+        rows = window_rows(values, window_size)
+        if dedup is not None and len(rows):
+            rows = rows[dedup_windows(values, window_size, dedup)]
+        if len(rows):
+            pd.DataFrame(rows, columns=all_cols).to_csv(out, index=False, header=False)
+            windows_out += len(rows)
+        tail = values[max(0, len(values) - (window_size - 1)):] if window_size > 1 else values[:0]
+    return {'frames': frames_in, 'kept': frames_kept, 'windows': windows_out,
+            'dropped': dedup.dropped - dropped if dedup else 0}, tail
+
+def create_windowed_dataset_streaming(input_csv: str, window_size: int = 6, output_csv: str = None, chunksize: int = 50000,
+                                      dedup_cap: int = None):
+    #same output as create_windowed_dataset, but memory stays bounded by chunksize however long the recording is:
+    #the cleaning state and the last window_size-1 cleaned frames are carried across chunk boundaries
+    if output_csv is None:
+        output_csv = default_output_csv(input_csv)
+    carry = {'prev_round_over': False, 'last_state': None}
+    try:
+        reader = pd.read_csv(input_csv, chunksize=chunksize)
+        with open(output_csv, 'w', newline='') as out:
+            pd.DataFrame(columns=window_columns(window_size)).to_csv(out, index=False)
+            stats, _ = stream_windows(reader, out, window_size, carry, dedup=_dedup_index(dedup_cap))
+    except Exception as e:
+        print(f"Error processing input CSV in chunks: {e}")
+        return
+    print(f"Streamed {input_csv} in chunks of {chunksize}: {stats['frames']} frames, {stats['kept']} after cleaning")
+    print(f"Windowed dataset saved to {output_csv}, shape: ({stats['windows']}, {len(window_columns(window_size))})")
+    return {'input': input_csv, 'output': output_csv, **stats}
+
+def character_dataset_files():
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'normalized_character_datasets'))
     pattern = os.path.join(base_dir, "normalized_dataset_*.csv")
-    for file in glob.glob(pattern):
-        create_windowed_dataset(file, window_size=window_size)
+    return glob.glob(pattern)
+
+def _process_one(file, window_size, chunksize, incremental=False, dedup_cap=None):
+    #runs in a worker process, any failure is reported back instead of aborting the batch
+    t0 = time.perf_counter()
+    try:
+        if incremental:
+            #imported here, preprocess_cache builds on this module
+            from preprocess_cache import update_windowed_dataset
+            stats = update_windowed_dataset(file, window_size=window_size, chunksize=chunksize or 50000, dedup_cap=dedup_cap)
+        else:
+            stats = create_windowed_dataset(file, window_size=window_size, chunksize=chunksize, dedup_cap=dedup_cap)
+        if stats is None:
+            raise RuntimeError("dataset could not be loaded")
+        stats['ok'] = True
+    except Exception as e:
+        stats = {'input': file, 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+    stats['seconds'] = time.perf_counter() - t0
+    return stats
+
+def print_summary(results, wall_seconds):
+    print(f"\n{'dataset':<28}{'frames':>9}{'kept':>9}{'repeats':>9}{'windows':>9}{'seconds':>9}  mode")
+    for r in sorted(results, key=lambda r: os.path.basename(r['input'])):
+        name = os.path.basename(r['input'])
+        if r['ok']:
+            print(f"{name:<28}{r['frames']:>9}{r['kept']:>9}{r.get('dropped', 0):>9}{r['windows']:>9}{r['seconds']:>9.2f}  "
+                  f"{r.get('mode', 'full')}")
+        else:
+            print(f"{name:<28}  FAILED after {r['seconds']:.2f}s: {r['error']}")
+    failed = sum(not r['ok'] for r in results)
+    busy = sum(r['seconds'] for r in results)
+    print(f"{len(results) - failed} processed, {failed} failed | wall {wall_seconds:.2f}s, summed {busy:.2f}s")
+
+def process_all_character_datasets(window_size=6, chunksize=None, workers=1, incremental=False, dedup_cap=None):
+    #largest files first so the longest job is not the one left running at the end
+    files = sorted(character_dataset_files(), key=os.path.getsize, reverse=True)
+    t0 = time.perf_counter()
+    if workers == 1:
+        results = [_process_one(file, window_size, chunksize, incremental, dedup_cap) for file in files]
+    else:
+        results = []
+        with ProcessPoolExecutor(max_workers=workers or None) as pool:
+            futures = {pool.submit(_process_one, file, window_size, chunksize, incremental, dedup_cap): file for file in files}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    #the worker itself died (e.g. out of memory)
+                    results.append({'input': futures[future], 'ok': False, 'seconds': 0.0, 'error': f"{type(e).__name__}: {e}"})
+    print_summary(results, time.perf_counter() - t0)
+    return results
 
 if __name__ == "__main__":
-    process_all_character_datasets(window_size=6)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Clean and window the normalized character datasets")
+    parser.add_argument('--window-size', type=int, default=6)
+    parser.add_argument('--chunksize', type=int, default=None, help="stream each dataset in chunks of this many rows with bounded memory")
+    parser.add_argument('--workers', type=int, default=1, help="process characters in parallel, 0 uses every core")
+    parser.add_argument('--incremental', action='store_true', help="only process rows appended since the last run, see preprocess_cache.py")
+    parser.add_argument('--dedup', type=int, default=None, metavar='CAP',
+                        help="keep at most CAP copies of each window (frames and buttons) across the whole recording, see dedup_index.py")
+    parser.add_argument('--verify-clean', action='store_true', help="check the vectorized cleaning against the row-by-row rules and time both")
+    args = parser.parse_args()
+
+    if args.verify_clean:
+        sys.exit(0 if verify_clean_dataset(sorted(character_dataset_files())) else 1)
+    results = process_all_character_datasets(window_size=args.window_size, chunksize=args.chunksize, workers=args.workers,
+                                             incremental=args.incremental, dedup_cap=args.dedup)
+    sys.exit(0 if all(r['ok'] for r in results) else 1)
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from preprocess_windows import STATE_COLS, BUTTON_COLS
+
+#compact binary copy of a flattened windowed csv for training
+#features are stored by dtype group (booleans and fight_result as uint8, small integers as int16,
+#move ids as int32) in .npy files that are memory-mapped, so opening a dataset reads nothing and a
+#batch only touches the pages of its rows. labels are uint8.
+FORMAT_VERSION = 1
+FIGHT_MAP = {'NOT_OVER': 0, 'P1': 1, 'P2': 2}
+BOOL_MAP = {False: 0, True: 1, 'False': 0, 'True': 1}
+STATE_DTYPES = {
+    'timer': 'int16', 'fight_result': 'uint8', 'has_round_started': 'uint8', 'is_round_over': 'uint8',
+    'player1_id': 'int16', 'p1_health': 'int16', 'p1_x': 'int16', 'p1_y': 'int16',
+    'p1_jumping': 'uint8', 'p1_crouching': 'uint8', 'p1_in_move': 'uint8', 'p1_move_id': 'int32',
+    'player2_id': 'int16', 'p2_health': 'int16', 'p2_x': 'int16', 'p2_y': 'int16',
+    'p2_jumping': 'uint8', 'p2_crouching': 'uint8', 'p2_in_move': 'uint8', 'p2_move_id': 'int32',
+    'diff_x': 'int16', 'diff_y': 'int16', 'diff_health': 'int16',
+}
+
+def feature_columns(window_size=6):
+    #the FEATURE_COLS order of train_individual_character.py, oldest frame first
+    return [f'{feat}_t-{t}' for t in range(window_size - 1, -1, -1) for feat in STATE_COLS]
+
+def default_typed_dir(csv_path):
+    return os.path.splitext(csv_path)[0] + '.typed'
+
+def _count_rows(csv_path):
+    rows = 0
+    last = b''
+    with open(csv_path, 'rb') as f:
+        while True:
+            block = f.read(1 << 22)
+            if not block:
+                break
+            rows += block.count(b'\n')
+            last = block[-1:]
+    if not last:
+        raise ValueError(f"{csv_path} is empty, expected at least the header line")
+    #header line, and a last row without a trailing newline still counts
+    return rows - 1 + (last != b'\n')
+
+def _encode(values, col, dtype):
+    base = col.rsplit('_t-', 1)[0]
+    if base == 'fight_result':
+        values = values.map(FIGHT_MAP)
+    elif values.dtype == object or values.dtype == bool:
+        values = values.map(BOOL_MAP)
+    if values.isna().any():
+        raise ValueError(f"{col} has values that cannot be encoded")
+    info = np.iinfo(dtype)
+    if values.min() < info.min or values.max() > info.max:
+        raise ValueError(f"{col} does not fit in {dtype} ({values.min()}..{values.max()})")
+    return values.to_numpy(dtype=dtype)
+
+def convert_windowed_csv(csv_path, out_dir=None, window_size=6, chunksize=50000):
+    #one streaming pass over the csv, memory is bounded by chunksize
+    out_dir = out_dir or default_typed_dir(csv_path)
+    os.makedirs(out_dir, exist_ok=True)
+    cols = feature_columns(window_size)
+    groups = {}
+    for col in cols:
+        groups.setdefault(STATE_DTYPES[col.rsplit('_t-', 1)[0]], []).append(col)
+    n = _count_rows(csv_path)
+
+    arrays = {dtype: open_memmap(os.path.join(out_dir, f'features_{dtype}.npy'), mode='w+', dtype=dtype, shape=(n, len(names)))
+              for dtype, names in groups.items()}
+    labels = open_memmap(os.path.join(out_dir, 'labels.npy'), mode='w+', dtype='uint8', shape=(n, len(BUTTON_COLS)))
+    start = 0
+    for chunk in pd.read_csv(csv_path, usecols=cols + BUTTON_COLS, chunksize=chunksize):
+        stop = start + len(chunk)
+        for dtype, names in groups.items():
+            arrays[dtype][start:stop] = np.column_stack([_encode(chunk[c], c, dtype) for c in names])
+        labels[start:stop] = np.column_stack([_encode(chunk[c], c, 'uint8') for c in BUTTON_COLS])
+        start = stop
+    if start != n:
+        raise ValueError(f"expected {n} rows in {csv_path}, read {start}")
+    for a in list(arrays.values()) + [labels]:
+        a.flush()
+    del arrays, labels
+
+    st = os.stat(csv_path)
+    meta = {'version': FORMAT_VERSION, 'rows': n, 'window_size': window_size,
+            'feature_cols': cols, 'label_cols': BUTTON_COLS, 'groups': groups,
+            'source': os.path.basename(csv_path), 'source_size': st.st_size, 'source_mtime_ns': st.st_mtime_ns}
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return out_dir
+
+def is_current(out_dir, csv_path):
+    #true when out_dir was converted from csv_path as it is now
+    try:
+        with open(os.path.join(out_dir, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    st = os.stat(csv_path)
+    return (meta.get('version') == FORMAT_VERSION and meta.get('source_size') == st.st_size
+            and meta.get('source_mtime_ns') == st.st_mtime_ns)
+
+class TypedWindows:
+    #memory-mapped features, indexed like the (windows, features) arrays of window_views:
+    #data[idx] gathers the rows of idx in feature_cols order, as float64 by default because
+    #move ids above 2**24 are not exact in float32
+    def __init__(self, path, dtype=np.float64):
+        self.dtype = dtype
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError(f"{path} is format {meta['version']}, expected {FORMAT_VERSION}; convert it again")
+        self.path = path
+        self.feature_cols = meta['feature_cols']
+        self.label_cols = meta['label_cols']
+        position = {c: i for i, c in enumerate(self.feature_cols)}
+        self._groups = [(np.load(os.path.join(path, f'features_{dtype}.npy'), mmap_mode='r'),
+                         np.array([position[c] for c in names]))
+                        for dtype, names in meta['groups'].items()]
+        self.labels = np.load(os.path.join(path, 'labels.npy'), mmap_mode='r')
+        self.shape = (meta['rows'], len(self.feature_cols))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        idx = np.atleast_1d(np.arange(self.shape[0])[idx] if isinstance(idx, slice) else idx)
+        out = np.empty((len(idx), self.shape[1]), dtype=self.dtype)
+        for arr, positions in self._groups:
+            out[:, positions] = arr[idx]
+        return out
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr, _ in self._groups) + self.labels.nbytes
+
+def verify(csv_path, data, sample=2000, seed=0):
+    #gathered rows must equal the encoded csv values exactly
+    df = pd.read_csv(csv_path, usecols=data.feature_cols + data.label_cols)
+    idx = np.sort(np.random.default_rng(seed).choice(len(df), size=min(sample, len(df)), replace=False))
+    expected = np.column_stack([_encode(df[c], c, 'int64') for c in data.feature_cols])
+    labels = df[data.label_cols].astype(int).to_numpy()
+    return np.array_equal(data[idx], expected[idx]) and np.array_equal(data.labels[idx], labels[idx])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert flattened windowed csvs to memory-mapped typed arrays")
+    parser.add_argument('--characters', type=int, nargs='+', help="character ids, defaults to every windowed csv")
+    parser.add_argument('--window-size', type=int, default=6)
+    parser.add_argument('--chunksize', type=int, default=50000)
+    parser.add_argument('--verify', action='store_true', help="compare a sample of gathered rows with the csv")
+    args = parser.parse_args()
+
+    base = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'flattened_window_datasets'))
+    if args.characters:
+        files = [os.path.join(base, f'windowed_dataset_{cid}.csv') for cid in args.characters]
+    else:
+        files = sorted(f for f in os.listdir(base) if f.startswith('windowed_dataset_') and f.endswith('.csv'))
+        files = [os.path.join(base, f) for f in files]
+    for csv_path in files:
+        if not os.path.exists(csv_path):
+            print(f"Skipping {csv_path} - not found")
+            continue
+        t0 = time.perf_counter()
+        out_dir = convert_windowed_csv(csv_path, window_size=args.window_size, chunksize=args.chunksize)
+        data = TypedWindows(out_dir)
+        print(f"{os.path.basename(csv_path)}: {len(data)} rows in {time.perf_counter() - t0:.1f}s, "
+              f"{os.path.getsize(csv_path) / 1e6:.1f} MB csv -> {data.nbytes / 1e6:.1f} MB typed ({out_dir})")
+        if args.verify:
+            print(f"  gathered rows match the csv: {verify(csv_path, data)}")
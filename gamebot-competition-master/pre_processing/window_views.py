@@ -0,0 +1,94 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import as_strided
+from preprocess_windows import STATE_COLS, BUTTON_COLS, clean_dataset, character_dataset_files
+
+#windows as strided views over the cleaned per-character frames instead of flattened csv rows
+#row i of window_view(frames, w) is frames[i:i+w].ravel(), oldest frame first, which is the
+#FEATURE_COLS order used by train_individual_character.py and bot.py
+FIGHT_MAP = {'NOT_OVER': 0, 'P1': 1, 'P2': 2}
+
+def encode_states(df, dtype=np.float64):
+    #numeric (frames, len(STATE_COLS)) array, fight_result mapped and booleans as 0/1
+    frames = np.empty((len(df), len(STATE_COLS)), dtype=dtype)
+    for j, col in enumerate(STATE_COLS):
+        values = df[col]
+        if col == 'fight_result':
+            values = values.map(FIGHT_MAP)
+        elif values.dtype == object:
+            values = values.map({False: 0, True: 1, 'False': 0, 'True': 1})
+        frames[:, j] = values.to_numpy(dtype=dtype)
+    return frames
+
+def window_view(frames, window_size):
+    #consecutive frames of a C-contiguous array are adjacent in memory, so every window is
+    #one contiguous run of window_size * n_features values and the 2d view needs no copy
+    frames = np.ascontiguousarray(frames)
+    n_windows = max(len(frames) - window_size + 1, 0)
+    step = frames.strides[0]
+    return as_strided(frames, shape=(n_windows, window_size * frames.shape[1]),
+                      strides=(step, frames.strides[1]), writeable=False)
+
+def window_targets(buttons, window_size):
+    #the target of a window is the button state of its last frame
+    return buttons[window_size - 1:]
+
+def load_character_windows(input_csv, window_size=6, dtype=np.float64, dedup=None):
+    #clean one normalized dataset and return (X, y), X being a read-only view over the frames
+    #with dedup (a dedup_index.DedupIndex) the windows over its cap are left out, and X is a copy of the others
+    df = clean_dataset(pd.read_csv(input_csv))
+    frames = encode_states(df, dtype)
+    buttons = df[BUTTON_COLS].to_numpy(dtype=np.float32)
+    X, y = window_view(frames, window_size), window_targets(buttons, window_size)
+    if dedup is not None:
+        from preprocess_windows import dedup_windows
+        keep = dedup_windows(df[STATE_COLS + BUTTON_COLS].values, window_size, dedup)
+        X, y = X[keep], y[keep]
+    return X, y
+
+def report_savings(input_csv, window_sizes=(6, 12, 30, 60)):
+    #compare the iloc/flatten loop of create_windowed_dataset with the strided view
+    df = clean_dataset(pd.read_csv(input_csv))
+    cols = STATE_COLS + BUTTON_COLS
+    results = []
+    for w in window_sizes:
+        t0 = time.perf_counter()
+        rows = [df.iloc[i - w + 1:i + 1][cols].values.flatten() for i in range(w - 1, len(df))]
+        t1 = time.perf_counter()
+        frames = encode_states(df)
+        X = window_view(frames, w)
+        t2 = time.perf_counter()
+        #the loop holds object arrays (8 byte pointers) on top of the scalars they point to
+        loop_bytes = sum(r.nbytes for r in rows)
+        results.append({
+            'window_size': w,
+            'windows': len(X),
+            'loop_seconds': t1 - t0,
+            'view_seconds': t2 - t1,
+            'loop_bytes': loop_bytes,
+            'materialized_bytes': X.size * X.itemsize,
+            'view_bytes': frames.nbytes,
+        })
+        del rows
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and time of strided window views against the flattened rows")
+    parser.add_argument('--input', help="normalized_dataset csv, defaults to the largest shipped dataset")
+    parser.add_argument('--window-sizes', type=int, nargs='+', default=[6, 12, 30, 60])
+    args = parser.parse_args()
+
+    input_csv = args.input or max(character_dataset_files(), key=os.path.getsize)
+    print(f"Dataset: {input_csv}")
+    csv_path = os.path.join(os.path.dirname(__file__), '..', 'flattened_window_datasets',
+                            os.path.basename(input_csv).replace('normalized_dataset_', 'windowed_dataset_'))
+    if os.path.exists(csv_path):
+        print(f"Flattened csv on disk: {os.path.getsize(csv_path) / 1e6:.1f} MB")
+    for r in report_savings(input_csv, args.window_sizes):
+        print(f"window {r['window_size']:>3}: {r['windows']} windows | "
+              f"loop {r['loop_seconds']:.2f}s, {r['loop_bytes'] / 1e6:.1f} MB | "
+              f"view {r['view_seconds'] * 1000:.1f} ms, {r['view_bytes'] / 1e6:.2f} MB "
+              f"(a float64 copy would be {r['materialized_bytes'] / 1e6:.1f} MB)")
@@ -0,0 +1,195 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+
+#trains smaller students on the soft outputs (logits) of each models/model_<id>.keras over the character's
+#windows, sweeps a few sizes and reports per-frame latency against decision agreement with the teacher
+#(decided with bot.resolve_buttons, the threshold and conflict rules of Bot.fight):
+#  python train_models/distill_models.py                              every model that has a dataset
+#  python train_models/distill_models.py --characters 7 --sizes 64,32 32 --min-agreement 0.98
+#  python train_models/distill_models.py --characters 7 --install     replace model_7 by its chosen student
+#chosen students are written to models/students/ in the models/ layout (.keras, .keras.scaler, .npz), so
+#SF_MODEL_DIR=../models/students python controller.py "1" "bot" "npz" runs them without changes
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(ROOT, 'pre_processing'))
+sys.path.append(os.path.join(ROOT, 'PythonAPI'))
+
+from bot import resolve_buttons
+from evaluate_models import dataset_path, load_dataset
+from fast_inference import QUANTIZATIONS, NumpyMLP, save_artifact
+from model_registry import MODEL_DIR, N_CHARACTERS, model_path
+from quantize_models import quantize
+from train_individual_character import backup
+
+STUDENT_DIR = os.path.join(MODEL_DIR, 'students')
+#hidden layer widths of the swept students, the teacher is 256-128-64
+SIZES = ((128, 64), (64, 32), (32, 16), (32,), (16,))
+
+def parse_size(spec):
+    #"64,32" -> (64, 32)
+    return tuple(int(h) for h in spec.split(','))
+
+def build_student(n_features, n_outputs, hidden, output='sigmoid'):
+    #output='linear' is the logit head the student is trained with, the saved student gets the sigmoid back
+    import tensorflow as tf
+    from tensorflow.keras import layers, models
+    model = models.Sequential([layers.Input(shape=(n_features,))] +
+                              [layers.Dense(h, activation='relu') for h in hidden] +
+                              [layers.Dense(n_outputs, activation=output)])
+    #the bot presses at p > 0.005 (a logit of -5.3), where binary crossentropy on the teacher's probabilities
+    #hardly sees a difference, so the student regresses the teacher's logits instead (distillation at high temperature)
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-3), loss='mse')
+    return model
+
+def latency_ms(mlp, X, n_frames=2000):
+    #one frame per call, as in the bot loop
+    times = np.empty(min(n_frames, len(X)))
+    for i in range(len(times)):
+        x = X[i:i + 1]
+        t0 = time.perf_counter()
+        mlp.predict(x)
+        times[i] = time.perf_counter() - t0
+    return times * 1000
+
+def predict(mlp, X, batch_size=8192):
+    return np.concatenate([mlp.predict(X[i:i + batch_size]).copy() for i in range(0, len(X), batch_size)])
+
+def compare(mlp, X_val, y_val, teacher_pressed, n_frames):
+    #latency of mlp and agreement of its decisions with the teacher's on the held-out windows
+    pressed = resolve_buttons(predict(mlp, X_val))
+    ms = latency_ms(mlp, X_val, n_frames)
+    return {
+        'params': int(sum(w.size + b.size for w, b in zip(mlp.weights, mlp.biases))),
+        'weights_kb': mlp.nbytes / 1e3,
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'combo_agreement': float((pressed == teacher_pressed).all(axis=1).mean()),
+        'button_agreement': float((pressed == teacher_pressed).mean()),
+        'combo_accuracy': float((pressed == y_val).all(axis=1).mean()),
+    }
+
+def distill(character_id, sizes=SIZES, epochs=100, source='windows', min_agreement=0.95, max_accuracy_drop=0.01,
+            n_frames=2000, out_dir=STUDENT_DIR, seed=42):
+    #trains one student per size and returns the report rows; the smallest student that makes the teacher's
+    #per-button decision on at least min_agreement of the held-out windows and whose exact-combo accuracy on the
+    #recorded buttons is at most max_accuracy_drop below the teacher's is saved to out_dir
+    import joblib
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(seed)
+    teacher_path = model_path(character_id)
+    teacher = tf.keras.models.load_model(teacher_path)
+    scaler = joblib.load(teacher_path + '.scaler')
+    with contextlib.redirect_stdout(io.StringIO()):
+        X, y = load_dataset(dataset_path(character_id, source), source)
+    X = np.ascontiguousarray(X, dtype=np.float32)
+
+    #every window is a training example, the teacher labels the ones without presses too
+    rng = np.random.default_rng(seed)
+    idx = rng.permutation(len(X))
+    n_val = len(X) // 5
+    val, train = np.sort(idx[:n_val]), idx[n_val:]
+    teacher_mlp = NumpyMLP.from_keras(teacher, scaler)
+    teacher_pressed = resolve_buttons(predict(teacher_mlp, X[val]))
+    #the same network without the final sigmoid
+    logits = predict(NumpyMLP(teacher_mlp.weights, teacher_mlp.biases, teacher_mlp.activations[:-1] + ['linear']), X)
+    X_scaled = ((X - scaler.mean_) / scaler.scale_).astype(np.float32)
+
+    rows = [{'character': character_id, 'student': 'teacher', 'hidden': [int(l.units) for l in teacher.layers[:-1]
+                                                                          if type(l).__name__ == 'Dense'],
+             'epochs': 0, 'train_s': 0.0, **compare(teacher_mlp, X[val], y[val], teacher_pressed, n_frames)}]
+    floor = rows[0]['combo_accuracy'] - max_accuracy_drop
+    chosen = None
+    for hidden in sizes:
+        trainer = build_student(X.shape[1], logits.shape[1], hidden, output='linear')
+        early = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
+        t0 = time.perf_counter()
+        history = trainer.fit(X_scaled[train], logits[train], validation_data=(X_scaled[val], logits[val]),
+                              epochs=epochs, batch_size=256, callbacks=[early], verbose=0)
+        train_s = time.perf_counter() - t0
+        student = build_student(X.shape[1], logits.shape[1], hidden)
+        student.set_weights(trainer.get_weights())
+        mlp = NumpyMLP.from_keras(student, scaler)
+        row = {'character': character_id, 'student': 'x'.join(map(str, hidden)), 'hidden': list(hidden),
+               'epochs': len(history.history['loss']), 'train_s': train_s,
+               **compare(mlp, X[val], y[val], teacher_pressed, n_frames)}
+        rows.append(row)
+        if (row['button_agreement'] >= min_agreement and row['combo_accuracy'] >= floor
+                and (chosen is None or row['params'] < chosen[0]['params'])):
+            chosen = (row, student)
+    if chosen is not None:
+        row, student = chosen
+        row['chosen'] = True
+        os.makedirs(out_dir, exist_ok=True)
+        dst = model_path(character_id, out_dir)
+        student.save(dst)
+        shutil.copy2(teacher_path + '.scaler', dst + '.scaler')
+        save_artifact(model_path(character_id, out_dir, backend='npz'), student, scaler)
+    return rows
+
+def install(character_id, student_dir=STUDENT_DIR, model_dir=MODEL_DIR):
+    #the student replaces model_<id>; every teacher file (model, scaler, npz, int8 and fp16) is kept as .prev,
+    #which train_individual_character.py --rollback restores
+    quantized = [model_path(character_id, model_dir, q) for q in QUANTIZATIONS]
+    requantize = any(os.path.exists(p) for p in quantized)
+    backup(model_path(character_id, model_dir))
+    #the teacher's int8 and fp16 variants would keep running under those backends
+    for p in quantized:
+        if os.path.exists(p):
+            os.remove(p)
+    for backend in ('keras', 'npz'):
+        src, dst = model_path(character_id, student_dir, backend), model_path(character_id, model_dir, backend)
+        paths = [(src, dst)] + ([(src + '.scaler', dst + '.scaler')] if backend == 'keras' else [])
+        for s, d in paths:
+            shutil.copy2(s, d)
+    if requantize:
+        quantize(character_id, model_dir)
+    print(f"Installed the student as {model_path(character_id, model_dir)} (teacher kept as .prev)"
+          + ("; int8 and fp16 variants rebuilt from it" if requantize else ""))
+
+def print_rows(rows):
+    print(f"{'model':<9}{'student':<13}{'params':>8}{'weights KB':>12}{'p50 ms':>9}{'p99 ms':>9}{'combo agree':>13}"
+          f"{'button agree':>14}{'combo acc':>11}{'epochs':>8}{'train s':>9}")
+    for r in rows:
+        print(f"model_{r['character']:<3}{r['student']:<13}{r['params']:>8}{r['weights_kb']:>12.0f}{r['p50_ms']:>9.4f}"
+              f"{r['p99_ms']:>9.4f}{r['combo_agreement']:>13.2%}{r['button_agreement']:>14.3%}{r['combo_accuracy']:>11.2%}"
+              f"{r['epochs']:>8}{r['train_s']:>9.1f}{'  <- saved' if r.get('chosen') else ''}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Distill the character models into smaller students")
+    parser.add_argument('--characters', type=int, nargs='+', default=list(range(N_CHARACTERS)))
+    parser.add_argument('--sizes', type=parse_size, nargs='+', default=list(SIZES), metavar='H1,H2',
+                        help="hidden layer widths of each student, e.g. 64,32 32")
+    parser.add_argument('--epochs', type=int, default=100, help="upper bound, training stops when the validation loss stalls")
+    parser.add_argument('--source', choices=['windows', 'csv', 'typed'], default='windows')
+    parser.add_argument('--min-agreement', type=float, default=0.95,
+                        help="per-button agreement with the teacher a student needs to be saved")
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01,
+                        help="how far below the teacher's combo accuracy on the recorded buttons a saved student may be")
+    parser.add_argument('--frames', type=int, default=2000, help="single-frame calls timed per network")
+    parser.add_argument('--install', action='store_true', help="replace models/model_<id> by the saved student")
+    parser.add_argument('--json', help="write the table rows to this file")
+    args = parser.parse_args()
+
+    rows = []
+    for cid in args.characters:
+        if not os.path.exists(model_path(cid)) or not os.path.exists(dataset_path(cid, args.source)):
+            print(f"=== Skipping character {cid} - model or dataset not found ===")
+            continue
+        print(f"=== Distilling model_{cid} ===", flush=True)
+        result = distill(cid, args.sizes, args.epochs, args.source,
+                         args.min_agreement, args.max_accuracy_drop, args.frames)
+        rows += result
+        if not any(r.get('chosen') for r in result):
+            print(f"No student of model_{cid} met the agreement and accuracy bounds, nothing saved")
+        elif args.install:
+            install(cid)
+    print_rows(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+#offline evaluation of the trained models: batched prediction over a character's windows, decided with the
+#same conflict resolution and threshold as Bot.fight, compared with the buttons that were actually pressed
+#  python train_models/evaluate_models.py                      every model that has a dataset
+#  python train_models/evaluate_models.py --characters 7 --input my_held_out_recording.csv
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(ROOT, 'pre_processing'))
+sys.path.append(os.path.join(ROOT, 'PythonAPI'))
+
+from bot import BUTTONS, FEATURE_COLS, PRESS_THRESHOLD, WINDOW_SIZE, resolve_buttons
+from model_registry import N_CHARACTERS, load_model, model_path
+
+NORMALIZED_DIR = os.path.join(ROOT, 'normalized_character_datasets')
+WINDOWED_DIR = os.path.join(ROOT, 'flattened_window_datasets')
+BOOL_MAP = {False: 0, True: 1, 'False': 0, 'True': 1}
+FIGHT_MAP = {'NOT_OVER': 0, 'P1': 1, 'P2': 2}
+
+def dataset_path(character_id, source='windows'):
+    if source == 'windows':
+        return os.path.join(NORMALIZED_DIR, f'normalized_dataset_{character_id}.csv')
+    return os.path.join(WINDOWED_DIR, f'windowed_dataset_{character_id}.csv')
+
+def load_windowed_csv(csv_path):
+    #(X, y) from a flattened windowed csv, encoded the way train_model encodes it
+    import pandas as pd
+    label_cols = [f'player1_buttons_{b.lower()}' for b in BUTTONS]
+    df = pd.read_csv(csv_path, usecols=FEATURE_COLS + label_cols)
+    X = np.empty((len(df), len(FEATURE_COLS)), dtype=np.float64)
+    for j, col in enumerate(FEATURE_COLS):
+        values = df[col]
+        if col.startswith('fight_result'):
+            values = values.map(FIGHT_MAP)
+        elif values.dtype == object:
+            values = values.map(BOOL_MAP)
+        X[:, j] = values.to_numpy(dtype=np.float64)
+    return X, df[label_cols].astype(bool).to_numpy()
+
+def load_dataset(path, source='windows'):
+    #normalized recordings are cleaned and windowed in memory, windowed csvs are read as they are
+    if source == 'windows':
+        from window_views import load_character_windows
+        X, y = load_character_windows(path, WINDOW_SIZE)
+        return X, y.astype(bool)
+    if source == 'typed':
+        from typed_windows import TypedWindows, convert_windowed_csv, default_typed_dir, is_current
+        typed = default_typed_dir(path)
+        if not is_current(typed, path):
+            convert_windowed_csv(path, typed, WINDOW_SIZE)
+        X = TypedWindows(typed)
+        return X[:], np.asarray(X.labels, dtype=bool)
+    return load_windowed_csv(path)
+
+def predict(loaded, X, backend, batch_size=8192):
+    #button probabilities for every row; keras gets the scaled rows, the numpy backends fold the scaler in
+    if backend == 'keras':
+        return loaded.model.predict(loaded.scaler.transform(X), batch_size=batch_size, verbose=0)
+    return np.concatenate([loaded.mlp.predict(X[i:i + batch_size]) for i in range(0, len(X), batch_size)])
+
+def score(pressed, y):
+    #per-button precision/recall and exact-combo accuracy of the decided buttons against the recorded ones
+    tp = (pressed & y).sum(axis=0)
+    predicted = pressed.sum(axis=0)
+    actual = y.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = np.where(predicted > 0, tp / predicted, np.nan)
+        recall = np.where(actual > 0, tp / actual, np.nan)
+    return {
+        'rows': len(y),
+        'exact_combo_accuracy': float((pressed == y).all(axis=1).mean()),
+        'button_accuracy': float((pressed == y).mean()),
+        'buttons': {b: {'precision': float(precision[i]), 'recall': float(recall[i]),
+                        'support': int(actual[i]), 'predicted': int(predicted[i])}
+                    for i, b in enumerate(BUTTONS)},
+    }
+
+def evaluate(character_id, data_path, source='windows', backend='keras', threshold=PRESS_THRESHOLD):
+    t0 = time.perf_counter()
+    X, y = load_dataset(data_path, source)
+    t1 = time.perf_counter()
+    loaded = load_model(model_path(character_id, backend=backend), backend, character_id, warm=False)
+    t2 = time.perf_counter()
+    preds = predict(loaded, X, backend)
+    pressed = resolve_buttons(preds, threshold)
+    t3 = time.perf_counter()
+    result = score(pressed, y)
+    result.update({'character': character_id, 'data': data_path, 'backend': backend, 'load_data_s': t1 - t0,
+                   'load_model_s': t2 - t1, 'predict_s': t3 - t2, 'rows_per_s': len(y) / (t3 - t2)})
+    return result
+
+def print_result(r):
+    print(f"\n=== Character {r['character']} ({r['backend']}) - {r['rows']} windows from {os.path.basename(r['data'])} ===")
+    print(f"exact combo accuracy {r['exact_combo_accuracy']:.1%} | per-button accuracy {r['button_accuracy']:.1%} | "
+          f"{r['rows_per_s']:,.0f} windows/s (data {r['load_data_s']:.2f}s, model {r['load_model_s']:.2f}s, predict {r['predict_s']:.2f}s)")
+    print(f"{'button':<8}{'precision':>10}{'recall':>9}{'support':>9}{'predicted':>11}")
+    for b, m in r['buttons'].items():
+        print(f"{b:<8}{m['precision']:>10.1%}{m['recall']:>9.1%}{m['support']:>9}{m['predicted']:>11}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate trained character models offline")
+    parser.add_argument('--characters', type=int, nargs='+', default=list(range(N_CHARACTERS)))
+    parser.add_argument('--source', choices=['windows', 'csv', 'typed'], default='windows',
+                        help="windows cleans and windows normalized_character_datasets in memory, csv and typed read flattened_window_datasets")
+    parser.add_argument('--input', help="evaluate on this file instead (e.g. a held-out normalized recording), needs one --characters id")
+    parser.add_argument('--backend', choices=['keras', 'numpy', 'npz', 'int8', 'fp16'], default='keras')
+    parser.add_argument('--threshold', type=float, default=PRESS_THRESHOLD)
+    parser.add_argument('--json', help="write every result to this file")
+    args = parser.parse_args()
+    if args.input and len(args.characters) != 1:
+        parser.error("--input needs exactly one --characters id")
+
+    results = []
+    t0 = time.perf_counter()
+    for cid in args.characters:
+        data = args.input or dataset_path(cid, args.source)
+        if not os.path.exists(model_path(cid, backend=args.backend)) or not os.path.exists(data):
+            print(f"\n=== Skipping character {cid} - model or dataset not found ===")
+            continue
+        results.append(evaluate(cid, data, args.source, args.backend, args.threshold))
+        print_result(results[-1])
+
+    rows = sum(r['rows'] for r in results)
+    print(f"\nEvaluated {len(results)} models on {rows} windows in {time.perf_counter() - t0:.1f}s")
+    for r in results:
+        print(f"  character {r['character']:>2}: exact combo {r['exact_combo_accuracy']:.1%} over {r['rows']} windows")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,5 +1,11 @@
+import argparse
+import glob
+import math
 import os
+import shutil
+import sys
 import joblib
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
@@ -9,20 +15,43 @@ from tensorflow.keras import layers, models, callbacks
 #defining constants
 WINDOW_SIZE = 6
 STATE_FEATURES = ['timer', 'fight_result', 'has_round_started', 'is_round_over','player1_id', 'p1_health', 'p1_x', 'p1_y', 'p1_jumping', 'p1_crouching', 'p1_in_move', 'p1_move_id','player2_id', 'p2_health', 'p2_x', 'p2_y', 'p2_jumping', 'p2_crouching', 'p2_in_move', 'p2_move_id','diff_x', 'diff_y', 'diff_health']
+def window_suffixes(window_size=WINDOW_SIZE):
+    #column suffix of each frame of a window, oldest first, as preprocess_windows.py names them
+    return [f"_t-{t}" for t in range(window_size - 1, -1, -1)] if window_size > 1 else ['_t']
+
+def feature_columns(window_size=WINDOW_SIZE):
+    return [feat + suffix for suffix in window_suffixes(window_size) for feat in STATE_FEATURES]
+
 #make a features array for model to know what are the features
-FEATURE_COLS = []
-for t in range(WINDOW_SIZE-1, -1, -1):
-    suffix = f"_t-{t}"
-    for feat in STATE_FEATURES:
-        FEATURE_COLS.append(feat + suffix)
+FEATURE_COLS = feature_columns()
 BUTTONS = ['up', 'down', 'right', 'left', 'y', 'b', 'x', 'a', 'l', 'r']
 #buttons to be predicted by the model
 P1_BUTTON_COLS = [f'player1_buttons_{b}' for b in BUTTONS]
+#strided window views are built by the preprocessing code
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'pre_processing')))
 
+def build_model(n_features, n_outputs):
+    model = models.Sequential([
+        layers.Input(shape=(n_features,)),
+        layers.Dense(256, activation='relu'),
+        layers.Dropout(0.3),
+        layers.Dense(128, activation='relu'),
+        layers.Dropout(0.2),
+        layers.Dense(64, activation='relu'),
+        layers.Dense(n_outputs, activation='sigmoid')])
+    #compile model with adam optimizer and binary crossentropy loss
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-4),loss='binary_crossentropy',metrics=['binary_accuracy'])
+    return model
 
-def train_model(csv_path: str, model_path: str):
+
+def train_model(csv_path: str, model_path: str, epochs: int = 50, balance: float = None, extra_callbacks: list = None,
+                window_size: int = WINDOW_SIZE):
     #load dataset
     df = pd.read_csv(csv_path)
+    if balance:
+        #cap every button's press ratio at balance before the positive/negative sampling
+        from balance_classes import report
+        df = df.iloc[report(df[P1_BUTTON_COLS].to_numpy(), balance)]
 
     #select rows where buttons are pressed
     df_pos = df[df[P1_BUTTON_COLS].sum(axis=1) > 0]
@@ -38,16 +67,17 @@ def train_model(csv_path: str, model_path: str):
     #encoding the features
     FIGHT_MAP = {'NOT_OVER': 0, 'P1': 1, 'P2': 2}
     BOOL_MAP = {False: 0, True: 1, 'False': 0, 'True': 1}
-    for t in range(WINDOW_SIZE):
+    feature_cols = feature_columns(window_size)
+    for suffix in window_suffixes(window_size):
         # map fight_result
-        col_fr = f'fight_result_t-{t}'
+        col_fr = f'fight_result{suffix}'
         df[col_fr] = df[col_fr].map(FIGHT_MAP)
         # map booleans
         for bf in ['has_round_started','is_round_over','p1_jumping','p1_crouching','p1_in_move','p2_jumping','p2_crouching','p2_in_move']:
-            col_b = f'{bf}_t-{t}'
+            col_b = f'{bf}{suffix}'
             df[col_b] = df[col_b].map(BOOL_MAP)
 
-    X = df[FEATURE_COLS]
+    X = df[feature_cols]
     y = df[P1_BUTTON_COLS].astype(int)
 
     #split data into 80% train and 20% test
@@ -63,41 +93,292 @@ def train_model(csv_path: str, model_path: str):
     #give more weight to samples with button presses
     sample_weight = (y_train.sum(axis=1) > 0).astype(float) * 4 + 1
 
-    model = models.Sequential([
-        layers.Input(shape=(len(FEATURE_COLS),)),
-        layers.Dense(256, activation='relu'),
-        layers.Dropout(0.3),
-        layers.Dense(128, activation='relu'),
-        layers.Dropout(0.2),
-        layers.Dense(64, activation='relu'),
-        layers.Dense(len(P1_BUTTON_COLS), activation='sigmoid')])
-    #compile model with adam optimizer and binary crossentropy loss
-    model.compile(optimizer=tf.keras.optimizers.Adam(1e-4),loss='binary_crossentropy',metrics=['binary_accuracy'])
+    model = build_model(len(feature_cols), len(P1_BUTTON_COLS))
 
     #checkpoint to only save the best model based on highest validation accuracy
     ckpt = callbacks.ModelCheckpoint(filepath=model_path,monitor='val_binary_accuracy',mode='max',save_best_only=True,verbose=1)
 
     #train the model
-    model.fit(X_train_scaled, y_train,sample_weight=sample_weight,validation_data=(X_val_scaled, y_val),epochs=50,batch_size=128,callbacks=[ckpt])
+    model.fit(X_train_scaled, y_train,sample_weight=sample_weight,validation_data=(X_val_scaled, y_val),epochs=epochs,batch_size=128,callbacks=[ckpt] + (extra_callbacks or []))
     print(f"Training done. Best model at {model_path}")
 
 
+class WindowBatches(tf.keras.utils.PyDataset):
+    #feeds keras from a window view: only the rows of the current batch are gathered and scaled
+    def __init__(self, X, y, indices, scaler, batch_size=128, weighted=False, shuffle=False, seed=42, **kwargs):
+        super().__init__(**kwargs)
+        self.X, self.y = X, y
+        self.indices = np.array(indices)
+        self.mean = scaler.mean_
+        self.scale = scaler.scale_
+        self.batch_size = batch_size
+        self.weighted = weighted
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        if shuffle:
+            self.rng.shuffle(self.indices)
+
+    def __len__(self):
+        return math.ceil(len(self.indices) / self.batch_size)
+
+    def __getitem__(self, i):
+        #sorted so a memory-mapped X is read front to back, the order inside a batch does not matter
+        idx = np.sort(self.indices[i * self.batch_size:(i + 1) * self.batch_size])
+        xb = ((self.X[idx] - self.mean) / self.scale).astype(np.float32)
+        yb = np.asarray(self.y[idx], dtype=np.float32)
+        if not self.weighted:
+            return xb, yb
+        #give more weight to samples with button presses
+        return xb, yb, (yb.sum(axis=1) > 0).astype(np.float32) * 4 + 1
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.indices)
+
+def prefetched(batches):
+    #tf.data pipeline over a WindowBatches, batches are gathered on a background thread while the
+    #previous step trains, and the generator is restarted (reshuffled) every epoch
+    def generate():
+        for i in range(len(batches)):
+            yield batches[i]
+        batches.on_epoch_end()
+    signature = [tf.TensorSpec((None, batches.X.shape[1]), tf.float32), tf.TensorSpec((None, batches.y.shape[1]), tf.float32)]
+    if batches.weighted:
+        signature.append(tf.TensorSpec((None,), tf.float32))
+    return tf.data.Dataset.from_generator(generate, output_signature=tuple(signature)).prefetch(tf.data.AUTOTUNE)
+
+def select_training_rows(y, seed=42, rows=None):
+    #same 2:1 positive to negative sampling and 80/20 split as train_model, on row indices
+    #rows restricts the sampling to a subset, e.g. the selection of balance_classes.select_rows
+    rng = np.random.default_rng(seed)
+    rows = np.arange(len(y)) if rows is None else rows
+    pressed = y[rows].sum(axis=1) > 0
+    pos = rows[pressed]
+    neg_all = rows[~pressed]
+    neg = rng.choice(neg_all, size=min(len(neg_all), len(pos) * 2), replace=False)
+    idx = np.concatenate([pos, neg])
+    rng.shuffle(idx)
+    return train_test_split(idx, test_size=0.2, random_state=seed, shuffle=True)
+
+def _columns_of(X):
+    #feature names for the window size X was built with (--window-size), so the scaler records them
+    return feature_columns(X.shape[1] // len(STATE_FEATURES))
+
+def fit_scaler(X, indices, chunk_size=8192):
+    #fitted chunk by chunk so the training windows are never copied out all at once
+    scaler = StandardScaler()
+    for start in range(0, len(indices), chunk_size):
+        chunk = pd.DataFrame(X[np.sort(indices[start:start + chunk_size])], columns=_columns_of(X))
+        scaler.partial_fit(chunk)
+    return scaler
+
+def train_model_from_windows(X, y, model_path: str, epochs: int = 50, prefetch: bool = False, balance: float = None):
+    #X is a (windows, window_size * len(STATE_FEATURES)) view from window_views or a memory-mapped TypedWindows,
+    #y the matching button targets
+    rows = None
+    if balance:
+        from balance_classes import report
+        rows = report(y, balance)
+    train_idx, val_idx = select_training_rows(y, rows=rows)
+    scaler = fit_scaler(X, train_idx)
+    joblib.dump(scaler, model_path + '.scaler')
+    print(f"Saved scaler to {model_path}.scaler")
+
+    train_data = WindowBatches(X, y, train_idx, scaler, weighted=True, shuffle=True)
+    val_data = WindowBatches(X, y, val_idx, scaler)
+    if prefetch:
+        train_data, val_data = prefetched(train_data), prefetched(val_data)
+    model = build_model(X.shape[1], y.shape[1])
+    ckpt = callbacks.ModelCheckpoint(filepath=model_path,monitor='val_binary_accuracy',mode='max',save_best_only=True,verbose=1)
+    model.fit(train_data, validation_data=val_data, epochs=epochs, callbacks=[ckpt])
+    print(f"Training done. Best model at {model_path}")
+
+def update_scaler(scaler, X, indices, chunk_size=8192):
+    #continues the running mean and variance of a fitted scaler with the rows of X at indices (StandardScaler.partial_fit)
+    #and returns the (mean, scale) it had before
+    old = scaler.mean_.copy(), scaler.scale_.copy()
+    for start in range(0, len(indices), chunk_size):
+        scaler.partial_fit(pd.DataFrame(X[np.sort(indices[start:start + chunk_size])], columns=_columns_of(X)))
+    return old
+
+def rescale_first_layer(model, old_mean, old_scale, new_mean, new_scale):
+    #keeps the model's outputs unchanged when its inputs are normalized with the updated scaler instead:
+    #(x - m0) / s0 = (x - m1) / s1 * (s1 / s0) + (m1 - m0) / s0
+    dense = next(layer for layer in model.layers if type(layer).__name__ == 'Dense')
+    w, b = dense.get_weights()
+    dense.set_weights([w * (new_scale / old_scale)[:, None], b + ((new_mean - old_mean) / old_scale) @ w])
+
+#artifacts exported from model_<id>.keras (PythonAPI/export_models.py and quantize_models.py)
+DERIVED_EXTENSIONS = ('npz', 'int8.npz', 'fp16.npz')
+
+def rollback_paths(model_path):
+    #every file of one model version as (current, .prev): the model, its scaler and the exported artifacts
+    base = model_path[:-len('.keras')] if model_path.endswith('.keras') else model_path
+    paths = [model_path, model_path + '.scaler'] + [f'{base}.{ext}' for ext in DERIVED_EXTENSIONS]
+    return [(p, p + '.prev') for p in paths]
+
+def backup(model_path):
+    #keeps the current version as .prev before it is replaced (a fine-tune here, distill_models.py --install);
+    #a .prev of an artifact that no longer exists is removed so --rollback never mixes two versions
+    for current, prev in rollback_paths(model_path):
+        if os.path.exists(current):
+            shutil.copy2(current, prev)
+        elif os.path.exists(prev):
+            os.remove(prev)
+
+def rollback(model_path):
+    for current, prev in rollback_paths(model_path)[:2]:
+        if not os.path.exists(prev):
+            raise FileNotFoundError(f"No previous version to roll back to: {prev}")
+    restored = []
+    for current, prev in rollback_paths(model_path):
+        if os.path.exists(prev):
+            shutil.copy2(prev, current)
+            restored.append(os.path.basename(current))
+    print(f"Restored {', '.join(restored)} from .prev")
+
+def finetune_model(X_new, y_new, X_old, y_old, model_path: str, epochs: int = 5, replay: float = 1.0,
+                   learning_rate: float = 2e-5, seed: int = 42):
+    #warm start from model_path: trains on the new windows plus a replay sample of replay * (new rows) old windows, so the
+    #model keeps what it learned; the scaler is updated with the new rows and the first layer compensated, so training
+    #starts from exactly the previous model. The model (and scaler) are only replaced when the validation accuracy on
+    #new + old rows improves on the previous model; the previous files are then kept as .prev
+    model = tf.keras.models.load_model(model_path)
+    scaler = joblib.load(model_path + '.scaler')
+
+    rng = np.random.default_rng(seed)
+    new_train, new_val = select_training_rows(y_new, seed)
+    old_train, old_val = select_training_rows(y_old, seed)
+    n_replay = min(len(old_train), int(round(replay * len(new_train))))
+    old_train = np.sort(rng.choice(old_train, size=n_replay, replace=False))
+    old_val = np.sort(rng.choice(old_val, size=min(len(old_val), len(new_val)), replace=False))
+    print(f"Fine-tuning on {len(new_train)} new + {len(old_train)} replayed windows, validating on {len(new_val)} new + {len(old_val)} old")
+
+    old_mean, old_scale = update_scaler(scaler, X_new, new_train)
+    rescale_first_layer(model, old_mean, old_scale, scaler.mean_, scaler.scale_)
+
+    #only the sampled rows are copied, so memory follows the size of the new session, not of the whole dataset
+    X = np.concatenate([X_new[np.sort(new_train)], X_old[old_train], X_new[np.sort(new_val)], X_old[old_val]])
+    y = np.concatenate([y_new[np.sort(new_train)], y_old[old_train], y_new[np.sort(new_val)], y_old[old_val]]).astype(np.float32)
+    n_train = len(new_train) + len(old_train)
+    train_data = WindowBatches(X, y, np.arange(n_train), scaler, weighted=True, shuffle=True, seed=seed)
+    val_data = WindowBatches(X, y, np.arange(n_train, len(X)), scaler)
+    new_val_data = WindowBatches(X, y, np.arange(n_train, n_train + len(new_val)), scaler)
+    old_val_data = WindowBatches(X, y, np.arange(n_train + len(new_val), len(X)), scaler)
+
+    def accuracies():
+        return {name: model.evaluate(data, verbose=0, return_dict=True)['binary_accuracy']
+                for name, data in (('val', val_data), ('new', new_val_data), ('old', old_val_data))}
+    before = accuracies()
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate), loss='binary_crossentropy', metrics=['binary_accuracy'])
+    #the checkpoint only holds weights for the updated scaler, so both are written next to the live files
+    #and swapped in together once training is over; an interrupted run leaves the live model untouched
+    tmp_model = model_path[:-len('.keras')] + '.finetune.keras'
+    tmp_scaler = model_path + '.scaler.finetune'
+    ckpt = callbacks.ModelCheckpoint(filepath=tmp_model, monitor='val_binary_accuracy', mode='max', save_best_only=True,
+                                     initial_value_threshold=before['val'], verbose=1)
+    try:
+        model.fit(train_data, validation_data=val_data, epochs=epochs, callbacks=[ckpt])
+        improved = ckpt.best > before['val']
+        if improved:
+            model = tf.keras.models.load_model(tmp_model)
+            joblib.dump(scaler, tmp_scaler)
+            backup(model_path)
+            os.replace(tmp_scaler, model_path + '.scaler')
+            os.replace(tmp_model, model_path)
+    finally:
+        for p in (tmp_model, tmp_scaler):
+            if os.path.exists(p):
+                os.remove(p)
+    after = accuracies() if improved else before
+    print(f"Validation accuracy new rows {before['new']:.4f} -> {after['new']:.4f}, old rows {before['old']:.4f} -> {after['old']:.4f}")
+    if improved:
+        print(f"Saved fine-tuned model to {model_path}, previous version in {model_path}.prev; "
+              f"re-run PythonAPI/export_models.py and quantize_models.py for the numpy backends")
+    else:
+        print(f"No improvement, kept the previous model")
+    return {'improved': bool(improved), 'new_rows': len(new_train), 'replay_rows': len(old_train), 'before': before, 'after': after}
+
+def new_sessions(character_id, model_path, normalized_dir):
+    #session recordings (SF_RECORD_ROTATE=1) written after the model was last trained
+    since = os.path.getmtime(model_path)
+    pattern = os.path.join(normalized_dir, 'sessions', '*', f'normalized_dataset_{character_id}.csv')
+    return sorted(p for p in glob.glob(pattern) if os.path.getmtime(p) > since)
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train one model per character")
     #set this according to the characters you want to train
-    characters_to_train = [7,10] 
+    parser.add_argument('--characters', type=int, nargs='+', default=[7, 10])
+    parser.add_argument('--source', choices=['csv', 'windows', 'typed'], default='csv',
+                        help="csv reads flattened_window_datasets, windows builds strided views straight from normalized_character_datasets, "
+                             "typed memory-maps the binary copy of the windowed csv (converted on first use, see pre_processing/typed_windows.py)")
+    parser.add_argument('--window-size', type=int, default=WINDOW_SIZE)
+    parser.add_argument('--epochs', type=int, default=None, help="default 50, or 5 with --finetune")
+    parser.add_argument('--balance', type=float, default=None, metavar='THRESHOLD',
+                        help="cap every button's press ratio at THRESHOLD (e.g. 0.55) with balance_classes before sampling, the dataset is not rewritten")
+    parser.add_argument('--dedup', type=int, default=None, metavar='CAP',
+                        help="with --source windows keep at most CAP copies of each window (its frames and buttons), dropping the rest whole, "
+                             "see pre_processing/dedup_index.py (for csv and typed run preprocess_windows.py --dedup CAP)")
+    parser.add_argument('--finetune', action='store_true',
+                        help="warm-start the existing model_<id>.keras on new recordings plus a replay sample of normalized_dataset_<id>.csv")
+    parser.add_argument('--new', nargs='+', metavar='CSV',
+                        help="normalized recordings to fine-tune on, default the sessions/ recordings newer than the model")
+    parser.add_argument('--replay', type=float, default=1.0, help="old windows replayed per new window when fine-tuning")
+    parser.add_argument('--learning-rate', type=float, default=2e-5, help="Adam learning rate when fine-tuning")
+    parser.add_argument('--rollback', action='store_true', help="restore model_<id>.keras and its scaler from .prev")
+    args = parser.parse_args()
+    epochs = args.epochs or (5 if args.finetune else 50)
 
     #get file paths for datasets and where to save the models
     base = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'flattened_window_datasets'))
+    normalized = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'normalized_character_datasets'))
     out = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models'))
     os.makedirs(out, exist_ok=True)
     #process only specific characters using their datasets
-    for cid in characters_to_train:
-        fn = f'windowed_dataset_{cid}.csv'
-        if not os.path.exists(os.path.join(base, fn)):
+    for cid in args.characters:
+        mdl = os.path.join(out, f'model_{cid}.keras')
+        if args.rollback:
+            rollback(mdl)
+            continue
+        if args.finetune:
+            from window_views import load_character_windows
+            old_csv = os.path.join(normalized, f'normalized_dataset_{cid}.csv')
+            new_csvs = args.new or new_sessions(cid, mdl, normalized)
+            if not new_csvs:
+                print(f"\n=== Skipping character {cid} - no recordings newer than {mdl} ===")
+                continue
+            print(f"\n=== Fine-tuning character {cid} on {len(new_csvs)} recording(s) ===")
+            new = [load_character_windows(p, args.window_size) for p in new_csvs]
+            X_new = np.concatenate([X for X, _ in new])
+            y_new = np.concatenate([y for _, y in new])
+            X_old, y_old = load_character_windows(old_csv, args.window_size)
+            finetune_model(X_new, y_new, X_old, y_old, mdl, epochs, args.replay, args.learning_rate)
+            continue
+        if args.source == 'windows':
+            inp = os.path.join(normalized, f'normalized_dataset_{cid}.csv')
+        else:
+            inp = os.path.join(base, f'windowed_dataset_{cid}.csv')
+        if not os.path.exists(inp):
             print(f"\n=== Skipping character {cid} - dataset not found ===")
             continue
-            
-        inp = os.path.join(base, fn)
-        mdl = os.path.join(out, f'model_{cid}.keras')
+
         print(f"\n=== Training character {cid} ===")
-        train_model(inp, mdl)
\ No newline at end of file
+        if args.source == 'windows':
+            from window_views import load_character_windows
+            dedup = None
+            if args.dedup:
+                from dedup_index import DedupIndex
+                dedup = DedupIndex(args.dedup)
+            X, y = load_character_windows(inp, args.window_size, dedup=dedup)
+            if dedup is not None:
+                print(dedup.summary())
+            train_model_from_windows(X, y, mdl, epochs, balance=args.balance)
+        elif args.source == 'typed':
+            from typed_windows import TypedWindows, convert_windowed_csv, default_typed_dir, is_current
+            typed = default_typed_dir(inp)
+            if not is_current(typed, inp):
+                convert_windowed_csv(inp, typed, args.window_size)
+            X = TypedWindows(typed)
+            train_model_from_windows(X, X.labels, mdl, epochs, prefetch=True, balance=args.balance)
+        else:
+            train_model(inp, mdl, epochs, balance=args.balance, window_size=args.window_size)